@@ -1,14 +1,20 @@
-from fastapi import APIRouter, HTTPException
-from typing import Literal
+from fastapi import APIRouter, HTTPException, Request, Response
+from typing import Literal, Optional
 
-from app.models import SystemState
+from app.models import SystemState, DeviceCommand, BatchStep
 from app.services.state_service import StateService
+from app.services.command_service import get_command_service
+from app.services.state_projection import StateProjection
+from app.encoding import accepts_msgpack, encoded_response, negotiated_response, pack
 
 router = APIRouter()
 
 # Initialize singleton service
 state_service = StateService()
 
+# 设备指令等待上限 (秒)
+COMMAND_WAIT_TIMEOUT = 10.0
+
 @router.get("/health")
 async def health_check():
     return {"status": "ok", "service": "AutoLine Monitor"}
@@ -19,10 +25,38 @@ async def clear_logs():
     state_service.clear_operation_logs()
     return {"message": "Operation logs cleared"}
 
-@router.get("/state")
-async def get_state() -> SystemState:
-    """Return the full system state."""
-    return state_service.get_state()
+@router.get(
+    "/state",
+    response_class=Response,
+    responses={200: {
+        "model": SystemState,
+        "description": "SystemState JSON (gzip/br per Accept-Encoding). Projections return only the selected line, sections and fields.",
+    }},
+)
+async def get_state(
+    request: Request,
+    line_id: Optional[str] = None,
+    include: Optional[str] = None,
+    exclude: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    """
+    Return the system state (latest published generation).
+    
+    - line_id: only this line and the carts located in it
+    - include / exclude: optional sections `logs`, `steps`, `mes` (comma separated)
+    - fields: sparse field paths, e.g. `timestamp,lines.id,lines.anodeChambers.temperature`
+    
+    Each projection is serialized once per generation and cached, together with
+    its compressed variants (negotiated via Accept-Encoding).
+    """
+    generation = state_service.get_generation()
+    try:
+        projection = StateProjection(line_id, include, exclude, fields)
+        content = generation.project(projection)
+    except ValueError as e:
+        raise HTTPException(status_code=404 if line_id and 'Line' in str(e) else 400, detail=str(e))
+    return encoded_response(request, content.encode('utf-8'), cache=generation.variants, cache_key=projection.key)
 
 @router.post("/cart/{cart_id}/move")
 async def move_cart(cart_id: str, direction: Literal["forward", "backward"], operator_name: str = "Admin", operator_role: str = "admin"):
@@ -42,7 +76,7 @@ async def create_line(type: str, name: str):
         raise HTTPException(status_code=400, detail=str(e))
 
 from pydantic import BaseModel
-from typing import List, Optional, Any
+from typing import Dict, List, Optional, Any
 
 class UpdateLineRequest(BaseModel):
     name: str
@@ -107,14 +141,22 @@ async def control_valve(
     valve_name: str,
     action: Literal["open", "close"],
     operator_name: str = "Admin",
-    operator_role: str = "admin"
+    operator_role: str = "admin",
+    wait: bool = False
 ):
-    """Open or close a specific valve."""
+    """Open or close a specific valve. Returns a command id; pass wait=true to block until the stroke ends."""
+    command_service = get_command_service()
     try:
-        state_service.toggle_valve(line_id, chamber_id, valve_name, action, operator_name, operator_role)
+        command = command_service.submit_valve(line_id, chamber_id, valve_name, action, operator_name, operator_role)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
-    return {"message": f"Valve {valve_name} in {chamber_id} set to {action}"}
+    if wait:
+        command = await command_service.wait_for(command.id, timeout=COMMAND_WAIT_TIMEOUT)
+    return {
+        "message": f"Valve {valve_name} in {chamber_id} set to {action}",
+        "commandId": command.id,
+        "status": command.status,
+    }
 
 @router.post("/pump/{line_id}/{chamber_id}/{pump_name}")
 async def control_pump(
@@ -123,14 +165,46 @@ async def control_pump(
     pump_name: str,
     action: Literal["on", "off"],
     operator_name: str = "Admin",
-    operator_role: str = "admin"
+    operator_role: str = "admin",
+    wait: bool = False
 ):
-    """Control a pump (molecular or roughing)."""
+    """Control a pump (molecular or roughing). Returns a command id; pass wait=true to block until done."""
+    command_service = get_command_service()
     try:
-        state_service.toggle_pump(line_id, chamber_id, pump_name, action, operator_name, operator_role)
+        command = command_service.submit_pump(line_id, chamber_id, pump_name, action, operator_name, operator_role)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
-    return {"message": f"Pump {pump_name} in {chamber_id} set to {action}"}
+    if wait:
+        command = await command_service.wait_for(command.id, timeout=COMMAND_WAIT_TIMEOUT)
+    return {
+        "message": f"Pump {pump_name} in {chamber_id} set to {action}",
+        "commandId": command.id,
+        "status": command.status,
+    }
+
+class BatchCommandRequest(BaseModel):
+    steps: List[BatchStep]
+    mode: Literal["atomic", "ordered"] = "atomic"
+
+@router.post("/commands/batch")
+def run_batch_commands(request: BatchCommandRequest, operator_name: str = "Admin", operator_role: str = "admin"):
+    """批量执行阀门/泵/小车移动序列：一次请求、一次写事务、一条汇总日志"""
+    if not request.steps:
+        raise HTTPException(status_code=400, detail="Empty batch")
+    applied, results = get_command_service().submit_batch(request.steps, request.mode, operator_name, operator_role)
+    return {"applied": applied, "mode": request.mode, "results": results}
+
+@router.get("/commands/{command_id}")
+async def get_command(command_id: str, wait: bool = False, timeout: float = COMMAND_WAIT_TIMEOUT) -> DeviceCommand:
+    """查询设备指令状态；wait=true 时等待指令结束（最多 timeout 秒）"""
+    command_service = get_command_service()
+    if wait:
+        command = await command_service.wait_for(command_id, timeout=min(timeout, COMMAND_WAIT_TIMEOUT))
+    else:
+        command = command_service.get_command(command_id)
+    if not command:
+        raise HTTPException(status_code=404, detail="Command not found")
+    return command
 
 class CreateCartRequest(BaseModel):
     lineId: str
@@ -181,34 +255,151 @@ async def get_snapshot_range():
 
 @router.get("/history/snapshots/multi_line")
 @router.get("/history/snapshots/at")
-async def get_snapshot_at(timestamp: float):
-    """获取指定时间点的状态总揽（聚合快照）"""
+async def get_snapshot_at(request: Request, timestamp: float):
+    """获取指定时间点的状态总揽（聚合快照），支持 MessagePack 与压缩协商"""
     history_service = get_history_service()
     data = history_service.get_snapshot(timestamp)
     if not data:
         raise HTTPException(status_code=404, detail="No snapshot found for this time")
     
-    import json
-    return json.loads(data)
+    if accepts_msgpack(request.headers.get('accept')):
+        import json
+        return encoded_response(request, pack(json.loads(data)), media_type="application/x-msgpack")
+    # 快照本身就是 JSON，直接发送，免去一次解析/序列化
+    return encoded_response(request, data.encode('utf-8'))
 
 @router.get("/history/{entity_id}")
 async def get_history(
+    request: Request,
     entity_id: str,
     metric: Literal["temperature", "vacuum"],
     start_time: float,
     end_time: float
 ):
-    """查询历史记录"""
+    """查询历史记录；Accept: application/x-msgpack 时返回列式二进制 (timestamp[] / value[])"""
     history_service = get_history_service()
     data = history_service.query_data(entity_id, metric, start_time, end_time)
-    return {"entity_id": entity_id, "metric": metric, "data": data}
+    columnar = {
+        "entity_id": entity_id,
+        "metric": metric,
+        "timestamp": [row['timestamp'] for row in data],
+        "value": [row['value'] for row in data],
+    }
+    return negotiated_response(request, {"entity_id": entity_id, "metric": metric, "data": data}, columnar)
 
 @router.get("/history/events/all")
-async def get_events(start_time: float, end_time: float):
+async def get_events(request: Request, start_time: float, end_time: float):
     """获取指定时间段内的系统事件"""
     history_service = get_history_service()
     events = history_service.query_events(start_time, end_time)
-    return events
+    return negotiated_response(request, events)
+
+from app.services.clock_service import get_clock
+from app.services.ingest_aggregator import get_ingest_aggregator
+
+@router.get("/history/aggregates/{entity_id}")
+async def get_history_aggregates(
+    request: Request,
+    entity_id: str,
+    metric: Literal["temperature", "vacuum"],
+    start_time: float,
+    end_time: float
+):
+    """查询预聚合历史 (每个时间桶的 min / max / mean / last / count)"""
+    data = get_history_service().query_aggregates(entity_id, metric, start_time, end_time)
+    return negotiated_response(request, {"entity_id": entity_id, "metric": metric, "data": data})
+
+@router.get("/history/raw/{entity_id}")
+async def get_history_raw(
+    request: Request,
+    entity_id: str,
+    metric: Literal["temperature", "vacuum"],
+    start_time: float,
+    end_time: float
+):
+    """查询报警/故障前后抓取的原始样本"""
+    data = get_history_service().query_raw(entity_id, metric, start_time, end_time)
+    return negotiated_response(request, {"entity_id": entity_id, "metric": metric, "data": data})
+
+class RawCaptureRequest(BaseModel):
+    entityIds: List[str]
+    reason: str = "manual"
+
+@router.post("/history/raw/capture")
+async def capture_raw_samples(req: RawCaptureRequest):
+    """手动触发原始样本抓取（触发前后各 rawCaptureSeconds 秒）"""
+    if not req.entityIds:
+        raise HTTPException(status_code=400, detail="entityIds must not be empty")
+    captured = get_ingest_aggregator().capture(req.entityIds, get_clock().now(), req.reason)
+    return {"captured": captured}
+
+@router.get("/history/ingest/status")
+async def get_ingest_status():
+    """获取预聚合写入层的状态与指标"""
+    return get_ingest_aggregator().get_status()
+
+# ==================== 报警 API ====================
+
+from app.services.alarm_engine import get_alarm_engine
+from app.services.alarm_history import get_alarm_history
+
+class AlarmActionRequest(BaseModel):
+    alarmIds: Optional[List[str]] = None   # 为空表示全部
+
+@router.get("/alarms")
+async def get_alarms(request: Request, since_version: Optional[int] = None):
+    """当前报警列表；since_version 与当前版本相同时只返回版本号（列表未变化）"""
+    version, alarms = get_alarm_engine().get_alarms()
+    if since_version is not None and since_version == version:
+        return {"version": version, "changed": False}
+    return negotiated_response(request, {"version": version, "changed": True, "alarms": alarms})
+
+@router.get("/alarms/events")
+async def get_alarm_events(request: Request, after: int = 0, limit: int = 200):
+    """序号大于 after 的报警状态变化事件"""
+    return negotiated_response(request, get_alarm_engine().events_since(after, limit))
+
+@router.get("/alarms/status")
+async def get_alarm_status():
+    """报警引擎状态：规则数、评估次数与耗时"""
+    return get_alarm_engine().get_status()
+
+@router.get("/alarms/summary")
+async def get_alarm_summary():
+    """各线体按级别的当前报警数与各腔体 MTBF（内存中维护，不查库）"""
+    return get_alarm_history().get_summary()
+
+@router.get("/alarms/history")
+async def get_alarm_history_records(
+    request: Request,
+    start_time: Optional[float] = None,
+    end_time: Optional[float] = None,
+    entity_id: Optional[str] = None,
+    line_id: Optional[str] = None,
+    active_only: bool = False,
+    limit: int = 500
+):
+    """查询报警记录：当前未结束 (active_only) / 按腔体或小车 / 按线体 / 按时间段"""
+    records = get_history_service().query_alarms(start_time, end_time, entity_id, line_id, active_only, max(1, min(limit, 5000)))
+    return negotiated_response(request, records)
+
+@router.post("/alarms/ack")
+async def acknowledge_alarms(req: AlarmActionRequest):
+    """确认报警"""
+    try:
+        return {"acknowledged": get_alarm_engine().acknowledge(req.alarmIds)}
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+
+@router.post("/alarms/clear")
+async def clear_alarms(req: AlarmActionRequest):
+    """清除已恢复的锁存报警"""
+    try:
+        return {"cleared": get_alarm_engine().clear(req.alarmIds)}
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 # ==================== 系统设置 API ====================
 
@@ -225,7 +416,35 @@ async def get_settings() -> SystemSettings:
 async def update_settings(settings: SystemSettings) -> SystemSettings:
     """更新系统设置"""
     service = SettingsService()
-    return service.update_settings(settings)
+    updated = service.update_settings(settings)
+    state_service.set_log_capacity(updated.data.logCapacity)
+    return updated
+
+# ==================== 数据采集 API ====================
+
+from app.services.acquisition_service import get_acquisition_service
+
+@router.get("/acquisition/status")
+async def get_acquisition_status():
+    """采集循环状态：当前协议、周期耗时、错误与重连退避、驱动指标"""
+    return get_acquisition_service().get_status()
+
+@router.post("/acquisition/standin/start")
+def start_acquisition_standin():
+    """按当前协议启动本地替身服务（用仿真驱动的当前拓扑副本提供读数，便于离线联调）"""
+    try:
+        return get_acquisition_service().start_standin()
+    except (ValueError, OSError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/acquisition/standin/stop")
+def stop_acquisition_standin():
+    """停止本地替身服务"""
+    try:
+        get_acquisition_service().stop_standin()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"message": "Stand-in stopped"}
 
 # ==================== 工艺配方 API ====================
 
@@ -267,30 +486,10 @@ async def delete_recipe(recipe_id: str):
 # ==================== 仿真设置 API ====================
 
 from app.models import SimulationConfig, FaultType
-from app.services.simulation_service import SimulationService
-
-# Helper to access the singleton simulation service instance
-# Since it was initialized in state_service or just a global instance?
-# In main.py or similar, it should be initialized. 
-# Looking at api.py line 10: state_service = StateService()
-# SimulationService usually uses StateService. Let's create a singleton accessor or instance here.
-# For simplicity, we can instantiate it, but we need to ensure it's the SAME instance that is running the thread?
-# Wait, SimulationService starts a thread. If I make a new instance here, is it the same?
-# SimulationService seems designed to be singleton-ish or held by main app.
-# Let's check main.py... oh we didn't read main.py.
-# Usually in FastAPI we use dependency injection or a global var. 
-# Let's assume we can use a global instance here like state_service.
-# We need to make sure `state_service` in api.py leads us to the right place. 
-# Actually, let's redefine SimulationService usage. 
-# Ideally, we should have `simulation_service = SimulationService()` at module level if it has state.
-# But `state_service` is already there. Does `state_service` hold `simulation_service`? No.
-# Let's instantiate it globally here for now, assuming api.py is imported once.
-simulation_service = SimulationService()
-
-@router.on_event("startup")
-async def startup_event():
-    # Auto start simulation loop on startup
-    simulation_service.start()
+from app.services.simulation_service import get_simulation_service
+
+# 仿真引擎全局唯一，启动/关闭由 main.py 的 lifespan 负责
+simulation_service = get_simulation_service()
 
 @router.get("/settings/simulation")
 async def get_simulation_config() -> SimulationConfig:
@@ -300,6 +499,55 @@ async def get_simulation_config() -> SimulationConfig:
 async def update_simulation_config(config: SimulationConfig) -> SimulationConfig:
     return simulation_service.update_config(config)
 
+@router.get("/simulation/status")
+async def get_simulation_status():
+    """仿真引擎状态：生命周期、tick 频率、延迟与实体数量"""
+    return simulation_service.get_status()
+
+@router.post("/simulation/start")
+def start_simulation():
+    simulation_service.start()
+    return simulation_service.get_status()
+
+@router.post("/simulation/pause")
+def pause_simulation():
+    try:
+        simulation_service.pause()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return simulation_service.get_status()
+
+@router.post("/simulation/resume")
+def resume_simulation():
+    try:
+        simulation_service.resume()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return simulation_service.get_status()
+
+@router.post("/simulation/step")
+def step_simulation(count: int = 1, dt: Optional[float] = None):
+    """暂停/停止状态下单步推进 count 个 tick（dt 为每步虚拟秒数）"""
+    if simulation_service.status == 'running':
+        raise HTTPException(status_code=400, detail="Pause the simulation before stepping")
+    try:
+        return simulation_service.step(count, dt)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/simulation/stop")
+def stop_simulation():
+    simulation_service.stop()
+    return simulation_service.get_status()
+
+@router.get("/simulation/carts/{cart_id}/progress")
+async def get_cart_progress(cart_id: str):
+    """按读取时刻精确计算小车工艺进度、剩余时间与后续工序事件"""
+    progress = simulation_service.observe_cart(cart_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Cart not found or has no process plan")
+    return progress
+
 @router.post("/simulation/fault")
 async def inject_fault(type: FaultType, line_id: str, chamber_id: str):
     return simulation_service.inject_fault(type, line_id, chamber_id)
@@ -309,6 +557,119 @@ async def clear_faults():
     simulation_service.clear_faults()
     return {"message": "All faults cleared"}
 
+class FastForwardRequest(BaseModel):
+    duration: float                          # 快进的虚拟时长 (秒)，如 24h 烘烤周期为 86400
+    step: Optional[float] = None             # 仿真步长 (虚拟秒)
+    startTime: Optional[float] = None        # 起点 (epoch 秒)，回填历史时设为过去时刻
+    recordInterval: Optional[float] = None   # 历史记录间隔 (虚拟秒)
+    recordHistory: bool = True
+
+@router.post("/simulation/fast-forward")
+def fast_forward_simulation(request: FastForwardRequest):
+    """快进 (headless) 仿真：不 sleep，按 CPU 能力推进虚拟时间（同步执行，在线程池中运行）"""
+    try:
+        return simulation_service.fast_forward(
+            request.duration,
+            step=request.step,
+            start=request.startTime,
+            record_interval=request.recordInterval,
+            record_history=request.recordHistory
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/simulation/recording/start")
+async def start_simulation_recording(seed: Optional[int] = None):
+    seed = simulation_service.start_recording(seed)
+    return {"message": "Recording started", "seed": seed}
+
+@router.post("/simulation/recording/stop")
+async def stop_simulation_recording():
+    recording = simulation_service.stop_recording()
+    if recording is None:
+        raise HTTPException(status_code=400, detail="Not recording")
+    return recording
+
+@router.post("/simulation/replay")
+def replay_simulation(recording: Dict[str, Any], restore: bool = True):
+    """按录制逐 tick 重放（同步执行，在线程池中运行），返回最终状态摘要是否一致"""
+    try:
+        return simulation_service.replay(recording, restore=restore)
+    except (KeyError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid recording: {e}")
+
+@router.get("/simulation/scheduler")
+async def get_simulation_scheduler():
+    """实时仿真循环的节拍指标（周期、迟到时间、跳过/补跑的 tick 数）"""
+    return simulation_service.get_scheduler_metrics()
+
+@router.get("/simulation/clock")
+async def get_simulation_clock():
+    clock = simulation_service.clock
+    return {"now": clock.now(), "rate": clock.rate, "frozen": clock.frozen, "offset": clock.offset}
+
+
+# ==================== 产能规划 API ====================
+
+from app.services.capacity_planner import DEFAULT_HANDOFF_SECONDS, get_capacity_planner
+
+class ThroughputPlanRequest(BaseModel):
+    carts: int = 20                            # 投入的小车数
+    days: float = 7.0                          # 规划的虚拟天数
+    lineId: Optional[str] = None               # 只规划该线体（默认全部线体）
+    anodeRecipeId: Optional[str] = None        # 默认使用阳极默认配方
+    cathodeRecipeId: Optional[str] = None      # 默认使用阴极默认配方
+    handoffSeconds: float = DEFAULT_HANDOFF_SECONDS  # 经传输阀转入下一腔体的耗时
+    arrivalIntervalHours: float = 0.0          # 小车到达间隔，0 表示进样仓空出即投入
+    extraChambers: Dict[str, int] = {}         # 假设追加的并行腔体，如 {"bake": 1}
+
+@router.post("/planner/throughput")
+def plan_throughput(request: ThroughputPlanRequest):
+    """离散事件仿真小车流经各线体，返回每日产出、工位利用率、排队等待与瓶颈工位"""
+    try:
+        return get_capacity_planner().plan(
+            carts=request.carts,
+            days=request.days,
+            line_id=request.lineId,
+            anode_recipe_id=request.anodeRecipeId,
+            cathode_recipe_id=request.cathodeRecipeId,
+            handoff_seconds=request.handoffSeconds,
+            arrival_interval_hours=request.arrivalIntervalHours,
+            extra_chambers=request.extraChambers,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+from app.services.sweep_runner import get_sweep_runner
+
+class SweepRequest(BaseModel):
+    recipe: Dict[str, List[Any]] = {}          # 配方参数取值，如 {"bakeDuration": [12, 15], "anode.bakeTargetTemp": [390, 410]}
+    extraChambers: List[Dict[str, int]] = []   # 追加并行腔体的方案，如 [{}, {"bake": 1}]
+    arrivalIntervalHours: List[float] = []     # 小车到达间隔的取值
+    carts: int = 20
+    days: float = 7.0
+    lineId: Optional[str] = None
+    handoffSeconds: float = DEFAULT_HANDOFF_SECONDS
+    workers: int = 2                           # 同时计算的任务数上限，实际为 min(workers, 进程池大小)；1 表示串行
+
+@router.post("/planner/sweep")
+def run_sweep(request: SweepRequest):
+    """What-if 参数扫描：各网格点的每日产出、能耗代理与报警次数对比（结果按参数哈希缓存）"""
+    try:
+        return get_sweep_runner().run(
+            recipe=request.recipe,
+            extra_chambers=request.extraChambers,
+            arrival_intervals=request.arrivalIntervalHours,
+            carts=request.carts,
+            days=request.days,
+            line_id=request.lineId,
+            handoff_seconds=request.handoffSeconds,
+            workers=request.workers,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 
 # ==================== 用户管理 API ====================
 
@@ -0,0 +1,120 @@
+"""
+AutoLine Monitor - 响应编码与内容协商
+
+远程查看端位于带宽受限的工厂 VPN 上，高流量接口（/state、历史曲线、快照、事件列表）
+按 Accept-Encoding 协商 br/gzip 压缩（小于阈值的响应不压缩），并可通过
+Accept: application/x-msgpack 选择 MessagePack 二进制表示。
+brotli / msgpack 为可选依赖，未安装时自动退化为 gzip / JSON。
+"""
+
+import gzip
+import json
+from typing import Any, Dict, MutableMapping, Optional, Tuple
+
+from fastapi import Request, Response
+
+try:
+    import brotli
+except ImportError:  # 可选依赖
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:  # 可选依赖
+    msgpack = None
+
+# 小于该字节数的响应不压缩（压缩收益低于开销）
+MIN_COMPRESS_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPES = ("application/x-msgpack", "application/msgpack")
+
+
+def _parse_accept(header: Optional[str]) -> Dict[str, float]:
+    """解析 Accept / Accept-Encoding 头，返回 {token: q}"""
+    result: Dict[str, float] = {}
+    if not header:
+        return result
+    for part in header.split(','):
+        token, _, params = part.strip().partition(';')
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        result[token] = q
+    return result
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """选择压缩算法：优先 br，其次 gzip；都不接受时返回 None"""
+    accepted = _parse_accept(accept_encoding)
+    wildcard = accepted.get('*', 0.0)
+    if brotli is not None and accepted.get('br', wildcard) > 0:
+        return 'br'
+    if accepted.get('gzip', wildcard) > 0:
+        return 'gzip'
+    return None
+
+
+def accepts_msgpack(accept: Optional[str]) -> bool:
+    """客户端是否请求 MessagePack（且服务端已安装 msgpack）"""
+    if msgpack is None:
+        return False
+    accepted = _parse_accept(accept)
+    return any(accepted.get(media, 0.0) > 0 for media in MSGPACK_MEDIA_TYPES)
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def pack(obj: Any) -> bytes:
+    return msgpack.packb(obj, use_bin_type=True)
+
+
+def encoded_response(
+    request: Request,
+    body: bytes,
+    media_type: str = JSON_MEDIA_TYPE,
+    cache: Optional[MutableMapping[Tuple, bytes]] = None,
+    cache_key: Optional[Tuple] = None
+) -> Response:
+    """
+    按 Accept-Encoding 压缩响应体。
+    提供 cache/cache_key 时，压缩结果缓存在 cache 中（如状态代对象上），同一数据只压缩一次。
+    """
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    encoding = choose_encoding(request.headers.get('accept-encoding')) if len(body) >= MIN_COMPRESS_SIZE else None
+    if encoding:
+        key = (cache_key, media_type, encoding) if cache is not None and cache_key is not None else None
+        compressed = cache.get(key) if key else None
+        if compressed is None:
+            compressed = compress(body, encoding)
+            if key:
+                cache[key] = compressed
+        body = compressed
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+def negotiated_response(request: Request, payload: Any, columnar: Optional[Any] = None) -> Response:
+    """
+    JSON / MessagePack 内容协商：请求 MessagePack 时发送 columnar（若提供）或 payload 的二进制编码，
+    否则发送 JSON。两种表示都经过压缩协商。
+    """
+    if accepts_msgpack(request.headers.get('accept')):
+        body = pack(columnar if columnar is not None else payload)
+        return encoded_response(request, body, media_type=MSGPACK_MEDIA_TYPES[0])
+    body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return encoded_response(request, body)
@@ -4,7 +4,7 @@ AutoLine Monitor - Backend Data Models
 """
 
 from pydantic import BaseModel
-from typing import List, Optional, Literal
+from typing import List, Optional, Literal, Tuple
 from enum import Enum
 
 
@@ -171,10 +171,51 @@ class SystemState(BaseModel):
     lines: List[LineData] = []
     carts: List[Cart]
     timestamp: float
-    systemLogs: List[LogEntry] = []
-    operationLogs: List[LogEntry] = []
+    # 日志按时间倒序（最新在前），发布后不可变，未变化时各代共享同一元组
+    systemLogs: Tuple[LogEntry, ...] = ()
+    operationLogs: Tuple[LogEntry, ...] = ()
 
 
+# ==================== Command Models ====================
+
+class CommandStatus(str, Enum):
+    pending = "pending"       # 已受理，等待同一设备上的前序指令完成
+    running = "running"       # 执行中（阀门处于 opening/closing 过渡态）
+    completed = "completed"
+    failed = "failed"
+
+
+class DeviceCommand(BaseModel):
+    """设备控制指令（阀门/泵），异步执行，前端可轮询或等待"""
+    id: str
+    kind: Literal['valve', 'pump']
+    lineId: str
+    chamberId: str
+    target: str                                        # 阀门名 / 泵名
+    action: str                                        # open/close 或 on/off
+    status: CommandStatus = CommandStatus.pending
+    createdAt: float
+    startedAt: Optional[float] = None
+    completedAt: Optional[float] = None
+    error: Optional[str] = None
+    rollbackError: Optional[str] = None                # 动作失败后撤销过渡态也失败的原因（设备状态可能与指令前不一致）
+
+
+class BatchStep(BaseModel):
+    """批量指令中的一步"""
+    kind: Literal['valve', 'pump', 'move']
+    chamberId: Optional[str] = None                    # valve/pump 目标腔体
+    target: Optional[str] = None                       # 阀门名 (gate_valve...) 或泵名 (molecular/roughing)
+    action: str                                        # open/close, on/off, forward/backward
+    cartId: Optional[str] = None                       # move 目标小车
+
+
+class BatchStepResult(BaseModel):
+    index: int
+    kind: str
+    status: Literal['ok', 'failed', 'skipped']
+    message: str = ""
+
 
 class UserRole(str, Enum):
     admin = "admin"
@@ -214,6 +255,11 @@ class AlarmThresholds(BaseModel):
     vacuumAlertThreshold: float = 1e-3     # 本底真空破坏阈值
     processVacuumThreshold: float = 5e-4   # 工艺允许最高气压
 
+    # 报警死区与延时（防抖）
+    temperatureHysteresis: float = 5.0     # 温度报警恢复死区 (℃)
+    vacuumHysteresisRatio: float = 0.2     # 真空报警恢复死区（阈值的比例）
+    alarmDelay: float = 3.0                # 越限/恢复须持续的时间 (秒)
+
     
 class Recipe(BaseModel):
     id: str
@@ -260,6 +306,9 @@ class DataConfig(BaseModel):
     retentionDays: int = 30
     autoBackup: bool = False
     backupPath: str = "./backups"
+    logCapacity: int = 50           # 内存中保留的系统/操作日志条数
+    aggregationInterval: float = 1.0  # 历史数据预聚合的时间桶 (秒)
+    rawCaptureSeconds: float = 5.0    # 报警前后各抓取多少秒原始样本，0 表示不抓取
 
 class SystemSettings(BaseModel):
     theme: Literal['dark', 'light'] = 'dark'
@@ -290,4 +339,6 @@ class SimulationFault(BaseModel):
 class SimulationConfig(BaseModel):
     timeMultiplier: float = 1.0     # 时间加速倍率 (1.0 - 60.0)
     noiseEnabled: bool = True       # 是否开启随机噪声
+    seed: Optional[int] = None      # 随机种子（设定后噪声、事件与实体 ID 可复现）
+    tickPolicy: Literal['catch_up', 'skip'] = 'skip'  # tick 超时策略：补跑错过的 tick / 跳到下一节拍
     activeFaults: List[SimulationFault] = []
@@ -0,0 +1,517 @@
+"""
+硬件数据采集服务 - 按 HardwareConfig.protocol 选择采集驱动
+
+采集循环运行在独立线程的 asyncio 事件循环中。每个轮询周期 (pollingInterval) 由驱动读取全部腔体的读数，
+在一次写事务内写入 StateService 工作副本，再批量写入历史记录（与仿真器相同的发布/历史链路）。
+驱动取得读数后仿真器跳过物理步进，腔体温度/压力/阀门/泵状态以采集值为准，
+小车工序等 MES 逻辑仍由仿真器推进；尚未连通或读数中断超过 STALE_PERIODS 个周期时由仿真器接管物理量。
+指令改变的阀门/泵在 COMMAND_HOLD 秒内以指令结果为准，读数不覆盖（动作中的阀门同样不覆盖）。
+protocol 为 simulation 时采集循环空转，设置变化时切换驱动。
+
+离线测试时可在同一事件循环中启动协议替身 (stand-in)：由 SimulatedPlant 用仿真内核推进一份腔体拓扑副本，
+替身服务按所选协议对外提供读数；指令改变的泵/阀设定在保持期内转发给替身数据源。
+"""
+
+import asyncio
+import math
+import threading
+import time
+from typing import Any, Callable, Collection, Dict, List, Optional, Tuple
+
+from app.models import Chamber, ChamberValves, HardwareConfig, ProtocolType, SystemState, ValveState
+from app.services.clock_service import get_clock
+from app.services.ingest_aggregator import get_ingest_aggregator
+from app.services.settings_service import SettingsService
+from app.services.simulation_kernel import ChamberKernel
+from app.services.state_service import StateService, device_key
+
+# 读数字段：数值量 / 开关量 / 阀门（valves: {阀门名: 是否打开}）
+FLOAT_READINGS = ('temperature', 'outerTemperature', 'highVacPressure', 'forelinePressure')
+BOOL_READINGS = ('molecularPump', 'roughingPump', 'isHeating')
+VALVE_NAMES = tuple(ChamberValves.model_fields)
+# 泵的开关量读数 -> 泵指令名称
+PUMP_READINGS = {'molecularPump': 'molecular', 'roughingPump': 'roughing'}
+
+# 采集失败后的重连退避 (秒)：初始值、上限
+RECONNECT_BACKOFF = 0.5
+MAX_RECONNECT_BACKOFF = 30.0
+
+# 连续多少个轮询周期没有读数视为采集中断（由仿真器接管物理量）
+STALE_PERIODS = 3
+
+# 指令改变的设备在多长时间内不被读数覆盖 (秒)：执行机构动作并反映到读数之前以指令结果为准
+COMMAND_HOLD = 5.0
+
+# 替身数据源的物理步进间隔 (秒)
+STANDIN_STEP = 0.5
+
+
+def ordered_chambers(state: SystemState) -> Tuple[List[Chamber], List[bool]]:
+    """按线体、阳极/阴极序列排列的腔体，以及相邻标记（与仿真器 TickIndex 的顺序一致）"""
+    chambers: List[Chamber] = []
+    adjacent: List[bool] = []
+    for line in state.lines:
+        for sequence in (line.anodeChambers, line.cathodeChambers):
+            chambers.extend(sequence)
+            adjacent.extend([True] * (len(sequence) - 1) + [False] * bool(sequence))
+    return chambers, adjacent
+
+
+def line_of_chambers(state: SystemState) -> Dict[str, str]:
+    """腔体 ID -> 所属线体 ID（以线体结构为准，不依赖 Chamber.lineId）"""
+    return {c.id: line.id for line in state.lines for c in line.anodeChambers + line.cathodeChambers}
+
+
+def chamber_reading(chamber: Chamber) -> dict:
+    """腔体模型 -> 读数（替身服务对外提供的值）"""
+    reading = {name: getattr(chamber, name) for name in FLOAT_READINGS + BOOL_READINGS}
+    reading['valves'] = {name: getattr(chamber.valves, name) == ValveState.open for name in VALVE_NAMES}
+    return reading
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def _is_switch(value) -> bool:
+    return isinstance(value, bool) or (isinstance(value, int) and value in (0, 1))
+
+
+def clean_reading(reading: dict) -> Tuple[dict, int]:
+    """
+    校验读数字段的类型：数值量为有限的数值，开关量与阀门为 bool（或 0/1），valves 为对象。
+    返回 (只含合法字段的读数, 被丢弃的字段数)；不认识的字段忽略，不计为错误
+    """
+    cleaned = {}
+    bad = 0
+    for name in FLOAT_READINGS:
+        if name in reading:
+            value = reading[name]
+            if _is_number(value):
+                cleaned[name] = float(value)
+            else:
+                bad += 1
+    for name in BOOL_READINGS:
+        if name in reading:
+            value = reading[name]
+            if _is_switch(value):
+                cleaned[name] = bool(value)
+            else:
+                bad += 1
+    if 'valves' in reading:
+        valves = reading['valves']
+        if isinstance(valves, dict):
+            cleaned['valves'] = {}
+            for name, value in valves.items():
+                if name not in VALVE_NAMES:
+                    continue
+                if _is_switch(value):
+                    cleaned['valves'][name] = bool(value)
+                else:
+                    bad += 1
+        else:
+            bad += 1
+    return cleaned, bad
+
+
+def apply_readings(state: SystemState, readings: Dict[str, dict], held: Collection[str] = ()) -> List[str]:
+    """
+    把读数写入工作副本中的腔体，返回有腔体更新的线体 ID；读数中缺失的字段保持原值。
+    held 中的设备（见 device_key）与动作中的阀门不被读数覆盖
+    """
+    updated: List[str] = []
+    for line in state.lines:
+        for chamber in line.anodeChambers + line.cathodeChambers:
+            reading = readings.get(chamber.id)
+            if reading is None:
+                continue
+            if not updated or updated[-1] != line.id:
+                updated.append(line.id)
+            for name in FLOAT_READINGS:
+                if name in reading:
+                    setattr(chamber, name, float(reading[name]))
+            for name in BOOL_READINGS:
+                pump = PUMP_READINGS.get(name)
+                if name in reading and (pump is None or device_key('pump', chamber.id, pump) not in held):
+                    setattr(chamber, name, bool(reading[name]))
+            for name, is_open in reading.get('valves', {}).items():
+                if name not in VALVE_NAMES or device_key('valve', chamber.id, name) in held:
+                    continue
+                if getattr(chamber.valves, name) in (ValveState.opening, ValveState.closing):
+                    continue
+                setattr(chamber.valves, name, ValveState.open if is_open else ValveState.closed)
+    return updated
+
+
+def commanded_settings(state: SystemState, held: Collection[str]) -> Dict[str, dict]:
+    """held 中设备的当前设定（读数格式，动作中的阀门除外）：{腔体 ID: {泵开关量..., 'valves': {...}}}"""
+    settings: Dict[str, dict] = {}
+    if not held:
+        return settings
+    for line in state.lines:
+        for chamber in line.anodeChambers + line.cathodeChambers:
+            setting = {
+                name: getattr(chamber, name)
+                for name, pump in PUMP_READINGS.items() if device_key('pump', chamber.id, pump) in held
+            }
+            valves = {
+                name: getattr(chamber.valves, name) == ValveState.open
+                for name in VALVE_NAMES
+                if device_key('valve', chamber.id, name) in held
+                and getattr(chamber.valves, name) in (ValveState.open, ValveState.closed)
+            }
+            if valves:
+                setting['valves'] = valves
+            if setting:
+                settings[chamber.id] = setting
+    return settings
+
+
+class AcquisitionDriver:
+    """
+    采集驱动接口：poll() 返回本周期的 {腔体 ID: 读数}，读数须经 clean_reading 校验。
+    连接不可用时抛出 ConnectionError，由采集循环计数并按退避重试。
+    """
+    protocol = ''
+
+    async def poll(self) -> Dict[str, dict]:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    def drain_samples(self) -> Optional[List[Tuple[str, str, float, float]]]:
+        """
+        推送式驱动逐条到达的原始样本 (腔体 ID, 指标, 数值, 时刻)，供预聚合层使用；
+        返回 None 时按本周期的读数（每个腔体一个样本）记录历史
+        """
+        return None
+
+    def metrics(self) -> dict:
+        return {}
+
+
+class SimulatedPlant:
+    """替身数据源：用仿真内核推进一份腔体拓扑副本（设定温度、泵阀状态取自副本中的模型）"""
+
+    def __init__(self, state: SystemState, seed: Optional[int] = None):
+        chambers, self.adjacent = ordered_chambers(state)
+        self.chambers = [chamber.model_copy(deep=True) for chamber in chambers]
+        self.chamber_by_id = {chamber.id: chamber for chamber in self.chambers}
+        self.line_of = line_of_chambers(state)
+        self.kernel = ChamberKernel(seed)
+
+    def apply_commands(self, settings: Dict[str, dict]):
+        """执行指令：泵/阀设定（commanded_settings 的格式）写入副本"""
+        for chamber_id, setting in settings.items():
+            chamber = self.chamber_by_id.get(chamber_id)
+            if chamber is None:
+                continue
+            for name in PUMP_READINGS:
+                if name in setting:
+                    setattr(chamber, name, bool(setting[name]))
+            for name, is_open in setting.get('valves', {}).items():
+                setattr(chamber.valves, name, ValveState.open if is_open else ValveState.closed)
+
+    def step(self, dt: float):
+        kernel = self.kernel
+        kernel.sync(self.chambers, self.adjacent)
+        for i, chamber in enumerate(self.chambers):
+            kernel.target_inner[i] = chamber.targetTemperature
+            kernel.target_outer[i] = chamber.targetTemperature + 10.0
+        kernel.step(dt, 1.0, True)
+        kernel.write_back(self.chambers)
+
+    def readings(self) -> Dict[str, dict]:
+        return {chamber.id: chamber_reading(chamber) for chamber in self.chambers}
+
+
+# 协议 -> 驱动工厂 (硬件配置, 当前拓扑)；协议 -> 替身服务工厂 (替身数据源, 硬件配置)，
+# 替身服务为带 async close() 的对象
+DRIVERS: Dict[ProtocolType, Callable[[HardwareConfig, SystemState], AcquisitionDriver]] = {}
+STANDINS: Dict[ProtocolType, Callable[[SimulatedPlant, HardwareConfig], Any]] = {}
+
+
+def register_driver(protocol: ProtocolType, driver_factory, standin_factory=None):
+    DRIVERS[protocol] = driver_factory
+    if standin_factory is not None:
+        STANDINS[protocol] = standin_factory
+
+
+class AcquisitionService:
+    """采集循环（全局唯一，由 get_acquisition_service() 获取，应用 lifespan 负责启动/关闭）"""
+
+    def __init__(self):
+        self.state_service = StateService()
+        self.clock = get_clock()
+        self.running = False
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._driver: Optional[AcquisitionDriver] = None
+        self._driver_key: Optional[Tuple] = None
+        self._standin = None
+        self._standin_task: Optional[asyncio.Task] = None
+        self._plant: Optional[SimulatedPlant] = None
+        self._standin_protocol: Optional[ProtocolType] = None
+        self._backoff = 0.0
+        self._retry_at = 0.0
+        # 最近一次取得读数的时刻 (事件循环时间)；采集值是否接管物理量
+        self._last_data: Optional[float] = None
+        self.external_physics = False
+
+        # 指标
+        self.cycles = 0
+        self.overruns = 0
+        self.errors = 0
+        self.last_error: Optional[str] = None
+        self.last_cycle = 0.0
+        self.max_cycle = 0.0
+        self.last_poll = 0.0
+        self.last_chambers = 0
+        self.last_success: Optional[float] = None
+
+    # ==================== 生命周期 ====================
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._thread_main, args=(ready,), daemon=True)
+        self._thread.start()
+        ready.wait(timeout=2.0)
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=3.0)
+        self._thread = None
+
+    def _thread_main(self, ready: threading.Event):
+        loop = asyncio.new_event_loop()
+        self._loop = loop
+        self._wake = asyncio.Event()
+        ready.set()
+        try:
+            loop.run_until_complete(self._run())
+        finally:
+            loop.run_until_complete(self._shutdown())
+            loop.close()
+            self._loop = None
+
+    def _call(self, coro, timeout: float = 5.0):
+        """在采集事件循环中执行协程并等待结果（供 API 线程调用）"""
+        if not self.running or self._loop is None:
+            raise ValueError("Acquisition service is not running")
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout)
+
+    async def _shutdown(self):
+        await self._close_driver()
+        await self._stop_standin()
+
+    # ==================== 采集循环 ====================
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        anchor = loop.time()
+        index = 0
+        while self.running:
+            config = SettingsService().get_settings().hardware
+            period = max(0.05, config.pollingInterval / 1000.0)
+            await self._ensure_driver(config)
+            if self._driver is not None and loop.time() >= self._retry_at:
+                await self._cycle()
+            fresh = self._last_data is not None and loop.time() - self._last_data <= STALE_PERIODS * period
+            await self._set_external_physics(self._driver is not None and fresh)
+
+            # 无漂移节拍：错过的截止时刻直接跳过（读数取最新值，无需补采）
+            index += 1
+            now = loop.time()
+            if anchor + index * period < now:
+                missed = int((now - anchor) / period) - index + 1
+                self.overruns += missed
+                index += missed
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), anchor + index * period - now)
+            except asyncio.TimeoutError:
+                pass
+            if self._wake.is_set():
+                # 被唤醒（停止或配置变更）时以当前时刻重新对齐
+                anchor, index = loop.time(), 0
+
+    async def _cycle(self):
+        started = time.perf_counter()
+        try:
+            readings = await self._driver.poll()
+            self._backoff = 0.0
+            self.last_poll = time.perf_counter() - started
+            samples = self._driver.drain_samples()
+            if readings:
+                # 写事务与 SQLite 写入放到线程池，避免阻塞事件循环（替身服务也在此循环中）
+                commanded = await asyncio.get_running_loop().run_in_executor(None, self._publish, readings, samples)
+                if commanded and self._plant is not None:
+                    self._plant.apply_commands(commanded)
+                self._last_data = asyncio.get_running_loop().time()
+        except Exception as e:
+            # 连接错误之外的意外异常（驱动缺陷、写入失败）同样计数并退避，采集循环不中断
+            if not isinstance(e, (ConnectionError, OSError, asyncio.TimeoutError)):
+                print(f"Acquisition cycle failed: {type(e).__name__}: {e}")
+            self.errors += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            # 指数退避：连续失败时逐步拉长重试间隔
+            self._backoff = min(MAX_RECONNECT_BACKOFF, self._backoff * 2 if self._backoff else RECONNECT_BACKOFF)
+            self._retry_at = asyncio.get_running_loop().time() + self._backoff
+            return
+        self.cycles += 1
+        self.last_chambers = len(readings)
+        self.last_success = self.clock.now()
+        self.last_cycle = time.perf_counter() - started
+        self.max_cycle = max(self.max_cycle, self.last_cycle)
+
+    def _publish(self, readings: Dict[str, dict], samples: Optional[List[Tuple[str, str, float, float]]] = None) -> Dict[str, dict]:
+        """
+        一次写事务更新全部腔体，历史数据经预聚合层批量写入。
+        返回保持期内被指令改变的设备设定（替身运行时转发给替身数据源）
+        """
+        timestamp = self.clock.now()
+        with self.state_service.mutate() as state:
+            held = self.state_service.commanded_devices(COMMAND_HOLD)
+            for line_id in apply_readings(state, readings, held):
+                self.state_service.touch_line(line_id, journal=False)
+            commanded = commanded_settings(state, held) if self._plant is not None else {}
+        aggregator = get_ingest_aggregator()
+        if samples is not None:
+            for metric in ('temperature', 'vacuum'):
+                selected = [s for s in samples if s[1] == metric]
+                if selected:
+                    entity_ids, _, values, times = zip(*selected)
+                    aggregator.ingest_samples(entity_ids, metric, values, times)
+            return commanded
+        batch = [
+            {
+                'entity_id': chamber_id,
+                'temperature': reading.get('temperature'),
+                'vacuum': reading.get('highVacPressure'),
+                'timestamp': timestamp,
+            }
+            for chamber_id, reading in readings.items()
+        ]
+        aggregator.ingest(batch)
+        return commanded
+
+    async def _ensure_driver(self, config: HardwareConfig):
+        """协议、连接参数或腔体拓扑变化时重建驱动"""
+        protocol = ProtocolType(config.protocol)
+        state = self.state_service.get_state()
+        chambers, _ = ordered_chambers(state)
+        key = (protocol, config.ipAddress, config.port, config.slaveId, tuple(c.id for c in chambers))
+        if key == self._driver_key:
+            return
+        await self._close_driver()
+        self._driver_key = key
+        factory = DRIVERS.get(protocol)
+        self._driver = factory(config, state) if factory is not None else None
+        self._backoff = 0.0
+        self._retry_at = 0.0
+        self._last_data = None
+        await self._set_external_physics(False)
+
+    async def _set_external_physics(self, external: bool):
+        """采集值接管/交还腔体物理量（需要写者锁，放到线程池执行，不阻塞事件循环）"""
+        if external == self.external_physics:
+            return
+        self.external_physics = external
+        from app.services.simulation_service import get_simulation_service
+        await asyncio.get_running_loop().run_in_executor(None, get_simulation_service().set_external_physics, external)
+        print(f"Acquisition {'took over' if external else 'released'} chamber physics.")
+
+    async def _close_driver(self):
+        if self._driver is not None:
+            await self._driver.close()
+        self._driver = None
+        self._driver_key = None
+
+    # ==================== 协议替身 ====================
+
+    def start_standin(self) -> dict:
+        """按当前协议启动本地替身服务（数据源为当前拓扑的仿真副本）"""
+        return self._call(self._start_standin())
+
+    def stop_standin(self):
+        self._call(self._stop_standin())
+
+    async def _start_standin(self) -> dict:
+        config = SettingsService().get_settings().hardware
+        protocol = ProtocolType(config.protocol)
+        factory = STANDINS.get(protocol)
+        if factory is None:
+            raise ValueError(f"No stand-in available for protocol: {protocol.value}")
+        await self._stop_standin()
+        plant = SimulatedPlant(self.state_service.get_state())
+        plant.step(0.0)
+        self._standin = await factory(plant, config)
+        self._standin_protocol = protocol
+        self._plant = plant
+        self._standin_task = asyncio.create_task(self._drive_plant(plant))
+        # 替身就绪后立即重试连接
+        self._retry_at = 0.0
+        self._backoff = 0.0
+        self._wake.set()
+        return {'protocol': protocol.value, 'chambers': len(plant.chambers)}
+
+    async def _drive_plant(self, plant: SimulatedPlant):
+        while True:
+            await asyncio.sleep(STANDIN_STEP)
+            plant.step(STANDIN_STEP)
+
+    async def _stop_standin(self):
+        if self._standin_task is not None:
+            self._standin_task.cancel()
+            self._standin_task = None
+        self._plant = None
+        if self._standin is not None:
+            await self._standin.close()
+            self._standin = None
+            self._standin_protocol = None
+
+    # ==================== 状态 ====================
+
+    def get_status(self) -> dict:
+        config = SettingsService().get_settings().hardware
+        driver = self._driver
+        return {
+            'running': self.running,
+            'protocol': ProtocolType(config.protocol).value,
+            'driverActive': driver is not None,
+            'externalPhysics': self.external_physics,
+            'standin': self._standin_protocol.value if self._standin_protocol else None,
+            'pollingInterval': config.pollingInterval,
+            'cycles': self.cycles,
+            'overruns': self.overruns,
+            'errors': self.errors,
+            'lastError': self.last_error,
+            'reconnectBackoff': self._backoff,
+            'lastPollSeconds': self.last_poll,
+            'lastCycleSeconds': self.last_cycle,
+            'maxCycleSeconds': self.max_cycle,
+            'lastChambers': self.last_chambers,
+            'lastSuccess': self.last_success,
+            'driver': driver.metrics() if driver is not None else {},
+        }
+
+
+_acquisition_service_instance: Optional[AcquisitionService] = None
+
+def get_acquisition_service() -> AcquisitionService:
+    global _acquisition_service_instance
+    if _acquisition_service_instance is None:
+        _acquisition_service_instance = AcquisitionService()
+        # 注册各协议驱动
+        from app.services import http_polling, modbus_tcp, mqtt_ingest  # noqa: F401
+    return _acquisition_service_instance
@@ -0,0 +1,409 @@
+"""
+服务端报警引擎 - 按 AlarmThresholds 每个 tick 对全部腔体与小车做一次向量化评估
+
+阈值设置或线体拓扑（腔体/小车集合）变化时把规则编译成一张规则表：每条规则一行，
+以 NumPy 数组保存信号位置、方向、报警限、恢复限与使能条件位置。每个 tick 把腔体/小车读数
+收集成向量后整表比较一次：
+
+- TEMP_HIGH: 烘烤/生长腔体内温超过上限（阳极烘烤、阴极烘烤、生长各取各的上限）
+- TEMP_LOW: 生长腔体在工艺中（有小车且在加热）时内温低于下限
+- VACUUM_LOSS: 分子泵运行且放气阀未开时，高真空规压力超过本底真空阈值
+- PROCESS_VACUUM: 小车所在腔体在工艺中时，小车真空超过工艺允许最高气压
+
+越限须持续 alarmDelay 秒才报警；恢复须回到死区以内（temperatureHysteresis / vacuumHysteresisRatio）
+并同样持续 alarmDelay 秒。报警为锁存式：
+
+    normal -> active（未确认） -> 确认 -> acknowledged -> 恢复 -> normal
+    active -> 恢复 -> cleared（锁存，未确认） -> 确认或清除 -> normal
+
+只有状态变化才产生事件（写入事件时间轴并触发原始样本抓取）。客户端读取的是状态变化时
+重建的报警列表与事件序列，评估开销与连接的客户端数量无关。报警不写入 SystemState，
+录制/回放的状态摘要不受影响。
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Callable, Collection, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.models import AlarmThresholds, Chamber, ChamberType, SystemState, ValveState
+from app.services.settings_service import SettingsService
+
+# 报警状态
+NORMAL, ACTIVE, ACKNOWLEDGED, CLEARED = 'normal', 'active', 'acknowledged', 'cleared'
+
+# 规则代码 -> (级别, 名称)
+RULES = {
+    'TEMP_HIGH': ('error', '温度过高'),
+    'TEMP_LOW': ('warn', '温度过低'),
+    'VACUUM_LOSS': ('error', '本底真空破坏'),
+    'PROCESS_VACUUM': ('warn', '工艺真空超限'),
+}
+
+# 信号向量的分段：腔体内温、腔体高真空、小车真空
+SIGNAL_TEMPERATURE, SIGNAL_PRESSURE, SIGNAL_CART_VACUUM = range(3)
+# 使能条件向量的分段：始终、腔体工艺中、腔体抽高真空中、小车工艺中
+GATE_ALWAYS, GATE_PROCESSING, GATE_PUMPED, GATE_CART_PROCESSING = range(4)
+
+# 内存中保留的报警事件数
+EVENT_HISTORY = 1000
+# 评估耗时的滑动平均系数
+DURATION_SMOOTHING = 0.1
+
+
+def _temperature_limit(chamber: Chamber, polarity: str, thresholds: AlarmThresholds) -> Optional[float]:
+    if chamber.type == ChamberType.bake:
+        return thresholds.anodeBakeHighTemp if polarity == 'anode' else thresholds.cathodeBakeHighTemp
+    if chamber.type == ChamberType.growth:
+        return thresholds.growthHighTemp
+    return None
+
+
+class AlarmEngine:
+    """报警规则表、锁存状态与事件序列（仿真线程评估，API 线程确认/清除）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 事件按序号顺序交给订阅者：状态变化与发出事件在同一个发出锁内（不阻塞只读查询）
+        self._emit_lock = threading.Lock()
+        self._thresholds: Optional[AlarmThresholds] = None
+        self._chamber_ids: List[str] = []
+        self._cart_ids: List[str] = []
+        self._chamber_position: Dict[str, int] = {}
+        self._compile_rules([], [], {}, AlarmThresholds(), 0.0)
+        self._events: deque = deque(maxlen=EVENT_HISTORY)
+        self._sequence = 0
+        self._listeners: List[Callable[[List[dict]], None]] = []
+        # 报警列表只在状态变化时重建
+        self.version = 0
+        self._alarms: List[dict] = []
+
+        # 指标
+        self.compiles = 0
+        self.evaluations = 0
+        self.last_duration = 0.0
+        self.mean_duration = 0.0
+
+    def add_listener(self, listener: Callable[[List[dict]], None]):
+        """订阅报警事件（有状态变化时以事件列表按序号顺序调用，不持有引擎锁）"""
+        self._listeners.append(listener)
+
+    # ==================== 规则编译 ====================
+
+    def _compile(self, state: SystemState, chambers: List[Chamber], thresholds: AlarmThresholds, now: float) -> List[dict]:
+        placement = {}
+        for line in state.lines:
+            for polarity, sequence in (('anode', line.anodeChambers), ('cathode', line.cathodeChambers)):
+                placement.update({c.id: (polarity, line) for c in sequence})
+        events = self._compile_rules(chambers, state.carts, placement, thresholds, now)
+        self._thresholds = thresholds.model_copy()
+        self.compiles += 1
+        # 规则变化可能移除了报警或改变了报警限
+        self._changed()
+        return events
+
+    def _compile_rules(self, chambers, carts, placement, thresholds: AlarmThresholds, now: float) -> List[dict]:
+        """
+        生成规则表；placement: 腔体 ID -> (阳极/阴极, 所属线体)。
+        已有规则（实体 ID + 规则代码相同）的报警状态原样保留；
+        随规则一起消失的未结束报警（例如小车已删除）产生 removed 事件
+        """
+        n = len(chambers)
+        signal_offset = (0, n, 2 * n)
+        gate_offset = (0, 1, 1 + n, 1 + 2 * n)
+        temperature_band = thresholds.temperatureHysteresis
+        vacuum_ratio = 1.0 - thresholds.vacuumHysteresisRatio
+
+        rules = []  # (实体 ID, 规则代码, 实体类型, 名称, 线体 ID, 信号, 使能条件, 方向, 报警限, 恢复限)
+        for i, chamber in enumerate(chambers):
+            polarity, line = placement.get(chamber.id, ('anode', None))
+            line_id = line.id if line is not None else None
+            name = f"{line.name} {chamber.name}" if line is not None else chamber.name
+            temperature = signal_offset[SIGNAL_TEMPERATURE] + i
+            high = _temperature_limit(chamber, polarity, thresholds)
+            if high is not None:
+                rules.append((chamber.id, 'TEMP_HIGH', 'chamber', name, line_id,
+                              temperature, gate_offset[GATE_ALWAYS], 1.0, high, high - temperature_band))
+            if chamber.type == ChamberType.growth:
+                low = thresholds.growthLowTemp
+                rules.append((chamber.id, 'TEMP_LOW', 'chamber', name, line_id,
+                              temperature, gate_offset[GATE_PROCESSING] + i, -1.0, low, low + temperature_band))
+            limit = thresholds.vacuumAlertThreshold
+            rules.append((chamber.id, 'VACUUM_LOSS', 'chamber', name, line_id,
+                          signal_offset[SIGNAL_PRESSURE] + i, gate_offset[GATE_PUMPED] + i, 1.0, limit, limit * vacuum_ratio))
+        for j, cart in enumerate(carts):
+            _, line = placement.get(cart.locationChamberId, (None, None))
+            limit = thresholds.processVacuumThreshold
+            rules.append((cart.id, 'PROCESS_VACUUM', 'cart', f"小车{cart.number}", line.id if line is not None else None,
+                          signal_offset[SIGNAL_CART_VACUUM] + j, gate_offset[GATE_CART_PROCESSING] + j, 1.0, limit, limit * vacuum_ratio))
+
+        previous = {key: i for i, key in enumerate(getattr(self, '_keys', []))}
+        count = len(rules)
+        keys = [(rule[0], rule[1]) for rule in rules]
+        remaining = set(keys)
+        events = [
+            self._event(i, 'removed', now) for key, i in previous.items()
+            if key not in remaining and (self._active[i] or not self._acked[i])
+        ]
+        self._keys = keys
+        self._rule_index = {f"{entity_id}:{code}": i for i, (entity_id, code) in enumerate(keys)}
+        self._entity_type = [rule[2] for rule in rules]
+        self._names = [rule[3] for rule in rules]
+        self._line_ids = [rule[4] for rule in rules]
+        self._source = np.array([rule[5] for rule in rules], dtype=np.int64)
+        self._gate = np.array([rule[6] for rule in rules], dtype=np.int64)
+        self._direction = np.array([rule[7] for rule in rules], dtype=np.float64)
+        self._limit = np.array([rule[8] for rule in rules], dtype=np.float64)
+        self._clear_limit = np.array([rule[9] for rule in rules], dtype=np.float64)
+        self._delay = max(0.0, thresholds.alarmDelay)
+
+        state = {
+            '_active': np.zeros(count, dtype=bool),
+            '_acked': np.ones(count, dtype=bool),
+            # 越限/恢复条件开始持续的时刻（未满足时为 inf）
+            '_over_since': np.full(count, np.inf),
+            '_clear_since': np.full(count, np.inf),
+            '_raised_at': np.full(count, np.nan),
+            '_cleared_at': np.full(count, np.nan),
+            '_trigger_value': np.full(count, np.nan),
+            '_value': np.full(count, np.nan),
+        }
+        kept = [(i, previous[key]) for i, key in enumerate(keys) if key in previous]
+        if kept:
+            new, old = (np.array(side, dtype=np.int64) for side in zip(*kept))
+            for name, array in state.items():
+                array[new] = getattr(self, name)[old]
+        for name, array in state.items():
+            setattr(self, name, array)
+        return events
+
+    # ==================== 评估 ====================
+
+    def evaluate(self, state: SystemState, chambers: List[Chamber], now: float,
+                 occupied: Optional[Collection[str]] = None):
+        """
+        评估全部规则（在仿真 tick 内调用）；状态变化时产生事件。
+        occupied: 有小车的腔体 ID 集合（仿真 tick 传入 TickIndex.cart_by_chamber）；
+        未给出时按小车的 locationChamberId 计算
+        """
+        started = time.perf_counter()
+        thresholds = SettingsService().get_settings().thresholds
+        carts = state.carts
+        if occupied is None:
+            occupied = {c.locationChamberId for c in carts}
+        chamber_ids = [c.id for c in chambers]
+        cart_ids = [c.id for c in carts]
+        with self._emit_lock:
+            events = []
+            with self._lock:
+                if thresholds != self._thresholds or chamber_ids != self._chamber_ids or cart_ids != self._cart_ids:
+                    events = self._compile(state, chambers, thresholds, now)
+                    self._chamber_ids = chamber_ids
+                    self._cart_ids = cart_ids
+                    self._chamber_position = {cid: i for i, cid in enumerate(chamber_ids)}
+                values, gates = self._gather(chambers, carts, occupied)
+                events += self._step(values, gates, now)
+                self.evaluations += 1
+                self.last_duration = time.perf_counter() - started
+                self.mean_duration += (self.last_duration - self.mean_duration) * DURATION_SMOOTHING
+            if events:
+                self._emit(events)
+
+    def _gather(self, chambers: List[Chamber], carts, occupied: Collection[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """读数与使能条件收集成向量（分段布局与规则表一致）"""
+        n, m = len(chambers), len(carts)
+        temperature = np.fromiter((c.temperature for c in chambers), np.float64, n)
+        pressure = np.fromiter((c.highVacPressure for c in chambers), np.float64, n)
+        # 腔体工艺中：有小车且在加热（小车位置以 Cart.locationChamberId 为准）
+        processing = np.fromiter((c.isHeating and c.id in occupied for c in chambers), bool, n)
+        pumped = np.fromiter(
+            (c.molecularPump and c.valves.vent_valve != ValveState.open for c in chambers), bool, n
+        )
+        cart_vacuum = np.fromiter((np.nan if c.vacuum is None else c.vacuum for c in carts), np.float64, m)
+        # 不在任何腔体中的小车取 -1，指向末尾补的 False
+        location = np.fromiter((self._chamber_position.get(c.locationChamberId, -1) for c in carts), np.int64, m)
+        cart_processing = np.append(processing, False)[location]
+        values = np.concatenate((temperature, pressure, cart_vacuum))
+        gates = np.concatenate(([True], processing, pumped, cart_processing))
+        return values, gates
+
+    def _step(self, values: np.ndarray, gates: np.ndarray, now: float) -> List[dict]:
+        value = values[self._source]
+        enabled = gates[self._gate]
+        self._value = value
+        # 读数缺失 (NaN) 时既不越限也不恢复，保持原状态
+        with np.errstate(invalid='ignore'):
+            over = enabled & (self._direction * (value - self._limit) > 0)
+            recovered = ~enabled | (self._direction * (value - self._clear_limit) < 0)
+        self._over_since = np.where(over, np.minimum(self._over_since, now), np.inf)
+        self._clear_since = np.where(recovered, np.minimum(self._clear_since, now), np.inf)
+
+        raised = ~self._active & over & (now - self._over_since >= self._delay)
+        cleared = self._active & recovered & (now - self._clear_since >= self._delay)
+        if not (raised.any() or cleared.any()):
+            return []
+
+        self._active[raised] = True
+        self._acked[raised] = False
+        self._raised_at[raised] = now
+        self._cleared_at[raised] = np.nan
+        self._trigger_value[raised] = value[raised]
+        self._active[cleared] = False
+        self._cleared_at[cleared] = now
+        events = [self._event(i, 'raised', now) for i in np.flatnonzero(raised).tolist()]
+        events += [self._event(i, 'cleared', now) for i in np.flatnonzero(cleared).tolist()]
+        self._changed()
+        return events
+
+    # ==================== 确认/清除 ====================
+
+    def _select(self, alarm_ids: Optional[Iterable[str]]) -> List[int]:
+        if alarm_ids is None:
+            return list(range(len(self._keys)))
+        unknown = [a for a in alarm_ids if a not in self._rule_index]
+        if unknown:
+            raise KeyError(f"Alarm not found: {', '.join(unknown)}")
+        return [self._rule_index[a] for a in alarm_ids]
+
+    def acknowledge(self, alarm_ids: Optional[Sequence[str]] = None, now: Optional[float] = None) -> int:
+        """确认报警（默认全部未确认的报警）；已恢复的锁存报警确认后回到 normal。返回确认数"""
+        from app.services.clock_service import get_clock
+        now = get_clock().now() if now is None else now
+        with self._emit_lock:
+            with self._lock:
+                selected = [i for i in self._select(alarm_ids) if not self._acked[i]]
+                for i in selected:
+                    self._acked[i] = True
+                events = [self._event(i, 'acknowledged', now) for i in selected]
+                if events:
+                    self._changed()
+            if events:
+                self._emit(events)
+        return len(events)
+
+    def clear(self, alarm_ids: Optional[Sequence[str]] = None, now: Optional[float] = None) -> int:
+        """
+        清除已恢复的锁存报警（默认全部）。指定的报警仍处于越限状态时抛出 ValueError。
+        返回清除数
+        """
+        from app.services.clock_service import get_clock
+        now = get_clock().now() if now is None else now
+        with self._emit_lock:
+            with self._lock:
+                selected = self._select(alarm_ids)
+                if alarm_ids is not None:
+                    still_active = [f"{self._keys[i][0]}:{self._keys[i][1]}" for i in selected if self._active[i]]
+                    if still_active:
+                        raise ValueError(f"Alarm still active: {', '.join(still_active)}")
+                selected = [i for i in selected if not self._active[i] and not self._acked[i]]
+                for i in selected:
+                    self._acked[i] = True
+                events = [self._event(i, 'reset', now) for i in selected]
+                if events:
+                    self._changed()
+            if events:
+                self._emit(events)
+        return len(events)
+
+    # ==================== 事件与查询 ====================
+
+    def _status_of(self, i: int) -> str:
+        if self._active[i]:
+            return ACKNOWLEDGED if self._acked[i] else ACTIVE
+        return NORMAL if self._acked[i] else CLEARED
+
+    def _describe(self, i: int) -> dict:
+        entity_id, code = self._keys[i]
+        severity, title = RULES[code]
+        raised_at, cleared_at = self._raised_at[i], self._cleared_at[i]
+        return {
+            'id': f"{entity_id}:{code}",
+            'code': code,
+            'severity': severity,
+            'entityType': self._entity_type[i],
+            'entityId': entity_id,
+            'entityName': self._names[i],
+            'lineId': self._line_ids[i],
+            'status': self._status_of(i),
+            'limit': float(self._limit[i]),
+            'triggerValue': float(self._trigger_value[i]),
+            'raisedAt': None if np.isnan(raised_at) else float(raised_at),
+            'clearedAt': None if np.isnan(cleared_at) else float(cleared_at),
+            'message': f"{self._names[i]}{title}",
+        }
+
+    def _event(self, i: int, transition: str, now: float) -> dict:
+        """生成一条状态变化事件（需持有引擎锁）"""
+        self._sequence += 1
+        event = {
+            'seq': self._sequence,
+            'timestamp': now,
+            'transition': transition,
+            'value': float(self._value[i]),
+            **self._describe(i),
+        }
+        if transition == 'removed':
+            event['status'] = NORMAL
+        self._events.append(event)
+        return event
+
+    def _changed(self):
+        """状态变化后重建报警列表（需持有引擎锁）"""
+        self.version += 1
+        alarms = [self._describe(i) for i in np.flatnonzero(self._active | ~self._acked).tolist()]
+        alarms.sort(key=lambda a: (a['severity'] != 'error', -(a['raisedAt'] or 0.0)))
+        self._alarms = alarms
+
+    def _emit(self, events: List[dict]):
+        """事件写入时间轴；新报警触发相关实体的原始样本抓取（持有发出锁、不持有引擎锁）"""
+        from app.services.history_service import get_history_service
+        from app.services.ingest_aggregator import get_ingest_aggregator
+        history = get_history_service()
+        aggregator = get_ingest_aggregator()
+        for event in events:
+            level = event['severity'] if event['transition'] == 'raised' else 'info'
+            history.record_event_async('alarm', f"[{event['transition']}] {event['message']} ({event['value']:.4g})", level, event['timestamp'])
+            if event['transition'] == 'raised':
+                aggregator.capture([event['entityId']], event['timestamp'], f"alarm:{event['code']}")
+        for listener in self._listeners:
+            try:
+                listener(events)
+            except Exception as e:
+                print(f"Error in alarm listener: {e}")
+
+    def get_alarms(self) -> Tuple[int, List[dict]]:
+        """当前报警（未恢复或未确认），按级别与发生时间排序：(版本号, 列表)"""
+        with self._lock:
+            return self.version, self._alarms
+
+    def events_since(self, seq: int = 0, limit: int = 200) -> List[dict]:
+        """序号大于 seq 的报警事件（客户端增量拉取）"""
+        with self._lock:
+            return [event for event in self._events if event['seq'] > seq][:limit]
+
+    def get_status(self) -> dict:
+        with self._lock:
+            return {
+                'rules': len(self._keys),
+                'chambers': len(self._chamber_ids),
+                'carts': len(self._cart_ids),
+                'active': int(self._active.sum()),
+                'unacknowledged': int((~self._acked).sum()),
+                'version': self.version,
+                'lastSeq': self._sequence,
+                'compiles': self.compiles,
+                'evaluations': self.evaluations,
+                'lastDuration': self.last_duration,
+                'meanDuration': self.mean_duration,
+            }
+
+
+_alarm_engine_instance: Optional[AlarmEngine] = None
+
+def get_alarm_engine() -> AlarmEngine:
+    global _alarm_engine_instance
+    if _alarm_engine_instance is None:
+        _alarm_engine_instance = AlarmEngine()
+    return _alarm_engine_instance
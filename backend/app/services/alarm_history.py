@@ -0,0 +1,117 @@
+"""
+报警历史与汇总统计 - 报警页面的数据来源
+
+报警引擎的状态变化事件经 HistoryService 的后台线程按顺序写入 alarm_history 表（与 system_events 同库），
+每次报警一行：报警/确认/恢复/结束时刻、级别、实体、报警限与触发值。表上的索引覆盖
+"当前未结束"（部分索引）、"按实体"与"按时间段"三类查询，报警页面不需要扫描事件日志。
+
+汇总计数在内存中随事件增量维护，读取时不查库：
+- 各线体按级别的当前报警数：越限中 (active) / 未确认 (unacknowledged)
+- 各腔体的 MTBF：相邻两次报警的平均间隔（启动时从 alarm_history 恢复）
+"""
+
+import copy
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from app.services.clock_service import get_clock
+
+
+class AlarmHistory:
+    """订阅报警引擎事件：转交 HistoryService 落库并维护内存中的汇总计数"""
+
+    def __init__(self, history_service, engine):
+        self.history_service = history_service
+        self.engine = engine
+        self._lock = threading.Lock()
+        self._started = False
+        # 未结束的报警：报警 ID -> (线体 ID, 级别, 越限中, 已确认)
+        self._open: Dict[str, Tuple[Optional[str], str, bool, bool]] = {}
+        # 线体 ID -> 级别 -> {'active': 越限中, 'unacknowledged': 未确认}
+        self._counts: Dict[Optional[str], Dict[str, Dict[str, int]]] = {}
+        # 腔体 ID -> [报警次数, 首次报警时刻, 最近一次报警时刻]
+        self._failures: Dict[str, List] = {}
+
+    def start(self):
+        """结束上次运行遗留的报警、恢复 MTBF 统计并订阅报警引擎（应用启动时、仿真开始前调用）"""
+        if self._started:
+            return
+        self._started = True
+        closed = self.history_service.close_open_alarms(get_clock().now())
+        if closed:
+            print(f"Closed {closed} alarms left open by the previous run.")
+        with self._lock:
+            for entity_id, count, first, last in self.history_service.query_alarm_counts('chamber'):
+                self._failures[entity_id] = [count, first, last]
+        self.engine.add_listener(self._on_events)
+
+    def _on_events(self, events: List[dict]):
+        self.history_service.record_alarm_events_async(events)
+        with self._lock:
+            for event in events:
+                self._apply(event)
+
+    def _count(self, line_id: Optional[str], severity: str, active: bool, acked: bool, sign: int):
+        counts = self._counts.setdefault(line_id, {}).setdefault(severity, {'active': 0, 'unacknowledged': 0})
+        counts['active'] += sign * active
+        counts['unacknowledged'] += sign * (not acked)
+
+    def _apply(self, event: dict):
+        alarm_id = event['id']
+        transition = event['transition']
+        if transition == 'raised':
+            line_id, severity, active, acked = event['lineId'], event['severity'], True, False
+            if event['entityType'] == 'chamber':
+                record = self._failures.get(event['entityId'])
+                if record is None:
+                    self._failures[event['entityId']] = [1, event['timestamp'], event['timestamp']]
+                else:
+                    record[0] += 1
+                    record[2] = event['timestamp']
+        else:
+            current = self._open.get(alarm_id)
+            if current is None:
+                return
+            line_id, severity, active, acked = current
+            self._count(line_id, severity, active, acked, -1)
+            if transition == 'acknowledged':
+                acked = True
+            elif transition == 'cleared':
+                active = False
+            else:
+                # reset / removed：报警结束
+                active, acked = False, True
+        if active or not acked:
+            self._open[alarm_id] = (line_id, severity, active, acked)
+            self._count(line_id, severity, active, acked, 1)
+        else:
+            self._open.pop(alarm_id, None)
+
+    def get_summary(self) -> dict:
+        """各线体按级别的当前报警数与各腔体 MTBF（秒；少于两次报警时为 None）"""
+        with self._lock:
+            lines = copy.deepcopy(self._counts)
+            totals = {
+                key: sum(counts[key] for severities in lines.values() for counts in severities.values())
+                for key in ('active', 'unacknowledged')
+            }
+            mtbf = {
+                chamber_id: {
+                    'failures': count,
+                    'mtbf': (last - first) / (count - 1) if count > 1 else None,
+                    'lastFailure': last,
+                }
+                for chamber_id, (count, first, last) in self._failures.items()
+            }
+        return {'lines': lines, 'totals': totals, 'mtbf': mtbf}
+
+
+_alarm_history_instance: Optional[AlarmHistory] = None
+
+def get_alarm_history() -> AlarmHistory:
+    global _alarm_history_instance
+    if _alarm_history_instance is None:
+        from app.services.alarm_engine import get_alarm_engine
+        from app.services.history_service import get_history_service
+        _alarm_history_instance = AlarmHistory(get_history_service(), get_alarm_engine())
+    return _alarm_history_instance
@@ -0,0 +1,310 @@
+"""
+产线产能规划 - 线体吞吐量与瓶颈分析
+
+按 StateService 中的线体拓扑与 RecipeService 中的配方，离散事件仿真 N 辆小车依次流经
+阳极/阴极腔体序列，数天的虚拟时间在一两秒内完成：
+
+- 相邻的同类型腔体视为同一工位的并行腔体（例如两个烘烤仓），每个腔体容纳 maxCartCapacity 辆小车
+- 工序时长与进样时生成的工艺步骤一致：烘烤/生长取配方时长，其余取标准工序时长
+- 小车完成工序后须等下一工位有空位才能经传输阀转入（阻塞），转入耗时 handoff 秒
+- 进样仓空出即投入下一辆小车（arrivalInterval 为 0 时），或按固定间隔到达
+
+输出每日产出、各工位利用率/阻塞率/排队等待时间与瓶颈工位，用于评估增加腔体（extraChambers）的收益。
+"""
+
+import heapq
+import itertools
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app.models import Chamber, ChamberType, Recipe
+
+# 标准工序时长 (小时)，与进样时生成的工艺步骤 (StateService.create_cart) 一致
+STANDARD_STEP_HOURS = {
+    ChamberType.load_lock: 5 / 60,
+    ChamberType.cleaning: 4.0,
+    ChamberType.docking: 2.0,
+    ChamberType.sealing: 3.0,
+    ChamberType.unload: 10 / 60,
+}
+
+# 经传输阀转入下一腔体的默认耗时 (秒)：开阀、传送、关阀
+DEFAULT_HANDOFF_SECONDS = 120.0
+
+# 单次规划最多投入的小车数
+MAX_PLANNED_CARTS = 10000
+
+
+def step_hours(chamber_type: ChamberType, recipe: Optional[Recipe]) -> float:
+    """工位的工序时长 (小时)"""
+    if recipe is not None:
+        if chamber_type == ChamberType.bake:
+            return recipe.bakeDuration
+        if chamber_type == ChamberType.growth:
+            return recipe.growthDuration
+    return STANDARD_STEP_HOURS.get(chamber_type, 0.0)
+
+
+class Stage:
+    """工位：一组相邻的同类型腔体"""
+    __slots__ = (
+        'type', 'name', 'chamber_ids', 'servers', 'process',
+        'occupied', 'waiting', 'busy_time', 'blocked_time', 'entries', 'queue_delay',
+    )
+
+    def __init__(self, chamber_type: ChamberType, name: str, process_seconds: float):
+        self.type = chamber_type
+        self.name = name
+        self.chamber_ids: List[str] = []
+        self.servers = 0
+        self.process = process_seconds
+        self.occupied = 0
+        # 已完成工序、等待下游空位的小车：(完成时刻, 小车序号)，先完成先转出
+        self.waiting: List[Tuple[float, int]] = []
+        self.busy_time = 0.0
+        self.blocked_time = 0.0
+        self.entries = 0
+        self.queue_delay = 0.0
+
+
+def build_stages(chambers: List[Chamber], recipe: Optional[Recipe], extra: Optional[Dict[str, int]] = None) -> List[Stage]:
+    """把腔体序列合并为工位；extra 按腔体类型追加假设的并行腔体数"""
+    stages: List[Stage] = []
+    for chamber in chambers:
+        if stages and stages[-1].type == chamber.type:
+            stage = stages[-1]
+        else:
+            stage = Stage(chamber.type, chamber.name, step_hours(chamber.type, recipe) * 3600)
+            stages.append(stage)
+        stage.chamber_ids.append(chamber.id)
+        stage.servers += max(1, chamber.maxCartCapacity)
+    for chamber_type, count in (extra or {}).items():
+        for stage in stages:
+            if stage.type.value == chamber_type:
+                stage.servers += max(0, count)
+    return stages
+
+
+def simulate_flow(
+    stages: List[Stage],
+    carts: int,
+    horizon: float,
+    handoff: float = DEFAULT_HANDOFF_SECONDS,
+    arrival_interval: float = 0.0
+) -> dict:
+    """
+    阻塞式流水线的离散事件仿真（时间单位：秒，从 0 开始）
+
+    事件：小车到达进样仓队列 / 工位工序完成。小车完成工序后若下一工位已满则占位阻塞，
+    下游腔体空出时按完成先后拉入；最后一个工位完成即离线。
+    """
+    events: List[Tuple[float, int, str, int, int]] = []
+    order = itertools.count()
+    arrivals: List[Tuple[float, int]] = []  # 等待进样的小车：(到达时刻, 小车序号)
+    entered_at: Dict[int, float] = {}
+    lead_times: List[float] = []
+    last = len(stages) - 1
+    released = 0
+    now = 0.0
+
+    def start(cart: int, index: int, t: float, ready: float):
+        stage = stages[index]
+        stage.occupied += 1
+        stage.entries += 1
+        stage.queue_delay += t - ready
+        # 转入耗时计入该工位占用（阀门与传送期间腔体不可用）
+        duration = stage.process + (handoff if index > 0 else 0.0)
+        stage.busy_time += min(duration, max(0.0, horizon - t))
+        heapq.heappush(events, (t + duration, next(order), 'done', cart, index))
+
+    def release(index: int, t: float):
+        """工位 index 空出一个腔体：从上游（或进样队列）拉入一辆小车，空出的上游腔体递归处理"""
+        stage = stages[index]
+        while stage.occupied < stage.servers:
+            if index == 0:
+                if not arrivals:
+                    return
+                ready, cart = heapq.heappop(arrivals)
+                entered_at[cart] = t
+                start(cart, 0, t, ready)
+            else:
+                upstream = stages[index - 1]
+                if not upstream.waiting:
+                    return
+                ready, cart = heapq.heappop(upstream.waiting)
+                upstream.occupied -= 1
+                upstream.blocked_time += min(t, horizon) - min(ready, horizon)
+                start(cart, index, t, ready)
+                release(index - 1, t)
+
+    def arrive(t: float):
+        nonlocal released
+        heapq.heappush(arrivals, (t, released))
+        released += 1
+        if released < carts and arrival_interval > 0:
+            heapq.heappush(events, (t + arrival_interval, next(order), 'arrive', -1, -1))
+
+    if arrival_interval > 0:
+        arrive(0.0)
+    else:
+        # 进样仓空出即投入：所有小车在 0 时刻排队等待
+        while released < carts:
+            arrive(0.0)
+    release(0, 0.0)
+
+    while events:
+        t, _, kind, cart, index = heapq.heappop(events)
+        if t > horizon:
+            break
+        now = t
+        if kind == 'arrive':
+            arrive(t)
+            release(0, t)
+            continue
+        stage = stages[index]
+        if index == last:
+            stage.occupied -= 1
+            lead_times.append(t - entered_at.pop(cart))
+            release(index, t)
+        else:
+            heapq.heappush(stage.waiting, (t, cart))
+            release(index + 1, t)
+
+    # 仿真结束时仍在阻塞的小车计入阻塞时间
+    for stage in stages:
+        stage.blocked_time += sum(horizon - ready for ready, _ in stage.waiting if ready < horizon)
+
+    return {
+        'released': released,
+        'completed': len(lead_times),
+        'inProcess': len(entered_at),
+        'leadTimes': lead_times,
+        'lastEventTime': now,
+    }
+
+
+def plan_sequence(
+    chambers: List[Chamber],
+    recipe: Optional[Recipe],
+    carts: int,
+    days: float,
+    handoff: float = DEFAULT_HANDOFF_SECONDS,
+    arrival_interval_hours: float = 0.0,
+    extra_chambers: Optional[Dict[str, int]] = None
+) -> dict:
+    """规划单条腔体序列（某线体的阳极或阴极线）"""
+    stages = build_stages(chambers, recipe, extra_chambers)
+    horizon = days * 86400
+    if not stages:
+        return {'stages': [], 'completed': 0, 'throughputPerDay': 0.0, 'bottleneck': None}
+
+    result = simulate_flow(stages, min(carts, MAX_PLANNED_CARTS), horizon, handoff, arrival_interval_hours * 3600)
+    lead_times = result['leadTimes']
+
+    stage_reports = []
+    for stage in stages:
+        capacity = stage.servers * horizon
+        cycle = stage.process + handoff
+        stage_reports.append({
+            'type': stage.type.value,
+            'name': stage.name,
+            'chamberIds': stage.chamber_ids,
+            'chambers': stage.servers,
+            'processHours': stage.process / 3600,
+            # 工位理论产能：并行腔体数 / (工序时长 + 转入耗时)
+            'capacityPerDay': stage.servers * 86400 / cycle if cycle > 0 else None,
+            'utilization': stage.busy_time / capacity if capacity else 0.0,
+            'blockedFraction': stage.blocked_time / capacity if capacity else 0.0,
+            'entries': stage.entries,
+            # 进入该工位前的平均等待（上游完成或到达进样队列之后）
+            'meanQueueDelayHours': stage.queue_delay / stage.entries / 3600 if stage.entries else 0.0,
+        })
+
+    bottleneck = max(stage_reports, key=lambda s: (s['utilization'], -(s['capacityPerDay'] or float('inf'))))
+    return {
+        'recipeId': recipe.id if recipe else None,
+        'released': result['released'],
+        'completed': result['completed'],
+        'inProcess': result['inProcess'],
+        'throughputPerDay': result['completed'] / days if days > 0 else 0.0,
+        'meanLeadTimeHours': sum(lead_times) / len(lead_times) / 3600 if lead_times else None,
+        'stages': stage_reports,
+        'bottleneck': {
+            'type': bottleneck['type'],
+            'name': bottleneck['name'],
+            'chamberIds': bottleneck['chamberIds'],
+            'utilization': bottleneck['utilization'],
+            'capacityPerDay': bottleneck['capacityPerDay'],
+        },
+    }
+
+
+class CapacityPlanner:
+    """对当前拓扑（或其中一条线体）运行产能规划"""
+
+    def __init__(self, state_service, recipe_service):
+        self.state_service = state_service
+        self.recipe_service = recipe_service
+
+    def _recipe(self, recipe_id: Optional[str], line_type: str) -> Optional[Recipe]:
+        if recipe_id:
+            recipe = self.recipe_service.get_recipe(recipe_id)
+            if recipe is None:
+                raise ValueError(f"Recipe not found: {recipe_id}")
+            return recipe
+        return self.recipe_service.get_default_recipe(line_type)
+
+    def plan(
+        self,
+        carts: int = 20,
+        days: float = 7.0,
+        line_id: Optional[str] = None,
+        anode_recipe_id: Optional[str] = None,
+        cathode_recipe_id: Optional[str] = None,
+        handoff_seconds: float = DEFAULT_HANDOFF_SECONDS,
+        arrival_interval_hours: float = 0.0,
+        extra_chambers: Optional[Dict[str, int]] = None
+    ) -> dict:
+        if carts < 1 or days <= 0:
+            raise ValueError("carts and days must be positive")
+        started_at = time.perf_counter()
+        state = self.state_service.get_state()
+        lines = [line for line in state.lines if line_id is None or line.id == line_id]
+        if line_id is not None and not lines:
+            raise ValueError(f"Line not found: {line_id}")
+
+        recipes = {
+            'anode': self._recipe(anode_recipe_id, 'anode'),
+            'cathode': self._recipe(cathode_recipe_id, 'cathode'),
+        }
+        reports = []
+        for line in lines:
+            for polarity, chambers in (('anode', line.anodeChambers), ('cathode', line.cathodeChambers)):
+                if not chambers:
+                    continue
+                report = plan_sequence(
+                    chambers, recipes[polarity], carts, days,
+                    handoff=handoff_seconds,
+                    arrival_interval_hours=arrival_interval_hours,
+                    extra_chambers=extra_chambers,
+                )
+                reports.append({'lineId': line.id, 'lineName': line.name, 'polarity': polarity, **report})
+
+        return {
+            'carts': carts,
+            'days': days,
+            'extraChambers': extra_chambers or {},
+            'sequences': reports,
+            'wallSeconds': time.perf_counter() - started_at,
+        }
+
+
+_capacity_planner_instance: Optional[CapacityPlanner] = None
+
+def get_capacity_planner() -> CapacityPlanner:
+    global _capacity_planner_instance
+    if _capacity_planner_instance is None:
+        from app.services.recipe_service import get_recipe_service
+        from app.services.state_service import StateService
+        _capacity_planner_instance = CapacityPlanner(StateService(), get_recipe_service())
+    return _capacity_planner_instance
@@ -0,0 +1,114 @@
+"""
+仿真虚拟时钟 - 所有服务读取的统一时间源
+
+实时模式下虚拟时间按 timeMultiplier 倍率随单调时钟推进；快进 (headless) 模式下时钟冻结，
+由仿真循环按步长离散推进。配方阶段、工序耗时、生长进度、日志与历史时间戳都读取该时钟，
+因此加速运行或快进回填时内部时间保持一致。
+"""
+
+import datetime
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+
+class SimulationClock:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 线程内固定的时间（一个 tick 或一条指令内所有读数一致）
+        self._local = threading.local()
+        self._virtual = time.time()   # 锚点处的虚拟时间 (epoch 秒)
+        self._real = time.monotonic() # 锚点处的单调时钟
+        self._rate = 1.0
+        self._frozen = False
+        # 时间跳变计数（快进、设置时间时递增），仿真循环据此重置 dt 基准
+        self.epoch = 0
+
+    def now(self) -> float:
+        """当前虚拟时间 (epoch 秒)"""
+        pinned = getattr(self._local, 'pinned', None)
+        if pinned is not None:
+            return pinned
+        with self._lock:
+            return self._now()
+
+    def _now(self) -> float:
+        if self._frozen:
+            return self._virtual
+        return self._virtual + (time.monotonic() - self._real) * self._rate
+
+    def now_ms(self) -> float:
+        return self.now() * 1000
+
+    def datetime(self) -> datetime.datetime:
+        """当前虚拟时间的本地 datetime（与 datetime.now() 同为 naive）"""
+        return datetime.datetime.fromtimestamp(self.now())
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    @property
+    def frozen(self) -> bool:
+        return self._frozen
+
+    @property
+    def offset(self) -> float:
+        """虚拟时间相对墙上时间的偏移 (秒)"""
+        return self.now() - time.time()
+
+    @contextmanager
+    def pinned(self, timestamp: float) -> Iterator[float]:
+        """在当前线程内把 now() 固定为 timestamp（可嵌套）"""
+        previous = getattr(self._local, 'pinned', None)
+        self._local.pinned = timestamp
+        try:
+            yield timestamp
+        finally:
+            self._local.pinned = previous
+
+    def _reanchor(self):
+        self._virtual = self._now()
+        self._real = time.monotonic()
+
+    def set_rate(self, rate: float):
+        """设置时间倍率（从当前时刻起生效）"""
+        with self._lock:
+            self._reanchor()
+            self._rate = max(0.0, rate)
+
+    def set(self, timestamp: float):
+        """把虚拟时间设为指定时刻"""
+        with self._lock:
+            self._virtual = timestamp
+            self._real = time.monotonic()
+            self.epoch += 1
+
+    def freeze(self):
+        """冻结时钟（快进模式），之后只能通过 advance 推进"""
+        with self._lock:
+            self._reanchor()
+            self._frozen = True
+
+    def unfreeze(self):
+        """从冻结时刻起恢复按倍率推进"""
+        with self._lock:
+            self._real = time.monotonic()
+            self._frozen = False
+            self.epoch += 1
+
+    def advance(self, seconds: float):
+        with self._lock:
+            self._reanchor()
+            self._virtual += seconds
+
+
+_clock_instance: Optional[SimulationClock] = None
+
+
+def get_clock() -> SimulationClock:
+    global _clock_instance
+    if _clock_instance is None:
+        _clock_instance = SimulationClock()
+    return _clock_instance
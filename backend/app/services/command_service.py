@@ -0,0 +1,241 @@
+"""
+设备指令服务 - 阀门/泵动作的异步指令管线
+
+阀门与泵的动作需要 0.5-1s 的机构行程时间。指令受理后立即返回指令 ID，
+阀门立刻进入 opening/closing 过渡态，行程结束后由事件循环调度完成。
+同一设备上的指令按提交顺序串行执行，不同设备之间互不阻塞。
+动作失败时阀门回到动作前的状态，指令无论成败都会结束（wait_for 不会挂起）。
+"""
+
+import asyncio
+import random
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.models import BatchStep, BatchStepResult, CommandStatus, DeviceCommand
+from app.services.state_service import StateService, device_key
+
+
+class CommandService:
+    # 执行机构行程时间范围 (秒)
+    VALVE_STROKE_TIME = (0.5, 1.0)
+    PUMP_SWITCH_TIME = (0.5, 1.0)
+
+    # 内存中保留的指令记录条数（供前端轮询）
+    HISTORY_LIMIT = 500
+
+    def __init__(self):
+        self.state_service = StateService()
+        self._commands: "OrderedDict[str, DeviceCommand]" = OrderedDict()
+        self._done_events: Dict[str, asyncio.Event] = {}
+        # 每个设备上最后一条指令的任务，新指令需等待其完成（串行化同一设备的冲突指令）
+        self._device_tails: Dict[str, asyncio.Task] = {}
+
+    def submit_valve(
+        self,
+        line_id: str,
+        chamber_id: str,
+        valve_name: str,
+        action: str,
+        operator_name: str = "Admin",
+        operator_role: str = "admin"
+    ) -> DeviceCommand:
+        """提交阀门指令，校验失败抛出 ValueError"""
+        self.state_service.validate_valve(chamber_id, valve_name)
+        command = self._new_command('valve', line_id, chamber_id, valve_name, action)
+        self._schedule(
+            command,
+            device_key=device_key('valve', chamber_id, valve_name),
+            begin=lambda: self.state_service.begin_valve_transition(chamber_id, valve_name, action),
+            finish=lambda: self.state_service.toggle_valve(
+                line_id, chamber_id, valve_name, action, operator_name, operator_role
+            ),
+            duration=random.uniform(*self.VALVE_STROKE_TIME),
+            rollback=lambda previous: self.state_service.revert_valve_transition(chamber_id, valve_name, previous),
+        )
+        return command
+
+    def submit_pump(
+        self,
+        line_id: str,
+        chamber_id: str,
+        pump_name: str,
+        action: str,
+        operator_name: str = "Admin",
+        operator_role: str = "admin"
+    ) -> DeviceCommand:
+        """提交泵启停指令，校验失败抛出 ValueError"""
+        self.state_service.validate_pump(chamber_id, pump_name)
+        command = self._new_command('pump', line_id, chamber_id, pump_name, action)
+        self._schedule(
+            command,
+            device_key=device_key('pump', chamber_id, pump_name),
+            begin=None,
+            finish=lambda: self.state_service.toggle_pump(
+                line_id, chamber_id, pump_name, action, operator_name, operator_role
+            ),
+            duration=random.uniform(*self.PUMP_SWITCH_TIME),
+        )
+        return command
+
+    def submit_batch(
+        self,
+        steps: List[BatchStep],
+        mode: str = 'atomic',
+        operator_name: str = "Admin",
+        operator_role: str = "admin"
+    ) -> Tuple[bool, List[BatchStepResult]]:
+        """
+        批量指令：作用于有未完成（执行中或排队中）指令的设备的步骤失败，
+        其余按 StateService.apply_batch 的 atomic/ordered 语义执行。
+        可在线程池中调用（等待写者锁时不阻塞事件循环）：检查与执行在同一次持有写者锁期间完成，
+        指令的开始与完成都需要写者锁，其间不会有指令改变设备。
+        """
+        with self.state_service.locked():
+            busy = sorted(key for key, task in tuple(self._device_tails.items()) if not task.done())
+            return self.state_service.apply_batch(steps, mode, operator_name, operator_role, busy_devices=busy)
+
+    def get_command(self, command_id: str) -> Optional[DeviceCommand]:
+        return self._commands.get(command_id)
+
+    async def wait_for(self, command_id: str, timeout: Optional[float] = None) -> Optional[DeviceCommand]:
+        """等待指令执行结束（或超时），返回指令当前状态"""
+        command = self._commands.get(command_id)
+        if not command:
+            return None
+        event = self._done_events.get(command_id)
+        if event and not event.is_set():
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return command
+
+    def _new_command(self, kind: str, line_id: str, chamber_id: str, target: str, action: str) -> DeviceCommand:
+        command = DeviceCommand(
+            id=f"cmd-{uuid.uuid4().hex[:12]}",
+            kind=kind,
+            lineId=line_id,
+            chamberId=chamber_id,
+            target=target,
+            action=action,
+            createdAt=time.time(),
+        )
+        self._commands[command.id] = command
+        self._done_events[command.id] = asyncio.Event()
+        self._prune_history()
+        return command
+
+    def _schedule(
+        self,
+        command: DeviceCommand,
+        device_key: str,
+        begin: Optional[Callable[[], Any]],
+        finish: Callable[[], None],
+        duration: float,
+        rollback: Optional[Callable[[Any], None]] = None
+    ):
+        """
+        begin 进入过渡态并返回动作前的状态，finish 完成动作；
+        finish 失败时以 begin 的返回值调用 rollback 撤销过渡态
+        """
+        previous = self._device_tails.get(device_key)
+        started = None
+        if previous is None or previous.done():
+            # 设备空闲：立即进入过渡态，响应中即可看到 running
+            previous = None
+            try:
+                started = self._start(command, begin)
+            except Exception as e:
+                self._fail(command, e)
+                return
+        task = asyncio.get_running_loop().create_task(
+            self._run(command, previous, started, begin, finish, duration, rollback)
+        )
+        self._device_tails[device_key] = task
+        task.add_done_callback(lambda t: self._release_device(device_key, t))
+
+    async def _run(
+        self,
+        command: DeviceCommand,
+        previous: Optional[asyncio.Task],
+        started: Any,
+        begin: Optional[Callable[[], Any]],
+        finish: Callable[[], None],
+        duration: float,
+        rollback: Optional[Callable[[Any], None]]
+    ):
+        in_transition = previous is None
+        try:
+            if previous is not None:
+                # 前序指令的失败不影响本指令
+                await asyncio.wait({previous})
+                started = self._start(command, begin)
+                in_transition = True
+            await asyncio.sleep(duration)
+            finish()
+            command.status = CommandStatus.completed
+        except Exception as e:
+            if in_transition and rollback is not None:
+                try:
+                    rollback(started)
+                except Exception as rollback_error:
+                    self._rollback_failed(command, rollback_error)
+            command.status = CommandStatus.failed
+            command.error = str(e)
+        finally:
+            command.completedAt = time.time()
+            self._done_events[command.id].set()
+
+    def _start(self, command: DeviceCommand, begin: Optional[Callable[[], Any]]) -> Any:
+        command.status = CommandStatus.running
+        command.startedAt = time.time()
+        if begin:
+            return begin()
+        return None
+
+    def _rollback_failed(self, command: DeviceCommand, error: Exception):
+        """撤销失败：记录在指令上，并以 error 级别写入系统日志（同步写入历史事件）"""
+        command.rollbackError = str(error)
+        try:
+            self.state_service.add_system_log(
+                f"指令 {command.id} 执行失败后撤销失败：{command.chamberId} {command.target} 可能停留在过渡态 ({error})",
+                'error'
+            )
+        except Exception as e:
+            print(f"Error logging rollback failure of command {command.id}: {e}")
+
+    def _fail(self, command: DeviceCommand, error: Exception):
+        command.status = CommandStatus.failed
+        command.error = str(error)
+        command.completedAt = time.time()
+        self._done_events[command.id].set()
+
+    def _release_device(self, device_key: str, task: asyncio.Task):
+        if self._device_tails.get(device_key) is task:
+            del self._device_tails[device_key]
+
+    def _prune_history(self):
+        """丢弃最早的已结束指令，限制内存占用"""
+        while len(self._commands) > self.HISTORY_LIMIT:
+            oldest_id = next(
+                (cid for cid, cmd in self._commands.items()
+                 if cmd.status in (CommandStatus.completed, CommandStatus.failed)),
+                None
+            )
+            if oldest_id is None:
+                break
+            del self._commands[oldest_id]
+            self._done_events.pop(oldest_id, None)
+
+
+# 全局单例
+_command_service_instance: Optional[CommandService] = None
+
+def get_command_service() -> CommandService:
+    global _command_service_instance
+    if _command_service_instance is None:
+        _command_service_instance = CommandService()
+    return _command_service_instance
@@ -5,9 +5,12 @@
 import sqlite3
 import time
 import os
+import queue
 import threading
 from typing import Dict, List, Tuple, Literal, Optional
 
+from app.services.clock_service import get_clock
+
 class HistoryService:
     """
     历史数据服务 (SQLite版)
@@ -22,6 +25,25 @@ class HistoryService:
     # 数据保留时长（24小时）
     RETENTION_PERIOD = 24 * 3600
     
+    # 报警记录保留时长（30天，只清理已结束的报警）
+    ALARM_RETENTION_PERIOD = 30 * 24 * 3600
+    
+    # 事件异步写入：单批最大条数 / 最长攒批等待 (秒)
+    EVENT_BATCH_SIZE = 200
+    EVENT_FLUSH_INTERVAL = 0.5
+    
+    # 报警状态变化 -> 对 alarm_history 的更新（参数：时刻, 时刻, 报警 ID），只作用于未结束的那一行
+    ALARM_UPDATES = {
+        'acknowledged': "UPDATE alarm_history SET acked_at = ?, closed_at = CASE WHEN cleared_at IS NULL THEN NULL ELSE ? END "
+                        "WHERE alarm_id = ? AND closed_at IS NULL",
+        'cleared': "UPDATE alarm_history SET cleared_at = ?, closed_at = CASE WHEN acked_at IS NULL THEN NULL ELSE ? END "
+                   "WHERE alarm_id = ? AND closed_at IS NULL",
+        'reset': "UPDATE alarm_history SET acked_at = COALESCE(acked_at, ?), closed_at = ? "
+                 "WHERE alarm_id = ? AND closed_at IS NULL",
+        'removed': "UPDATE alarm_history SET cleared_at = COALESCE(cleared_at, ?), closed_at = ? "
+                   "WHERE alarm_id = ? AND closed_at IS NULL",
+    }
+    
     def __init__(self):
         # 确保目录存在
         os.makedirs(os.path.dirname(self.DB_PATH), exist_ok=True)
@@ -33,6 +55,16 @@ class HistoryService:
         # 这里我们使用简单的模式：每次操作打开新连接，利用SQLite的锁机制
         self._lock = threading.RLock()
         
+        # 事件异步写入队列：请求线程只负责入队，由后台线程攒批写库
+        self._event_queue: "queue.Queue[tuple]" = queue.Queue()
+        self._event_thread = threading.Thread(target=self._event_writer_loop, daemon=True)
+        self._event_thread.start()
+        
+        # 报警状态变化按发生顺序由独立的后台线程写入
+        self._alarm_queue: "queue.Queue[dict]" = queue.Queue()
+        self._alarm_thread = threading.Thread(target=self._alarm_writer_loop, daemon=True)
+        self._alarm_thread.start()
+        
         # 启动清理线程
         self._cleanup_running = False
         self._cleanup_thread: Optional[threading.Thread] = None
@@ -92,6 +124,58 @@ class HistoryService:
             """)
             conn.execute("CREATE INDEX IF NOT EXISTS idx_event_timestamp ON system_events (timestamp)")
             
+            # 预聚合表：每个时间桶一行 (桶起始时刻, 最小/最大/均值/末值, 样本数)；均值同时写入 history_data
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS history_aggregates (
+                    entity_id TEXT NOT NULL,
+                    metric TEXT NOT NULL,
+                    timestamp REAL NOT NULL,
+                    min REAL NOT NULL,
+                    max REAL NOT NULL,
+                    mean REAL NOT NULL,
+                    last REAL NOT NULL,
+                    count INTEGER NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_agg_entity_metric_time ON history_aggregates (entity_id, metric, timestamp)")
+            
+            # 报警前后的原始样本抓取
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS history_raw (
+                    entity_id TEXT NOT NULL,
+                    metric TEXT NOT NULL,
+                    timestamp REAL NOT NULL,
+                    value REAL NOT NULL,
+                    reason TEXT NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_raw_entity_metric_time ON history_raw (entity_id, metric, timestamp)")
+            
+            # 报警记录：每次报警一行，closed_at 为空表示尚未结束（越限中或未确认）
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS alarm_history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    alarm_id TEXT NOT NULL,
+                    code TEXT NOT NULL,
+                    severity TEXT NOT NULL,
+                    entity_type TEXT NOT NULL,
+                    entity_id TEXT NOT NULL,
+                    line_id TEXT,
+                    message TEXT NOT NULL,
+                    limit_value REAL,
+                    trigger_value REAL,
+                    raised_at REAL NOT NULL,
+                    acked_at REAL,
+                    cleared_at REAL,
+                    closed_at REAL
+                )
+            """)
+            # 部分索引只包含未结束的报警：当前报警列表与状态更新不随历史增长变慢
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_alarm_open ON alarm_history (raised_at) WHERE closed_at IS NULL")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_alarm_open_id ON alarm_history (alarm_id) WHERE closed_at IS NULL")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_alarm_entity_time ON alarm_history (entity_id, raised_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_alarm_time ON alarm_history (raised_at)")
+            
             conn.commit()
 
     def start_cleanup_thread(self):
@@ -123,17 +207,9 @@ class HistoryService:
         
         while self._cleanup_running:
             try:
-                state = state_service.get_state()
-                # 序列化状态
-                import json
-                # 处理 Pydantic 兼容性
-                if hasattr(state, "model_dump_json"):
-                    snapshot_json = state.model_dump_json()
-                else:
-                    # 备选方案
-                    snapshot_json = json.dumps(state, default=lambda x: str(x))
-                
-                self.record_snapshot(snapshot_json, state.timestamp / 1000.0)
+                # 读取已发布的一代状态，复用其缓存的序列化结果
+                generation = state_service.get_generation()
+                self.record_snapshot(generation.to_json(), generation.state.timestamp / 1000.0)
             except Exception as e:
                 print(f"Error taking snapshot: {e}")
             
@@ -185,7 +261,7 @@ class HistoryService:
     def record_event(self, type: str, content: str, level: str, timestamp: Optional[float] = None):
         """记录一个系统事件（用于时间轴标记）"""
         if timestamp is None:
-            timestamp = time.time()
+            timestamp = get_clock().now()
         try:
             with self._get_conn() as conn:
                 conn.execute(
@@ -196,6 +272,158 @@ class HistoryService:
         except Exception as e:
             print(f"Error recording event: {e}")
 
+    def record_event_async(self, type: str, content: str, level: str, timestamp: Optional[float] = None):
+        """异步记录系统事件：仅入队，不在调用线程上打开数据库连接"""
+        if timestamp is None:
+            timestamp = get_clock().now()
+        self._event_queue.put((timestamp, type, content, level))
+
+    def flush_events(self, timeout: float = 2.0):
+        """等待已入队的事件与报警记录全部落库（用于关闭前）"""
+        deadline = time.time() + timeout
+        while (self._event_queue.unfinished_tasks or self._alarm_queue.unfinished_tasks) and time.time() < deadline:
+            time.sleep(0.01)
+
+    def _take_batch(self, source: queue.Queue) -> list:
+        """阻塞取一条，再在 EVENT_FLUSH_INTERVAL 内攒批"""
+        batch = [source.get()]
+        deadline = time.time() + self.EVENT_FLUSH_INTERVAL
+        while len(batch) < self.EVENT_BATCH_SIZE:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(source.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _event_writer_loop(self):
+        """后台事件写入线程：攒批后单事务 executemany 写入"""
+        while True:
+            batch = self._take_batch(self._event_queue)
+            try:
+                with self._get_conn() as conn:
+                    conn.executemany(
+                        "INSERT INTO system_events (timestamp, type, content, level) VALUES (?, ?, ?, ?)",
+                        batch
+                    )
+                    conn.commit()
+            except Exception as e:
+                print(f"Error writing event batch: {e}")
+            finally:
+                for _ in batch:
+                    self._event_queue.task_done()
+
+    # ==================== 报警记录 ====================
+
+    def record_alarm_events_async(self, events: List[Dict]):
+        """报警引擎的状态变化事件入队，由后台线程按顺序写入 alarm_history"""
+        for event in events:
+            self._alarm_queue.put(event)
+
+    def _alarm_writer_loop(self):
+        """后台报警写入线程：一批状态变化按发生顺序在一个事务内应用"""
+        while True:
+            batch = self._take_batch(self._alarm_queue)
+            try:
+                with self._get_conn() as conn:
+                    for event in batch:
+                        if event['transition'] == 'raised':
+                            conn.execute(
+                                """
+                                INSERT INTO alarm_history (alarm_id, code, severity, entity_type, entity_id, line_id,
+                                                           message, limit_value, trigger_value, raised_at)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                """,
+                                (event['id'], event['code'], event['severity'], event['entityType'], event['entityId'],
+                                 event['lineId'], event['message'], event['limit'], event['triggerValue'], event['timestamp'])
+                            )
+                        elif event['transition'] in self.ALARM_UPDATES:
+                            conn.execute(
+                                self.ALARM_UPDATES[event['transition']],
+                                (event['timestamp'], event['timestamp'], event['id'])
+                            )
+                    conn.commit()
+            except Exception as e:
+                print(f"Error writing alarm batch: {e}")
+            finally:
+                for _ in batch:
+                    self._alarm_queue.task_done()
+
+    def close_open_alarms(self, timestamp: float) -> int:
+        """结束上次运行遗留的未结束报警（报警状态不跨进程保留，仍越限的会重新报警），返回结束数"""
+        try:
+            with self._get_conn() as conn:
+                cursor = conn.execute(
+                    "UPDATE alarm_history SET cleared_at = COALESCE(cleared_at, ?), closed_at = ? WHERE closed_at IS NULL",
+                    (timestamp, timestamp)
+                )
+                conn.commit()
+                return cursor.rowcount
+        except Exception as e:
+            print(f"Error closing open alarms: {e}")
+            return 0
+
+    def query_alarms(
+        self,
+        start_time: Optional[float] = None,
+        end_time: Optional[float] = None,
+        entity_id: Optional[str] = None,
+        line_id: Optional[str] = None,
+        active_only: bool = False,
+        limit: int = 500
+    ) -> List[Dict]:
+        """查询报警记录（按报警时刻倒序）：当前未结束 / 按实体 / 按时间段"""
+        conditions, params = [], []
+        if active_only:
+            conditions.append("closed_at IS NULL")
+        if entity_id is not None:
+            conditions.append("entity_id = ?")
+            params.append(entity_id)
+        if line_id is not None:
+            conditions.append("line_id = ?")
+            params.append(line_id)
+        if start_time is not None:
+            conditions.append("raised_at >= ?")
+            params.append(start_time)
+        if end_time is not None:
+            conditions.append("raised_at <= ?")
+            params.append(end_time)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        try:
+            with self._get_conn() as conn:
+                cursor = conn.execute(
+                    f"""
+                    SELECT alarm_id, code, severity, entity_type, entity_id, line_id, message,
+                           limit_value, trigger_value, raised_at, acked_at, cleared_at, closed_at
+                    FROM alarm_history {where}
+                    ORDER BY raised_at DESC
+                    LIMIT ?
+                    """,
+                    (*params, limit)
+                )
+                return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"Error querying alarms: {e}")
+            return []
+
+    def query_alarm_counts(self, entity_type: str) -> List[Tuple[str, int, float, float]]:
+        """各实体的报警次数与首次/最近一次报警时刻（启动时恢复 MTBF 统计）"""
+        try:
+            with self._get_conn() as conn:
+                cursor = conn.execute(
+                    """
+                    SELECT entity_id, COUNT(*), MIN(raised_at), MAX(raised_at)
+                    FROM alarm_history WHERE entity_type = ? GROUP BY entity_id
+                    """,
+                    (entity_type,)
+                )
+                return [tuple(row) for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"Error querying alarm counts: {e}")
+            return []
+
     def query_events(self, start_time: float, end_time: float) -> List[Dict]:
         """查询指定时间段内的事件记录"""
         try:
@@ -217,10 +445,16 @@ class HistoryService:
 
     def cleanup_old_data(self):
         """清理超过保留期的数据"""
-        cutoff_time = time.time() - self.RETENTION_PERIOD
+        cutoff_time = get_clock().now() - self.RETENTION_PERIOD
         try:
             with self._get_conn() as conn:
                 conn.execute("DELETE FROM history_data WHERE timestamp < ?", (cutoff_time,))
+                conn.execute("DELETE FROM history_aggregates WHERE timestamp < ?", (cutoff_time,))
+                conn.execute("DELETE FROM history_raw WHERE timestamp < ?", (cutoff_time,))
+                conn.execute(
+                    "DELETE FROM alarm_history WHERE closed_at IS NOT NULL AND raised_at < ?",
+                    (get_clock().now() - self.ALARM_RETENTION_PERIOD,)
+                )
                 conn.commit()
                 # VACUUM 可能会锁库较久，视情况执行
                 # conn.execute("VACUUM") 
@@ -236,7 +470,7 @@ class HistoryService:
     ):
         """记录一条或多条数据"""
         if timestamp is None:
-            timestamp = time.time()
+            timestamp = get_clock().now()
             
         try:
             with self._get_conn() as conn:
@@ -286,6 +520,71 @@ class HistoryService:
         except Exception as e:
             print(f"Error recording data batch: {e}")
 
+    def record_aggregates(self, rows: List[Tuple], raw_rows: Optional[List[Tuple]] = None):
+        """
+        批量写入预聚合结果（一个事务）
+        rows: (entity_id, metric, 桶起始时刻, min, max, mean, last, count)
+        raw_rows: (entity_id, metric, timestamp, value, reason)
+        """
+        if not rows and not raw_rows:
+            return
+        try:
+            with self._get_conn() as conn:
+                if rows:
+                    conn.executemany(
+                        "INSERT INTO history_aggregates (entity_id, metric, timestamp, min, max, mean, last, count) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        rows
+                    )
+                    # 均值写入明细表，已有的历史查询与曲线不受影响
+                    conn.executemany(
+                        "INSERT INTO history_data (entity_id, metric, timestamp, value) VALUES (?, ?, ?, ?)",
+                        [(row[0], row[1], row[2], row[5]) for row in rows]
+                    )
+                if raw_rows:
+                    conn.executemany(
+                        "INSERT INTO history_raw (entity_id, metric, timestamp, value, reason) VALUES (?, ?, ?, ?, ?)",
+                        raw_rows
+                    )
+                conn.commit()
+        except Exception as e:
+            print(f"Error recording aggregates: {e}")
+
+    def query_aggregates(self, entity_id: str, metric: str, start_time: float, end_time: float) -> List[Dict]:
+        """查询预聚合数据 (timestamp, min, max, mean, last, count)"""
+        try:
+            with self._get_conn() as conn:
+                cursor = conn.execute(
+                    """
+                    SELECT timestamp, min, max, mean, last, count
+                    FROM history_aggregates
+                    WHERE entity_id = ? AND metric = ? AND timestamp BETWEEN ? AND ?
+                    ORDER BY timestamp ASC
+                    """,
+                    (entity_id, metric, start_time, end_time)
+                )
+                return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"Error querying aggregates: {e}")
+            return []
+
+    def query_raw(self, entity_id: str, metric: str, start_time: float, end_time: float) -> List[Dict]:
+        """查询报警前后抓取的原始样本"""
+        try:
+            with self._get_conn() as conn:
+                cursor = conn.execute(
+                    """
+                    SELECT timestamp, value, reason
+                    FROM history_raw
+                    WHERE entity_id = ? AND metric = ? AND timestamp BETWEEN ? AND ?
+                    ORDER BY timestamp ASC
+                    """,
+                    (entity_id, metric, start_time, end_time)
+                )
+                return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"Error querying raw samples: {e}")
+            return []
+
     def query_data(
         self,
         entity_id: str,
@@ -0,0 +1,272 @@
+"""
+HTTP API 轮询驱动与本地替身网关
+
+每条线体对应网关上的一个 JSON 端点 GET {base}/lines/{线体 ID}/telemetry，响应为
+{"chambers": {腔体 ID: 读数}}（也接受 [{"id": 腔体 ID, ...读数}] 列表形式）。
+
+各端点由独立的轮询协程并发拉取：周期取 pollingInterval，每次在 ±JITTER 范围内随机抖动，
+首次拉取的相位在一个周期内随机分布，避免所有网关在同一时刻被请求。
+所有请求共用一个 httpx.AsyncClient 的长连接池，同一主机的并发请求数受 PER_HOST_CONCURRENCY 限制；
+单个端点失败时按指数退避，不影响其他端点。拉取结果合并进本周期的批次，
+由采集循环每个周期取走一次，经批量写入链路更新状态与历史（不逐设备写入）。
+"""
+
+import asyncio
+import json
+import random
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from app.models import HardwareConfig, ProtocolType, SystemState
+from app.services.acquisition_service import (
+    MAX_RECONNECT_BACKOFF, RECONNECT_BACKOFF,
+    AcquisitionDriver, SimulatedPlant, clean_reading, line_of_chambers, register_driver,
+)
+
+ENDPOINT_PATH = '/lines/{line_id}/telemetry'
+
+# 连接池与并发
+POOL_SIZE = 16
+PER_HOST_CONCURRENCY = 4
+# 超时 (秒)：连接 / 整体请求
+CONNECT_TIMEOUT = 2.0
+REQUEST_TIMEOUT = 2.0
+# 轮询周期的随机抖动比例
+JITTER = 0.1
+# 延迟的滑动平均系数
+LATENCY_SMOOTHING = 0.1
+
+
+def parse_telemetry(body) -> Dict[str, dict]:
+    """网关响应 -> {腔体 ID: 读数}"""
+    chambers = body.get('chambers') if isinstance(body, dict) else None
+    if isinstance(chambers, dict):
+        return {cid: reading for cid, reading in chambers.items() if isinstance(reading, dict)}
+    if isinstance(chambers, list):
+        return {item['id']: {k: v for k, v in item.items() if k != 'id'} for item in chambers if isinstance(item, dict) and isinstance(item.get('id'), str)}
+    raise ValueError("Unexpected telemetry response")
+
+
+class _Endpoint:
+    __slots__ = ('line_id', 'url', 'host', 'failures', 'last_ok', 'last_error')
+
+    def __init__(self, line_id: str, url: str):
+        self.line_id = line_id
+        self.url = url
+        self.host = urlsplit(url).netloc
+        self.failures = 0
+        self.last_ok: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+
+class HttpPollingDriver(AcquisitionDriver):
+    """按线体并发轮询网关 JSON 端点"""
+    protocol = ProtocolType.http_api.value
+
+    def __init__(self, config: HardwareConfig, state: SystemState):
+        self.base_url = f"http://{config.ipAddress}:{config.port}"
+        self.period = max(0.05, config.pollingInterval / 1000.0)
+        self.line_of = line_of_chambers(state)
+        self.endpoints = [
+            _Endpoint(line.id, self.base_url + ENDPOINT_PATH.format(line_id=line.id)) for line in state.lines
+        ]
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_limits: Dict[str, asyncio.Semaphore] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._batch: Dict[str, dict] = {}
+        self._rng = random.Random()
+
+        # 指标
+        self.requests = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.decode_errors = 0
+        self.last_latency = 0.0
+        self.mean_latency = 0.0
+        self.max_latency = 0.0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def _start(self):
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE),
+        )
+        for endpoint in self.endpoints:
+            self._host_limits.setdefault(endpoint.host, asyncio.Semaphore(PER_HOST_CONCURRENCY))
+            self._tasks.append(asyncio.create_task(self._poll_endpoint(endpoint)))
+
+    async def _poll_endpoint(self, endpoint: _Endpoint):
+        # 首次拉取的相位在一个周期内随机分布
+        await asyncio.sleep(self._rng.uniform(0, self.period))
+        while True:
+            if await self._fetch(endpoint):
+                endpoint.failures = 0
+                delay = self.period
+            else:
+                endpoint.failures += 1
+                delay = min(MAX_RECONNECT_BACKOFF, RECONNECT_BACKOFF * 2 ** (endpoint.failures - 1))
+            await asyncio.sleep(delay * self._rng.uniform(1 - JITTER, 1 + JITTER))
+
+    async def _fetch(self, endpoint: _Endpoint) -> bool:
+        async with self._host_limits[endpoint.host]:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            started = time.perf_counter()
+            try:
+                response = await self._client.get(endpoint.url)
+                response.raise_for_status()
+                readings = parse_telemetry(response.json())
+            except httpx.TimeoutException as e:
+                self.timeouts += 1
+                return self._failed(endpoint, e)
+            except (httpx.HTTPError, ValueError) as e:
+                return self._failed(endpoint, e)
+            finally:
+                self.in_flight -= 1
+                self.requests += 1
+        latency = time.perf_counter() - started
+        self.last_latency = latency
+        self.max_latency = max(self.max_latency, latency)
+        self.mean_latency += (latency - self.mean_latency) * LATENCY_SMOOTHING
+
+        for chamber_id, reading in readings.items():
+            # 只接受属于该线体的腔体
+            if self.line_of.get(chamber_id) != endpoint.line_id:
+                self.rejected += 1
+                continue
+            # 类型不符的字段计为解码错误并丢弃
+            reading, bad = clean_reading(reading)
+            self.decode_errors += bad
+            merged = self._batch.setdefault(chamber_id, {})
+            valves = reading.get('valves')
+            merged.update({k: v for k, v in reading.items() if k != 'valves'})
+            if isinstance(valves, dict):
+                merged.setdefault('valves', {}).update(valves)
+        endpoint.last_ok = time.monotonic()
+        endpoint.last_error = None
+        return True
+
+    def _failed(self, endpoint: _Endpoint, error: Exception) -> bool:
+        self.failures += 1
+        endpoint.last_error = f"{type(error).__name__}: {error}"
+        return False
+
+    async def poll(self) -> Dict[str, dict]:
+        if self._client is None:
+            self._start()
+        batch, self._batch = self._batch, {}
+        if not batch and self.endpoints and all(e.failures for e in self.endpoints):
+            # 全部端点连续失败：交给采集循环计数与退避（各端点的轮询协程继续按自身退避重试）
+            raise ConnectionError(self.endpoints[0].last_error or "All gateway endpoints failing")
+        return batch
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def metrics(self) -> dict:
+        now = time.monotonic()
+        return {
+            'endpoints': len(self.endpoints),
+            'healthyEndpoints': sum(1 for e in self.endpoints if e.last_ok is not None and not e.failures),
+            'requests': self.requests,
+            'failures': self.failures,
+            'timeouts': self.timeouts,
+            'rejectedReadings': self.rejected,
+            'decodeErrors': self.decode_errors,
+            'lastLatency': self.last_latency,
+            'meanLatency': self.mean_latency,
+            'maxLatency': self.max_latency,
+            'maxInFlight': self.max_in_flight,
+            'stalestEndpointAge': max(
+                (now - e.last_ok for e in self.endpoints if e.last_ok is not None), default=None
+            ),
+        }
+
+
+class HttpStandInGateway:
+    """本地 HTTP 网关替身（HTTP/1.1 长连接）：按线体返回替身数据源的读数"""
+
+    def __init__(self, plant: SimulatedPlant):
+        self.plant = plant
+        self.connections = 0
+        self.requests = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._writers = set()
+
+    async def start(self, host: str, port: int):
+        self._server = await asyncio.start_server(self._handle, host, port)
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._writers):
+                writer.close()
+            await asyncio.sleep(0.05)
+            await self._server.wait_closed()
+            self._server = None
+
+    def _route(self, method: str, path: str):
+        parts = path.split('?')[0].strip('/').split('/')
+        if method != 'GET' or len(parts) != 3 or parts[0] != 'lines' or parts[2] != 'telemetry':
+            return 404, {'detail': 'Not found'}
+        line_id = parts[1]
+        readings = self.plant.readings()
+        chambers = {cid: reading for cid, reading in readings.items() if self.plant.line_of[cid] == line_id}
+        if not chambers:
+            return 404, {'detail': f'Line not found: {line_id}'}
+        return 200, {'lineId': line_id, 'chambers': chambers}
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        self._writers.add(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                if int(headers.get('content-length', 0)):
+                    await reader.readexactly(int(headers['content-length']))
+                status, body = self._route(method, path)
+                self.requests += 1
+                payload = json.dumps(body).encode('utf-8')
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Not Found'}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + payload
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, OSError, ValueError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+
+async def start_standin(plant: SimulatedPlant, config: HardwareConfig) -> HttpStandInGateway:
+    gateway = HttpStandInGateway(plant)
+    await gateway.start(config.ipAddress, config.port)
+    return gateway
+
+
+register_driver(ProtocolType.http_api, HttpPollingDriver, start_standin)
@@ -0,0 +1,290 @@
+"""
+高频采样的边缘预聚合 - 采集驱动/仿真器与 HistoryService 之间的写入层
+
+规范的真空规、热电偶以 10–50 Hz 上报时逐点写入 SQLite 会拖垮数据库。本模块把每个序列
+（实体 ID + 指标）的原始样本累计到按时间桶 (DataConfig.aggregationInterval) 划分的
+min / max / sum / count / last 中，时间桶结束时整批写入 history_aggregates（均值同时写入 history_data，
+原有历史查询不受影响）。
+
+所有序列的累计量放在预分配的 NumPy 数组中（容量不足时成倍扩容），一批样本用 ufunc.at 一次累计。
+每个序列另有一个定长环形缓冲保存最近的原始样本；capture() 触发时（报警、故障注入）
+把触发前 rawCaptureSeconds 秒的样本与触发后同样时长内到达的样本写入 history_raw。
+"""
+
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.services.settings_service import SettingsService
+
+# 历史数据的指标名
+METRICS = ('temperature', 'vacuum')
+
+# 初始预分配的序列数
+INITIAL_SERIES = 256
+# 每个序列原始样本环形缓冲的长度（50 Hz 下约 10 秒）
+RAW_RING = 512
+
+
+class IngestAggregator:
+    """按时间桶预聚合所有序列的样本（线程安全：仿真线程与采集线程都会写入）"""
+
+    def __init__(self, history_service):
+        self.history_service = history_service
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, str], int] = {}
+        self._keys: List[Tuple[str, str]] = []
+        self._allocate(INITIAL_SERIES)
+        self._bucket: Optional[int] = None
+        self._interval, self._raw_seconds = self._settings()
+        # 已结束、待写出的聚合行与原始样本
+        self._closed_rows: List[Tuple] = []
+        self._raw_pending: List[Tuple] = []
+        self._capture_reason: Dict[int, str] = {}
+
+        # 指标
+        self.samples = 0
+        self.late_samples = 0
+        self.buckets = 0
+        self.persisted_rows = 0
+        self.raw_rows = 0
+        self.captures = 0
+
+    @staticmethod
+    def _settings() -> Tuple[float, float]:
+        data = SettingsService().get_settings().data
+        return max(0.01, data.aggregationInterval), max(0.0, data.rawCaptureSeconds)
+
+    # ==================== 预分配缓冲 ====================
+
+    def _allocate(self, capacity: int):
+        old = len(getattr(self, '_count', ()))
+        grown = {
+            '_min': np.full(capacity, np.inf),
+            '_max': np.full(capacity, -np.inf),
+            '_sum': np.zeros(capacity),
+            '_count': np.zeros(capacity, dtype=np.int64),
+            '_last': np.zeros(capacity),
+            '_last_time': np.full(capacity, -np.inf),
+            '_ring_values': np.zeros((capacity, RAW_RING)),
+            '_ring_times': np.full((capacity, RAW_RING), -np.inf),
+            '_ring_pos': np.zeros(capacity, dtype=np.int64),
+            # 原始样本抓取：抓取截止时刻 / 已写出的最晚样本时刻（避免重叠抓取重复写出）
+            '_capture_until': np.full(capacity, -np.inf),
+            '_captured_through': np.full(capacity, -np.inf),
+        }
+        for name, array in grown.items():
+            if old:
+                array[:old] = getattr(self, name)
+            setattr(self, name, array)
+
+    def _index(self, entity_id: str, metric: str) -> int:
+        key = (entity_id, metric)
+        index = self._series.get(key)
+        if index is None:
+            index = len(self._keys)
+            if index >= len(self._count):
+                self._allocate(2 * len(self._count))
+            self._series[key] = index
+            self._keys.append(key)
+        return index
+
+    # ==================== 写入 ====================
+
+    def ingest(self, items: List[Dict]):
+        """record_data_batch 格式的一批数据：{'entity_id', 'timestamp', 'temperature'?, 'vacuum'?}"""
+        series, values, times = [], [], []
+        with self._lock:
+            for item in items:
+                for metric in METRICS:
+                    value = item.get(metric)
+                    if value is not None:
+                        series.append(self._index(item['entity_id'], metric))
+                        values.append(value)
+                        times.append(item['timestamp'])
+        self._ingest(series, values, times)
+
+    def ingest_samples(self, entity_ids: Sequence[str], metric: str, values: Sequence[float], times: Sequence[float]):
+        """同一指标的一批原始样本（高频驱动使用）"""
+        with self._lock:
+            series = [self._index(entity_id, metric) for entity_id in entity_ids]
+        self._ingest(series, values, times)
+
+    def _ingest(self, series, values, times):
+        if not series:
+            return
+        index = np.asarray(series, dtype=np.int64)
+        value = np.asarray(values, dtype=np.float64)
+        when = np.asarray(times, dtype=np.float64)
+        with self._lock:
+            completed = self._accumulate(index, value, when)
+            persist = self._take_pending() if completed else None
+        if persist:
+            self._persist(*persist)
+
+    def _accumulate(self, index: np.ndarray, value: np.ndarray, when: np.ndarray) -> bool:
+        """累计一批样本，返回是否有时间桶结束"""
+        self.samples += len(index)
+        self._record_raw(index, value, when)
+
+        completed = False
+        interval, self._raw_seconds = self._settings()
+        if interval != self._interval:
+            # 时间桶设置变更：结束当前时间桶，按新桶宽重新对齐
+            if self._bucket is not None:
+                self._close_bucket()
+                completed = True
+            self._bucket = None
+            self._interval = interval
+
+        buckets = np.floor(when / self._interval).astype(np.int64)
+        if self._bucket is None:
+            self._bucket = int(buckets.min())
+        # 迟到的样本（早于当前时间桶）并入当前时间桶
+        late = buckets < self._bucket
+        if late.any():
+            self.late_samples += int(late.sum())
+            buckets[late] = self._bucket
+
+        for bucket in np.unique(buckets):
+            if bucket > self._bucket:
+                self._close_bucket()
+                self._bucket = int(bucket)
+                completed = True
+            selected = buckets == bucket
+            self._fold(index[selected], value[selected], when[selected])
+        return completed
+
+    def _fold(self, index: np.ndarray, value: np.ndarray, when: np.ndarray):
+        np.minimum.at(self._min, index, value)
+        np.maximum.at(self._max, index, value)
+        np.add.at(self._sum, index, value)
+        np.add.at(self._count, index, 1)
+        # 末值：每个序列时间最晚的样本
+        order = np.lexsort((when, index))
+        index, value, when = index[order], value[order], when[order]
+        last = np.append(index[1:] != index[:-1], True)
+        newer = when[last] >= self._last_time[index[last]]
+        self._last[index[last][newer]] = value[last][newer]
+        self._last_time[index[last][newer]] = when[last][newer]
+
+    def _record_raw(self, index: np.ndarray, value: np.ndarray, when: np.ndarray):
+        """原始样本写入环形缓冲；处于抓取窗口内的样本直接进入待写出列表"""
+        order = np.lexsort((when, index))
+        index, value, when = index[order], value[order], when[order]
+        starts = np.append(True, index[1:] != index[:-1])
+        group_start = np.maximum.accumulate(np.where(starts, np.arange(len(index)), 0))
+        rank = np.arange(len(index)) - group_start
+        counts = np.bincount(index, minlength=len(self._ring_pos))
+        # 单批超过环形缓冲长度时只保留最新的 RAW_RING 个
+        keep = rank >= counts[index] - RAW_RING
+        slot = (self._ring_pos[index] + rank) % RAW_RING
+        self._ring_values[index[keep], slot[keep]] = value[keep]
+        self._ring_times[index[keep], slot[keep]] = when[keep]
+        self._ring_pos += counts[:len(self._ring_pos)]
+
+        live = when <= self._capture_until[index]
+        if live.any():
+            for i, v, t in zip(index[live].tolist(), value[live].tolist(), when[live].tolist()):
+                if t > self._captured_through[i]:
+                    entity_id, metric = self._keys[i]
+                    self._raw_pending.append((entity_id, metric, t, v, self._capture_reason.get(i, 'capture')))
+            np.maximum.at(self._captured_through, index[live], when[live])
+
+    def _close_bucket(self):
+        """当前时间桶结束：生成有样本的序列的聚合行并清零累计量"""
+        active = np.flatnonzero(self._count[:len(self._keys)])
+        if not len(active):
+            return
+        start = self._bucket * self._interval
+        mean = self._sum[active] / self._count[active]
+        rows = self._closed_rows
+        for i, lo, hi, avg, last, count in zip(
+            active.tolist(), self._min[active].tolist(), self._max[active].tolist(),
+            mean.tolist(), self._last[active].tolist(), self._count[active].tolist()
+        ):
+            entity_id, metric = self._keys[i]
+            rows.append((entity_id, metric, start, lo, hi, avg, last, count))
+        self._min[active] = np.inf
+        self._max[active] = -np.inf
+        self._sum[active] = 0.0
+        self._count[active] = 0
+        self.buckets += 1
+
+    def _take_pending(self) -> Tuple[List[Tuple], List[Tuple]]:
+        rows, self._closed_rows = self._closed_rows, []
+        raw, self._raw_pending = self._raw_pending, []
+        return rows, raw
+
+    def _persist(self, rows: List[Tuple], raw: List[Tuple]):
+        """在锁外写库"""
+        self.history_service.record_aggregates(rows, raw)
+        self.persisted_rows += len(rows)
+        self.raw_rows += len(raw)
+
+    def flush(self):
+        """结束当前时间桶并写出全部待写数据（关闭时调用）"""
+        with self._lock:
+            if self._bucket is not None:
+                self._close_bucket()
+                self._bucket = None
+            persist = self._take_pending()
+        self._persist(*persist)
+
+    # ==================== 原始样本抓取 ====================
+
+    def capture(self, entity_ids: Iterable[str], at: float, reason: str) -> int:
+        """
+        报警等事件触发原始样本抓取：写出触发前 rawCaptureSeconds 秒内缓冲的样本，
+        并在触发后同样时长内继续抓取到达的样本。返回立即写出的样本数。
+        """
+        window = self._raw_seconds
+        if window <= 0:
+            return 0
+        targets = set(entity_ids)
+        with self._lock:
+            series = [i for i, (entity_id, _) in enumerate(self._keys) if entity_id in targets]
+            captured = 0
+            for i in series:
+                entity_id, metric = self._keys[i]
+                times = self._ring_times[i]
+                selected = (times >= at - window) & (times <= at) & (times > self._captured_through[i])
+                order = np.argsort(times[selected])
+                for t, v in zip(times[selected][order].tolist(), self._ring_values[i][selected][order].tolist()):
+                    self._raw_pending.append((entity_id, metric, t, v, reason))
+                captured += int(selected.sum())
+                self._captured_through[i] = max(self._captured_through[i], at)
+                self._capture_until[i] = max(self._capture_until[i], at + window)
+                self._capture_reason[i] = reason
+            self.captures += 1
+        return captured
+
+    def get_status(self) -> dict:
+        with self._lock:
+            return {
+                'interval': self._interval,
+                'rawCaptureSeconds': self._raw_seconds,
+                'series': len(self._keys),
+                'capacity': len(self._count),
+                'samples': self.samples,
+                'lateSamples': self.late_samples,
+                'buckets': self.buckets,
+                'persistedRows': self.persisted_rows,
+                # 写入行数相对原始样本数的压缩比
+                'reduction': self.samples / self.persisted_rows if self.persisted_rows else None,
+                'captures': self.captures,
+                'rawRows': self.raw_rows,
+                'pendingRaw': len(self._raw_pending),
+                'activeCaptures': int(np.count_nonzero(self._capture_until[:len(self._keys)] >= self._last_time[:len(self._keys)])),
+            }
+
+
+_ingest_aggregator_instance: Optional[IngestAggregator] = None
+
+def get_ingest_aggregator() -> IngestAggregator:
+    global _ingest_aggregator_instance
+    if _ingest_aggregator_instance is None:
+        from app.services.history_service import get_history_service
+        _ingest_aggregator_instance = IngestAggregator(get_history_service())
+    return _ingest_aggregator_instance
@@ -0,0 +1,270 @@
+"""
+状态持久化服务 - 追加式日志 (Journal) + 定期检查点 (Checkpoint)
+
+journal 只记录指令级的变化：写者显式标记的线体/小车、新增/删除与重排序、新增的日志以及
+仿真簿记等附加数据。仿真 tick 与采集读数对物理量的连续改写不进入 journal，由检查点持久化。
+后台写线程按 FLUSH_INTERVAL 把这段时间内合并的变化写成一条记录并 fsync，
+定期把完整状态压缩写成 checkpoint 并截断 journal。
+重启时加载最新 checkpoint，只重放其后的 journal 尾部，启动时间与运行时长无关。
+
+写线程由应用 lifespan 通过 StateService.start_journal() 启动；未启动时（脚本、测试）不写任何文件。
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Set, Tuple
+
+from app.models import LogEntry, SystemState
+
+# 日志类型 -> SystemState 字段
+LOG_FIELDS = {'system': 'systemLogs', 'operation': 'operationLogs'}
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "mes_data")
+JOURNAL_FILE = os.path.join(DATA_DIR, "state_journal.jsonl")
+CHECKPOINT_FILE = os.path.join(DATA_DIR, "state_checkpoint.json")
+
+
+class JournalBatch:
+    """
+    两次写入之间合并的发布（从 previous 到 current 的指令级变化）
+
+    发布方只合并、不排队，写线程滞后时内存占用也不超过一份状态加日志容量。
+    lines/carts 为需要写入的实体 ID，None 表示全部；logs 为日志类型 -> (是否整体替换, 新增条目)。
+    """
+    __slots__ = ('previous', 'current', 'lines', 'carts', 'aux', 'logs')
+
+    def __init__(self, previous: SystemState):
+        self.previous = previous
+        self.current = previous
+        self.lines: Optional[Set[str]] = set()
+        self.carts: Optional[Set[str]] = set()
+        self.aux: Dict[str, Any] = {}
+        self.logs: Dict[str, Tuple[bool, Tuple[LogEntry, ...]]] = {}
+
+    def merge(self, current: SystemState, lines: Optional[Set[str]], carts: Optional[Set[str]],
+              aux_changes: Dict[str, Any], log_changes: Dict[str, Tuple[bool, Tuple[LogEntry, ...]]]):
+        self.current = current
+        self.lines = None if lines is None or self.lines is None else self.lines | lines
+        self.carts = None if carts is None or self.carts is None else self.carts | carts
+        self.aux.update(aux_changes)
+        for log_type, (reset, entries) in log_changes.items():
+            previous = self.logs.get(log_type)
+            if previous is not None and not reset:
+                reset, entries = previous[0], entries + previous[1]
+            if reset or len(entries) >= len(getattr(current, LOG_FIELDS[log_type])):
+                # 整体替换（或新增条目已超过容量）：写入时取 current 的完整日志
+                self.logs[log_type] = (True, ())
+            else:
+                self.logs[log_type] = (False, entries)
+
+
+class StateJournal:
+    # 检查点触发条件：距上次检查点的时间 (秒) 或累计记录数
+    CHECKPOINT_INTERVAL = 300
+    CHECKPOINT_MAX_RECORDS = 1000
+    # 写入并 fsync journal 的周期 (秒)：崩溃时最多丢失这段时间内的指令
+    FLUSH_INTERVAL = 1.0
+
+    def __init__(self, journal_file: str = JOURNAL_FILE, checkpoint_file: str = CHECKPOINT_FILE):
+        self.journal_file = journal_file
+        self.checkpoint_file = checkpoint_file
+        os.makedirs(os.path.dirname(self.journal_file), exist_ok=True)
+
+        self._cond = threading.Condition()
+        self._pending: Optional[JournalBatch] = None
+        self._closing = False
+        self._thread: Optional[threading.Thread] = None
+        self._seq = 0
+        self._records_since_checkpoint = 0
+        self._last_checkpoint = time.time()
+        # 写线程持有的最新完整视图（用于写检查点），以及上次检查点写入的那一代
+        self._latest_state: Optional[SystemState] = None
+        self._latest_aux: Dict[str, Any] = {}
+        self._checkpointed: Optional[SystemState] = None
+
+    # ==================== 恢复 ====================
+
+    def load(self) -> Optional[Tuple[SystemState, Dict[str, Any]]]:
+        """加载检查点并重放 journal 尾部；没有任何持久化数据时返回 None"""
+        state_dict: Optional[Dict] = None
+        aux: Dict[str, Any] = {}
+        seq = 0
+
+        if os.path.exists(self.checkpoint_file):
+            try:
+                with open(self.checkpoint_file, 'r', encoding='utf-8') as f:
+                    checkpoint = json.load(f)
+                state_dict = checkpoint['state']
+                aux = checkpoint.get('aux', {})
+                seq = checkpoint.get('seq', 0)
+            except Exception as e:
+                print(f"Error loading state checkpoint: {e}")
+
+        replayed = 0
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, 'r', encoding='utf-8') as f:
+                for raw in f:
+                    try:
+                        record = json.loads(raw)
+                    except json.JSONDecodeError:
+                        # 崩溃时最后一行可能只写了一半，丢弃
+                        break
+                    if record['seq'] <= seq:
+                        continue
+                    state_dict = self._apply_record(state_dict, record)
+                    aux.update(record.get('aux', {}))
+                    seq = record['seq']
+                    replayed += 1
+
+        if state_dict is None:
+            return None
+
+        self._seq = seq
+        self._records_since_checkpoint = replayed
+        print(f"State restored from journal (seq={seq}, replayed {replayed} records).")
+        return SystemState.model_validate(state_dict), aux
+
+    @staticmethod
+    def _apply_record(state_dict: Optional[Dict], record: Dict) -> Dict:
+        if state_dict is None:
+            state_dict = {'lines': [], 'carts': [], 'timestamp': record['ts'] * 1000,
+                          'systemLogs': [], 'operationLogs': []}
+        lines = {l['id']: l for l in state_dict['lines']}
+        lines.update({l['id']: l for l in record.get('lines', [])})
+        state_dict['lines'] = [lines[i] for i in record['lineOrder'] if i in lines]
+
+        carts = {c['id']: c for c in state_dict['carts']}
+        carts.update({c['id']: c for c in record.get('carts', [])})
+        state_dict['carts'] = [carts[i] for i in record['cartOrder'] if i in carts]
+
+        # logs: 清空/整体替换后的完整日志；logAppend: 新增条目（均为最新在前），容量由 StateService 截断
+        for log_type, field in LOG_FIELDS.items():
+            if log_type in record.get('logs', {}):
+                state_dict[field] = record['logs'][log_type]
+            elif log_type in record.get('logAppend', {}):
+                state_dict[field] = record['logAppend'][log_type] + state_dict[field]
+        state_dict['timestamp'] = record['ts'] * 1000
+        return state_dict
+
+    # ==================== 写入 ====================
+
+    def start(self, state: SystemState, aux: Dict[str, Any]):
+        """以 state/aux 为基线写入检查点（压缩上次运行的 journal 尾部）并启动后台写线程"""
+        if self._thread:
+            return
+        self._latest_state = state
+        self._latest_aux = dict(aux)
+        self._write_checkpoint()
+        open(self.journal_file, 'w', encoding='utf-8').close()
+        self._closing = False
+        self._thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self._thread.start()
+
+    def submit(self, previous: SystemState, current: SystemState, lines: Optional[Set[str]], carts: Optional[Set[str]],
+               aux_changes: Dict[str, Any], log_changes: Dict[str, Tuple[bool, Tuple[LogEntry, ...]]]):
+        """
+        提交一次发布（两代状态均为不可变对象，记录在写线程中生成）；写线程未启动时忽略
+        :param lines: 需要写入 journal 的线体 ID（None 表示全部）；新增的实体总会写入
+        :param carts: 同上，小车 ID
+        :param log_changes: 日志类型 -> (是否整体替换, 完整日志或新增条目)
+        """
+        if not self._thread:
+            return
+        with self._cond:
+            if self._pending is None:
+                self._pending = JournalBatch(previous)
+            self._pending.merge(current, lines, carts, aux_changes, log_changes)
+
+    def close(self, timeout: float = 2.0):
+        """写完合并中的记录并生成最终检查点"""
+        if not self._thread:
+            return
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+        self._thread.join(timeout=timeout)
+        self._thread = None
+
+    def _writer_loop(self):
+        with open(self.journal_file, 'a', encoding='utf-8') as journal:
+            closing = False
+            while not closing:
+                with self._cond:
+                    if not self._closing:
+                        self._cond.wait(self.FLUSH_INTERVAL)
+                    batch, self._pending = self._pending, None
+                    closing = self._closing
+                try:
+                    if batch is not None:
+                        record = self._build_record(batch)
+                        if record is not None:
+                            journal.write(record)
+                            journal.write('\n')
+                            journal.flush()
+                            os.fsync(journal.fileno())
+                            self._records_since_checkpoint += 1
+                    if closing or self._checkpoint_due():
+                        self._write_checkpoint()
+                        journal.seek(0)
+                        journal.truncate()
+                except Exception as e:
+                    print(f"Error writing state journal: {e}")
+
+    def _checkpoint_due(self) -> bool:
+        if self._records_since_checkpoint >= self.CHECKPOINT_MAX_RECORDS:
+            return True
+        # 定时检查点同时持久化 journal 之外的物理量变化
+        changed = self._records_since_checkpoint > 0 or self._latest_state is not self._checkpointed
+        return changed and time.time() - self._last_checkpoint >= self.CHECKPOINT_INTERVAL
+
+    def _build_record(self, batch: JournalBatch) -> Optional[str]:
+        """合并批次 -> journal 记录；没有指令级变化（只有物理量）时返回 None"""
+        previous, current = batch.previous, batch.current
+        self._latest_state = current
+        prev_lines = {l.id for l in previous.lines}
+        prev_carts = {c.id for c in previous.carts}
+        lines = [l for l in current.lines if batch.lines is None or l.id in batch.lines or l.id not in prev_lines]
+        carts = [c for c in current.carts if batch.carts is None or c.id in batch.carts or c.id not in prev_carts]
+        line_order = [l.id for l in current.lines]
+        cart_order = [c.id for c in current.carts]
+        reordered = line_order != [l.id for l in previous.lines] or cart_order != [c.id for c in previous.carts]
+        if not (lines or carts or reordered or batch.aux or batch.logs):
+            return None
+
+        self._seq += 1
+        record: Dict[str, Any] = {
+            'seq': self._seq,
+            'ts': current.timestamp / 1000.0,
+            'lines': [l.model_dump(mode='json') for l in lines],
+            'lineOrder': line_order,
+            'carts': [c.model_dump(mode='json') for c in carts],
+            'cartOrder': cart_order,
+        }
+        for log_type, (reset, logs) in batch.logs.items():
+            if reset:
+                logs = getattr(current, LOG_FIELDS[log_type])
+            record.setdefault('logs' if reset else 'logAppend', {})[log_type] = [log.model_dump(mode='json') for log in logs]
+        if batch.aux:
+            record['aux'] = batch.aux
+            self._latest_aux.update(batch.aux)
+        return json.dumps(record, ensure_ascii=False)
+
+    def _write_checkpoint(self):
+        """原子写入检查点（先写临时文件再替换）"""
+        checkpoint = {
+            'seq': self._seq,
+            'ts': time.time(),
+            'state': self._latest_state.model_dump(mode='json'),
+            'aux': self._latest_aux,
+        }
+        tmp_file = self.checkpoint_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.checkpoint_file)
+        self._checkpointed = self._latest_state
+        self._records_since_checkpoint = 0
+        self._last_checkpoint = time.time()
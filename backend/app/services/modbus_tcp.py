@@ -0,0 +1,331 @@
+"""
+Modbus TCP 采集驱动与本地替身服务
+
+寄存器映射：腔体按采集顺序（线体、阳极/阴极序列）依次占用 REGISTER_STRIDE 个保持寄存器，
+块内布局见 FLOAT_POINTS / STATUS_OFFSET。浮点数为 IEEE754 单精度、高字在前（ABCD）；
+状态字按 STATUS_BITS 顺序逐位表示阀门开/关、泵与加热状态。
+
+每个轮询周期把所有点位的地址区间合并为最少的读请求（跨过不超过 MAX_GAP 个空闲寄存器，
+单次不超过协议上限 125 个寄存器），在一条持久连接上按事务号流水线发送（最多 MAX_IN_FLIGHT 个在途）。
+连接断开时驱动抛出 ConnectionError，由采集循环按指数退避重连。
+"""
+
+import asyncio
+import struct
+from typing import Dict, List, Optional, Tuple
+
+from app.models import HardwareConfig, ProtocolType, SystemState
+from app.services.acquisition_service import (
+    BOOL_READINGS, FLOAT_READINGS, VALVE_NAMES,
+    AcquisitionDriver, SimulatedPlant, clean_reading, ordered_chambers, register_driver,
+)
+
+READ_HOLDING_REGISTERS = 0x03
+READ_INPUT_REGISTERS = 0x04
+ILLEGAL_FUNCTION = 0x01
+ILLEGAL_DATA_ADDRESS = 0x02
+
+# 寄存器映射
+REGISTER_BASE = 0
+REGISTER_STRIDE = 10
+FLOAT_POINTS = tuple((name, 2 * k) for k, name in enumerate(FLOAT_READINGS))
+STATUS_OFFSET = 2 * len(FLOAT_READINGS)
+STATUS_BITS = VALVE_NAMES + BOOL_READINGS
+POINT_REGISTERS = STATUS_OFFSET + 1
+
+# 读请求合并参数
+MAX_READ_REGISTERS = 125
+MAX_GAP = 4
+
+# 连接与请求
+CONNECT_TIMEOUT = 2.0
+REQUEST_TIMEOUT = 1.0
+MAX_IN_FLIGHT = 8
+
+# 替身从站的寄存器快照有效期 (秒)
+SNAPSHOT_TTL = 0.05
+
+_MBAP = struct.Struct('>HHHB')
+
+
+class ModbusError(Exception):
+    """从站返回的异常响应"""
+
+    def __init__(self, function: int, code: int):
+        super().__init__(f"Modbus exception {code} for function {function:#04x}")
+        self.function = function
+        self.code = code
+
+
+def build_register_map(chamber_ids: List[str]) -> Dict[str, int]:
+    """腔体 ID -> 该腔体寄存器块的起始地址"""
+    return {cid: REGISTER_BASE + k * REGISTER_STRIDE for k, cid in enumerate(chamber_ids)}
+
+
+def coalesce(ranges: List[Tuple[int, int]], max_gap: int = MAX_GAP, max_count: int = MAX_READ_REGISTERS) -> List[Tuple[int, int]]:
+    """
+    把 (起始地址, 数量) 区间合并为最少的读请求：相邻区间间隔不超过 max_gap 且合并后不超过 max_count 时合并。
+    区间本身不拆分（超过 max_count 的除外），同一腔体的点位总在同一次读中取得，数值彼此一致。
+    """
+    requests: List[Tuple[int, int]] = []
+    for start, count in sorted(ranges):
+        end = start + count
+        if requests:
+            first, length = requests[-1]
+            last = first + length
+            if start - last <= max_gap and max(end, last) - first <= max_count:
+                requests[-1] = (first, max(end, last) - first)
+                continue
+        # 超长区间按协议上限拆分
+        while end - start > max_count:
+            requests.append((start, max_count))
+            start += max_count
+        requests.append((start, end - start))
+    return requests
+
+
+def encode_reading(reading: dict) -> List[int]:
+    """读数 -> 一个腔体寄存器块的内容"""
+    words: List[int] = []
+    for name, _ in FLOAT_POINTS:
+        words.extend(struct.unpack('>HH', struct.pack('>f', float(reading.get(name, 0.0)))))
+    status = 0
+    valves = reading.get('valves', {})
+    for bit, name in enumerate(STATUS_BITS):
+        if valves.get(name, False) if name in VALVE_NAMES else reading.get(name, False):
+            status |= 1 << bit
+    words.append(status)
+    return words
+
+
+def decode_reading(words: List[int]) -> dict:
+    """一个腔体寄存器块 -> 读数"""
+    reading = {}
+    for name, offset in FLOAT_POINTS:
+        reading[name] = struct.unpack('>f', struct.pack('>HH', words[offset], words[offset + 1]))[0]
+    status = words[STATUS_OFFSET]
+    reading['valves'] = {name: bool(status >> bit & 1) for bit, name in enumerate(STATUS_BITS) if name in VALVE_NAMES}
+    for bit, name in enumerate(STATUS_BITS):
+        if name not in VALVE_NAMES:
+            reading[name] = bool(status >> bit & 1)
+    return reading
+
+
+class ModbusTcpClient:
+    """单条持久连接上的 Modbus TCP 主站，按事务号匹配流水线请求的响应"""
+
+    def __init__(self, host: str, port: int, unit: int, timeout: float = REQUEST_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.unit = unit
+        self.timeout = timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._receiver: Optional[asyncio.Task] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._transaction = 0
+        self._in_flight = asyncio.Semaphore(MAX_IN_FLIGHT)
+        self.connects = 0
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), CONNECT_TIMEOUT
+        )
+        self._receiver = asyncio.create_task(self._receive())
+        self.connects += 1
+
+    async def close(self):
+        if self._receiver is not None:
+            self._receiver.cancel()
+            self._receiver = None
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+        self._writer = None
+        self._fail_pending(ConnectionError("Connection closed"))
+
+    def _fail_pending(self, error: Exception):
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self._pending = {}
+
+    async def _receive(self):
+        try:
+            while True:
+                header = await self._reader.readexactly(_MBAP.size)
+                transaction, _, length, _ = _MBAP.unpack(header)
+                pdu = await self._reader.readexactly(length - 1)
+                future = self._pending.pop(transaction, None)
+                if future is not None and not future.done():
+                    future.set_result(pdu)
+        except (asyncio.IncompleteReadError, ConnectionError, OSError) as e:
+            if self._writer is not None:
+                self._writer.close()
+            self._fail_pending(ConnectionError(f"Connection lost: {e}"))
+
+    async def request(self, pdu: bytes) -> bytes:
+        if not self.connected:
+            raise ConnectionError("Not connected")
+        async with self._in_flight:
+            self._transaction = (self._transaction + 1) & 0xFFFF
+            transaction = self._transaction
+            future = asyncio.get_running_loop().create_future()
+            self._pending[transaction] = future
+            self._writer.write(_MBAP.pack(transaction, 0, len(pdu) + 1, self.unit) + pdu)
+            try:
+                response = await asyncio.wait_for(future, self.timeout)
+            finally:
+                self._pending.pop(transaction, None)
+        if response[0] & 0x80:
+            raise ModbusError(response[0] & 0x7F, response[1])
+        return response
+
+    async def read_registers(self, address: int, count: int, function: int = READ_HOLDING_REGISTERS) -> List[int]:
+        response = await self.request(struct.pack('>BHH', function, address, count))
+        return list(struct.unpack(f'>{count}H', response[2:2 + 2 * count]))
+
+
+class ModbusDriver(AcquisitionDriver):
+    """按寄存器映射轮询全部腔体"""
+    protocol = ProtocolType.modbus_tcp.value
+
+    def __init__(self, config: HardwareConfig, state: SystemState):
+        chambers, _ = ordered_chambers(state)
+        self.client = ModbusTcpClient(config.ipAddress, config.port, config.slaveId)
+        self.addresses = build_register_map([c.id for c in chambers])
+        self.requests = coalesce([(address, POINT_REGISTERS) for address in self.addresses.values()])
+        self.polls = 0
+        self.exceptions = 0
+        self.decode_errors = 0
+
+    async def poll(self) -> Dict[str, dict]:
+        client = self.client
+        if not client.connected:
+            await client.close()
+            await client.connect()
+        results = await asyncio.gather(
+            *(client.read_registers(start, count) for start, count in self.requests),
+            return_exceptions=True,
+        )
+        registers: Dict[int, int] = {}
+        for (start, count), result in zip(self.requests, results):
+            if isinstance(result, ModbusError):
+                # 从站拒绝的区间本周期不更新，其余区间照常使用
+                self.exceptions += 1
+                continue
+            if isinstance(result, BaseException):
+                await client.close()
+                raise ConnectionError(str(result) or type(result).__name__)
+            registers.update(zip(range(start, start + count), result))
+
+        readings = {}
+        for chamber_id, address in self.addresses.items():
+            words = [registers.get(address + k) for k in range(POINT_REGISTERS)]
+            if None not in words:
+                # 非有限值（NaN / inf）的浮点点位计为解码错误并丢弃
+                readings[chamber_id], bad = clean_reading(decode_reading(words))
+                self.decode_errors += bad
+        self.polls += 1
+        return readings
+
+    async def close(self):
+        await self.client.close()
+
+    def metrics(self) -> dict:
+        return {
+            'requestsPerPoll': len(self.requests),
+            'registersPerPoll': sum(count for _, count in self.requests),
+            'polls': self.polls,
+            'connects': self.client.connects,
+            'exceptions': self.exceptions,
+            'decodeErrors': self.decode_errors,
+        }
+
+
+class ModbusStandInServer:
+    """本地 Modbus TCP 从站替身：寄存器内容由替身数据源在每次读请求时刷新"""
+
+    def __init__(self, plant: SimulatedPlant, unit: int):
+        self.plant = plant
+        self.unit = unit
+        self.addresses = build_register_map([c.id for c in plant.chambers])
+        self.size = REGISTER_BASE + len(self.addresses) * REGISTER_STRIDE
+        self.requests = 0
+        self._bank: Optional[List[int]] = None
+        self._bank_at = 0.0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._writers = set()
+
+    async def start(self, host: str, port: int):
+        self._server = await asyncio.start_server(self._handle, host, port)
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            # 主动断开已建立的连接（模拟从站掉线）
+            for writer in list(self._writers):
+                writer.close()
+            # 让连接处理协程读到 EOF 后自行退出
+            await asyncio.sleep(0.05)
+            await self._server.wait_closed()
+            self._server = None
+
+    def registers(self) -> List[int]:
+        bank = [0] * self.size
+        readings = self.plant.readings()
+        for chamber_id, address in self.addresses.items():
+            bank[address:address + POINT_REGISTERS] = encode_reading(readings[chamber_id])
+        return bank
+
+    def _respond(self, pdu: bytes, bank: List[int]) -> bytes:
+        function = pdu[0]
+        if function not in (READ_HOLDING_REGISTERS, READ_INPUT_REGISTERS):
+            return bytes((function | 0x80, ILLEGAL_FUNCTION))
+        address, count = struct.unpack('>HH', pdu[1:5])
+        if count < 1 or count > MAX_READ_REGISTERS or address + count > len(bank):
+            return bytes((function | 0x80, ILLEGAL_DATA_ADDRESS))
+        return struct.pack(f'>BB{count}H', function, 2 * count, *bank[address:address + count])
+
+    def snapshot(self) -> List[int]:
+        """寄存器快照：同一轮询周期内的流水线请求读取同一份数据"""
+        now = asyncio.get_running_loop().time()
+        if self._bank is None or now - self._bank_at > SNAPSHOT_TTL:
+            self._bank = self.registers()
+            self._bank_at = now
+        return self._bank
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._writers.add(writer)
+        try:
+            while True:
+                header = await reader.readexactly(_MBAP.size)
+                transaction, protocol, length, unit = _MBAP.unpack(header)
+                pdu = await reader.readexactly(length - 1)
+                if protocol != 0 or unit not in (self.unit, 0xFF):
+                    continue
+                response = self._respond(pdu, self.snapshot())
+                self.requests += 1
+                writer.write(_MBAP.pack(transaction, 0, len(response) + 1, unit) + response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+
+async def start_standin(plant: SimulatedPlant, config: HardwareConfig) -> ModbusStandInServer:
+    server = ModbusStandInServer(plant, config.slaveId)
+    await server.start(config.ipAddress, config.port)
+    return server
+
+
+register_driver(ProtocolType.modbus_tcp, ModbusDriver, start_standin)
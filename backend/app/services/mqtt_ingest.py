@@ -0,0 +1,504 @@
+"""
+MQTT 遥测接入与内置 Broker 替身
+
+PLC 网关按腔体发布遥测：主题 {TOPIC_ROOT}/{线体 ID}/{腔体 ID}/telemetry，载荷为 JSON 读数
+（字段同采集读数，可只含部分字段，如 {"temperature": 150.2, "valves": {"vent_valve": false}}）。
+
+驱动为每条线体订阅 {TOPIC_ROOT}/{线体 ID}/+/telemetry，收到的消息经主题树路由到线体、
+按腔体 ID 校验后合并进本周期的批次（同一腔体多条消息只保留各字段最新值），
+采集循环每个周期取走一次批次，经与轮询驱动相同的批量写入链路更新状态与历史。
+
+QoS：订阅请求 SUBSCRIBE_QOS；QoS 1 收到即回 PUBACK，QoS 2 按 PUBREC/PUBREL/PUBCOMP 握手，
+PUBREL 之前重发的同一报文 ID 视为重复丢弃（恰好一次）。
+协议为 MQTT 3.1.1 的最小实现（asyncio 流），不依赖第三方库。
+"""
+
+import asyncio
+import itertools
+import json
+import struct
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.models import HardwareConfig, ProtocolType, SystemState
+from app.services.acquisition_service import AcquisitionDriver, SimulatedPlant, clean_reading, line_of_chambers, register_driver
+from app.services.clock_service import get_clock
+
+# 报文类型
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 10, 11, 12, 13, 14
+
+TOPIC_ROOT = 'autoline'
+TELEMETRY = 'telemetry'
+SUBSCRIBE_QOS = 1
+KEEPALIVE = 30
+CONNECT_TIMEOUT = 2.0
+# 入站速率的滑动平均系数（按采集周期更新）
+RATE_SMOOTHING = 0.3
+# 替身网关发布遥测的 QoS
+STANDIN_QOS = 1
+
+
+def telemetry_topic(line_id: str, chamber_id: str) -> str:
+    return f"{TOPIC_ROOT}/{line_id}/{chamber_id}/{TELEMETRY}"
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    """MQTT 主题过滤：+ 匹配单层，# 匹配其后的任意层（含父层本身）"""
+    levels = topic.split('/')
+    parts = topic_filter.split('/')
+    for i, part in enumerate(parts):
+        if part == '#':
+            return True
+        if i >= len(levels) or (part != '+' and part != levels[i]):
+            return False
+    return len(parts) == len(levels)
+
+
+class TopicRouter:
+    """主题树：按层级匹配订阅过滤器，单条消息的路由开销与主题层数成正比"""
+
+    def __init__(self):
+        self._root: dict = {}
+
+    def add(self, topic_filter: str, value):
+        node = self._root
+        for part in topic_filter.split('/'):
+            node = node.setdefault(part, {})
+        node.setdefault(None, []).append(value)
+
+    def match(self, topic: str) -> list:
+        levels = topic.split('/')
+        found = []
+        nodes = [self._root]
+        for level in levels:
+            following = []
+            for node in nodes:
+                if '#' in node:
+                    found.extend(node['#'].get(None, []))
+                for key in (level, '+'):
+                    if key in node:
+                        following.append(node[key])
+            nodes = following
+            if not nodes:
+                return found
+        for node in nodes:
+            found.extend(node.get(None, []))
+            if '#' in node:
+                found.extend(node['#'].get(None, []))
+        return found
+
+
+# ==================== 报文编解码 ====================
+
+def _encode_length(length: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        out.append(byte | (0x80 if length else 0))
+        if not length:
+            return bytes(out)
+
+
+def _string(text: str) -> bytes:
+    data = text.encode('utf-8')
+    return struct.pack('>H', len(data)) + data
+
+
+def packet(kind: int, flags: int, body: bytes = b'') -> bytes:
+    return bytes((kind << 4 | flags,)) + _encode_length(len(body)) + body
+
+
+def publish_packet(topic: str, payload: bytes, qos: int, packet_id: int = 0, dup: bool = False) -> bytes:
+    body = _string(topic) + (struct.pack('>H', packet_id) if qos else b'') + payload
+    return packet(PUBLISH, (dup << 3) | (qos << 1), body)
+
+
+async def read_packet(reader: asyncio.StreamReader) -> Tuple[int, int, bytes]:
+    """读取一个报文：(类型, 标志位, 可变头+载荷)"""
+    first = (await reader.readexactly(1))[0]
+    length, shift = 0, 0
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        length |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            break
+        if shift > 21:
+            raise ConnectionError("Malformed remaining length")
+    body = await reader.readexactly(length) if length else b''
+    return first >> 4, first & 0x0F, body
+
+
+def parse_publish(flags: int, body: bytes) -> Tuple[str, int, int, bytes]:
+    """PUBLISH 报文 -> (主题, QoS, 报文 ID, 载荷)"""
+    qos = (flags >> 1) & 0x03
+    (topic_length,) = struct.unpack('>H', body[:2])
+    topic = body[2:2 + topic_length].decode('utf-8')
+    offset = 2 + topic_length
+    packet_id = 0
+    if qos:
+        (packet_id,) = struct.unpack('>H', body[offset:offset + 2])
+        offset += 2
+    return topic, qos, packet_id, body[offset:]
+
+
+# ==================== 客户端 ====================
+
+class MqttClient:
+    """订阅端：持久连接、QoS 0/1/2 入站处理；收到的消息交给 on_message(主题, 载荷)"""
+
+    def __init__(self, host: str, port: int, client_id: str, on_message, on_decode_error=None):
+        self.host = host
+        self.port = port
+        self.client_id = client_id
+        self.on_message = on_message
+        # 单个报文格式错误时调用（不断开连接）
+        self.on_decode_error = on_decode_error
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._receiver: Optional[asyncio.Task] = None
+        self._packet_ids = itertools.cycle(range(1, 0x10000))
+        self._acks: Dict[int, asyncio.Future] = {}
+        # QoS 2：已收到 PUBLISH、尚未收到 PUBREL 的报文 ID
+        self._awaiting_release: Set[int] = set()
+        self._last_sent = 0.0
+        self.connects = 0
+        self.duplicates = 0
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    def _send(self, data: bytes):
+        self._writer.write(data)
+        self._last_sent = time.monotonic()
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), CONNECT_TIMEOUT
+        )
+        # 协议名、级别 4 (3.1.1)、clean session、保活时间
+        body = _string('MQTT') + struct.pack('>BBH', 4, 0x02, KEEPALIVE) + _string(self.client_id)
+        self._send(packet(CONNECT, 0, body))
+        kind, _, ack = await asyncio.wait_for(read_packet(self._reader), CONNECT_TIMEOUT)
+        if kind != CONNACK or ack[1] != 0:
+            await self.close()
+            raise ConnectionError(f"Broker refused connection (code {ack[1] if len(ack) > 1 else '?'})")
+        self._awaiting_release = set()
+        self._receiver = asyncio.create_task(self._receive())
+        self.connects += 1
+
+    async def subscribe(self, filters: List[Tuple[str, int]]) -> List[int]:
+        """订阅并返回 Broker 授予的 QoS 列表（0x80 表示拒绝）"""
+        packet_id = next(self._packet_ids)
+        body = struct.pack('>H', packet_id) + b''.join(_string(f) + bytes((qos,)) for f, qos in filters)
+        future = asyncio.get_running_loop().create_future()
+        self._acks[packet_id] = future
+        self._send(packet(SUBSCRIBE, 0x02, body))
+        return list(await asyncio.wait_for(future, CONNECT_TIMEOUT))
+
+    def ping_if_idle(self):
+        if self.connected and time.monotonic() - self._last_sent > KEEPALIVE / 2:
+            self._send(packet(PINGREQ, 0))
+
+    async def close(self):
+        if self._receiver is not None:
+            self._receiver.cancel()
+            self._receiver = None
+        if self._writer is not None:
+            if not self._writer.is_closing():
+                self._writer.write(packet(DISCONNECT, 0))
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+        self._writer = None
+        for future in self._acks.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Connection closed"))
+        self._acks = {}
+
+    async def _receive(self):
+        """
+        接收循环：单个报文格式错误（主题非 UTF-8、长度不符）时计数后继续；
+        连接断开或其他异常时关闭连接，connected 变为 False，由下一次 poll 重连
+        """
+        try:
+            while True:
+                kind, flags, body = await read_packet(self._reader)
+                try:
+                    self._dispatch(kind, flags, body)
+                except (ValueError, struct.error, IndexError):
+                    if self.on_decode_error is not None:
+                        self.on_decode_error()
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            self._lost()
+        except Exception as e:
+            print(f"MQTT receiver failed: {type(e).__name__}: {e}")
+            self._lost()
+
+    def _dispatch(self, kind: int, flags: int, body: bytes):
+        if kind == PUBLISH:
+            topic, qos, packet_id, payload = parse_publish(flags, body)
+            if qos == 2:
+                if packet_id in self._awaiting_release:
+                    self.duplicates += 1
+                else:
+                    self._awaiting_release.add(packet_id)
+                    self.on_message(topic, payload)
+                self._send(packet(PUBREC, 0, struct.pack('>H', packet_id)))
+            else:
+                self.on_message(topic, payload)
+                if qos == 1:
+                    self._send(packet(PUBACK, 0, struct.pack('>H', packet_id)))
+        elif kind == PUBREL:
+            (packet_id,) = struct.unpack('>H', body[:2])
+            self._awaiting_release.discard(packet_id)
+            self._send(packet(PUBCOMP, 0, body[:2]))
+        elif kind == SUBACK:
+            (packet_id,) = struct.unpack('>H', body[:2])
+            future = self._acks.pop(packet_id, None)
+            if future is not None and not future.done():
+                future.set_result(body[2:])
+
+    def _lost(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+# ==================== 采集驱动 ====================
+
+class MqttDriver(AcquisitionDriver):
+    """订阅各线体的遥测主题，按采集周期批量交付"""
+    protocol = ProtocolType.mqtt.value
+
+    def __init__(self, config: HardwareConfig, state: SystemState):
+        self.line_of = line_of_chambers(state)
+        self.router = TopicRouter()
+        self.filters = []
+        for line in state.lines:
+            topic_filter = telemetry_topic(line.id, '+')
+            self.router.add(topic_filter, line.id)
+            self.filters.append((topic_filter, SUBSCRIBE_QOS))
+        self.client = MqttClient(config.ipAddress, config.port, f"autoline-ingest-{config.slaveId}", self._on_message,
+                                 self._on_decode_error)
+        self.granted: List[int] = []
+        self._batch: Dict[str, dict] = {}
+        # 逐条消息的原始样本（高频网关在一个周期内会上报多次），交给预聚合层
+        self._samples: List[Tuple[str, str, float, float]] = []
+        self._clock = get_clock()
+
+        # 指标
+        self.received = 0
+        self.received_bytes = 0
+        self.unrouted = 0
+        self.decode_errors = 0
+        self.delivered = 0
+        self.last_batch = 0
+        self.last_messages = 0
+        self.message_rate = 0.0
+        self.byte_rate = 0.0
+        self._window_messages = 0
+        self._window_bytes = 0
+        self._window_start = time.monotonic()
+
+    def _on_decode_error(self):
+        self.decode_errors += 1
+
+    def _on_message(self, topic: str, payload: bytes):
+        self.received += 1
+        self.received_bytes += len(payload)
+        self._window_messages += 1
+        self._window_bytes += len(payload)
+        levels = topic.split('/')
+        lines = self.router.match(topic)
+        chamber_id = levels[2] if len(levels) == 4 else None
+        if not lines or self.line_of.get(chamber_id) not in lines:
+            self.unrouted += 1
+            return
+        try:
+            reading = json.loads(payload)
+            if not isinstance(reading, dict):
+                raise ValueError("payload is not an object")
+        except ValueError:
+            self.decode_errors += 1
+            return
+        # 类型不符的字段计为解码错误并丢弃，其余字段照常合并
+        reading, bad = clean_reading(reading)
+        self.decode_errors += bad
+        now = self._clock.now()
+        for field, metric in (('temperature', 'temperature'), ('highVacPressure', 'vacuum')):
+            value = reading.get(field)
+            if value is not None:
+                self._samples.append((chamber_id, metric, value, now))
+        merged = self._batch.setdefault(chamber_id, {})
+        valves = reading.pop('valves', None)
+        merged.update(reading)
+        if isinstance(valves, dict):
+            merged.setdefault('valves', {}).update(valves)
+
+    async def poll(self) -> Dict[str, dict]:
+        client = self.client
+        if not client.connected:
+            await client.close()
+            self._batch = {}
+            self._samples = []
+            await client.connect()
+            self.granted = await client.subscribe(self.filters)
+        client.ping_if_idle()
+
+        batch, self._batch = self._batch, {}
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed > 0:
+            self.message_rate += (self._window_messages / elapsed - self.message_rate) * RATE_SMOOTHING
+            self.byte_rate += (self._window_bytes / elapsed - self.byte_rate) * RATE_SMOOTHING
+        self.last_messages = self._window_messages
+        self._window_messages = self._window_bytes = 0
+        self._window_start = now
+        self.last_batch = len(batch)
+        self.delivered += len(batch)
+        return batch
+
+    def drain_samples(self) -> List[Tuple[str, str, float, float]]:
+        samples, self._samples = self._samples, []
+        return samples
+
+    async def close(self):
+        await self.client.close()
+
+    def metrics(self) -> dict:
+        return {
+            'subscriptions': len(self.filters),
+            'grantedQos': sorted(set(self.granted)),
+            'connects': self.client.connects,
+            'received': self.received,
+            'receivedBytes': self.received_bytes,
+            'messagesPerSecond': self.message_rate,
+            'bytesPerSecond': self.byte_rate,
+            'lastMessages': self.last_messages,
+            'lastBatch': self.last_batch,
+            'delivered': self.delivered,
+            'duplicates': self.client.duplicates,
+            'unrouted': self.unrouted,
+            'decodeErrors': self.decode_errors,
+        }
+
+
+# ==================== Broker 替身 ====================
+
+class _Session:
+    __slots__ = ('writer', 'subscriptions', 'packet_ids')
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.subscriptions: Dict[str, int] = {}
+        self.packet_ids = itertools.cycle(range(1, 0x10000))
+
+
+class MqttStandInBroker:
+    """
+    内置 Broker 替身：转发客户端发布的消息，并以网关身份按采集周期发布替身数据源的遥测
+    （出站 QoS 取发布与订阅 QoS 的较小值；只做协议握手，不做重传与会话保持）
+    """
+
+    def __init__(self, plant: SimulatedPlant, interval: float):
+        self.plant = plant
+        self.interval = interval
+        self.sessions: Set[_Session] = set()
+        self.published = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._publisher: Optional[asyncio.Task] = None
+
+    async def start(self, host: str, port: int):
+        self._server = await asyncio.start_server(self._handle, host, port)
+        self._publisher = asyncio.create_task(self._publish_plant())
+
+    async def close(self):
+        if self._publisher is not None:
+            self._publisher.cancel()
+            self._publisher = None
+        if self._server is not None:
+            self._server.close()
+            for session in list(self.sessions):
+                session.writer.close()
+            await asyncio.sleep(0.05)
+            await self._server.wait_closed()
+            self._server = None
+
+    def route(self, topic: str, payload: bytes, qos: int):
+        for session in list(self.sessions):
+            granted = [sub_qos for topic_filter, sub_qos in session.subscriptions.items() if topic_matches(topic_filter, topic)]
+            if not granted or session.writer.is_closing():
+                continue
+            out_qos = min(qos, max(granted))
+            packet_id = next(session.packet_ids) if out_qos else 0
+            session.writer.write(publish_packet(topic, payload, out_qos, packet_id))
+            self.published += 1
+
+    async def _publish_plant(self):
+        while True:
+            for chamber_id, reading in self.plant.readings().items():
+                topic = telemetry_topic(self.plant.line_of[chamber_id], chamber_id)
+                self.route(topic, json.dumps(reading).encode('utf-8'), STANDIN_QOS)
+            await asyncio.sleep(self.interval)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        session = _Session(writer)
+        try:
+            kind, _, _ = await read_packet(reader)
+            if kind != CONNECT:
+                return
+            writer.write(packet(CONNACK, 0, b'\x00\x00'))
+            self.sessions.add(session)
+            while True:
+                kind, flags, body = await read_packet(reader)
+                if kind == SUBSCRIBE:
+                    packet_id, offset, granted = body[:2], 2, bytearray()
+                    while offset < len(body):
+                        (length,) = struct.unpack('>H', body[offset:offset + 2])
+                        topic_filter = body[offset + 2:offset + 2 + length].decode('utf-8')
+                        qos = min(body[offset + 2 + length], 2)
+                        session.subscriptions[topic_filter] = qos
+                        granted.append(qos)
+                        offset += 3 + length
+                    writer.write(packet(SUBACK, 0, packet_id + bytes(granted)))
+                elif kind == UNSUBSCRIBE:
+                    offset = 2
+                    while offset < len(body):
+                        (length,) = struct.unpack('>H', body[offset:offset + 2])
+                        session.subscriptions.pop(body[offset + 2:offset + 2 + length].decode('utf-8'), None)
+                        offset += 2 + length
+                    writer.write(packet(UNSUBACK, 0, body[:2]))
+                elif kind == PUBLISH:
+                    topic, qos, packet_id, payload = parse_publish(flags, body)
+                    if qos == 1:
+                        writer.write(packet(PUBACK, 0, struct.pack('>H', packet_id)))
+                    elif qos == 2:
+                        writer.write(packet(PUBREC, 0, struct.pack('>H', packet_id)))
+                    self.route(topic, payload, qos)
+                elif kind == PUBREL:
+                    writer.write(packet(PUBCOMP, 0, body[:2]))
+                elif kind == PUBREC:
+                    writer.write(packet(PUBREL, 0x02, body[:2]))
+                elif kind == PINGREQ:
+                    writer.write(packet(PINGRESP, 0))
+                elif kind == DISCONNECT:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        finally:
+            self.sessions.discard(session)
+            writer.close()
+
+
+async def start_standin(plant: SimulatedPlant, config: HardwareConfig) -> MqttStandInBroker:
+    broker = MqttStandInBroker(plant, max(0.05, config.pollingInterval / 1000.0))
+    await broker.start(config.ipAddress, config.port)
+    return broker
+
+
+register_driver(ProtocolType.mqtt, MqttDriver, start_standin)
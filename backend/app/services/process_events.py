@@ -0,0 +1,273 @@
+"""
+工序离散事件调度 - 小车工艺步骤的到时事件
+
+小车进入新工序（进样、移动、配方修订）时编译一次工艺时间线：进行中工序的开始时间、
+按配方 (bakeDuration / growthDuration) 或步骤 estimatedDuration 得到的计划结束时间，
+以及后续待执行工序的计划时长。由时间线生成带时间戳的事件放入优先队列 (heapq)，
+仿真推进到事件时刻时才处理：
+
+- step_end: 进行中工序的计划时长到期（烘烤为恒温段结束，随后进入冷却）
+- cooldown_done: 烘烤冷却完成（设定曲线回到常温）
+- ready_to_move: 工序完成，可转入下一工位（最后一道工序完成即整车完工）
+- progress: 按显示精度 (PROGRESS_REFRESH) 刷新 progress / remainingTime
+
+progress / remainingTime 是时间线在某一时刻的取值而不是逐 tick 累加，
+需要精确值时由 observe() 按读取时刻计算。每个 tick 的处理量与到期事件数成正比。
+"""
+
+import datetime
+import heapq
+import math
+import re
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from app.models import Cart, ProcessStep, Recipe
+from app.services.recipe_profile import BAKE_HOLD_RATIO
+
+STEP_END = 'step_end'
+COOLDOWN_DONE = 'cooldown_done'
+READY_TO_MOVE = 'ready_to_move'
+PROGRESS = 'progress'
+
+# 同一时刻多个事件的处理顺序
+EVENT_ORDER = {STEP_END: 0, COOLDOWN_DONE: 1, READY_TO_MOVE: 2, PROGRESS: 3}
+
+# progress / remainingTime 的刷新间隔 (虚拟秒)，与 remainingTime 的分钟显示精度一致；
+# 刷新时刻对齐到绝对时间网格，与时间线何时编译无关（录制回放逐位一致）
+PROGRESS_REFRESH = 60.0
+
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)\s*([hms])')
+_DURATION_UNITS = {'h': 3600, 'm': 60, 's': 1}
+
+
+def parse_duration(text: Optional[str]) -> float:
+    """解析 "2h" / "1h 30m" / "10m" 形式的时长 (秒)，无法解析时为 0"""
+    if not text:
+        return 0.0
+    return sum(float(value) * _DURATION_UNITS[unit] for value, unit in _DURATION_PART.findall(text))
+
+
+def format_duration(seconds: float) -> str:
+    """与进样时 totalTime / remainingTime 相同的格式："5h 30m" / "45m\""""
+    seconds = max(0.0, seconds)
+    hours = int(seconds // 3600)
+    minutes = int((seconds % 3600) // 60)
+    return f"{hours}h {minutes}m" if hours > 0 else f"{minutes}m"
+
+
+def _timestamp(iso: Optional[str]) -> Optional[float]:
+    return datetime.datetime.fromisoformat(iso).timestamp() if iso else None
+
+
+def _planned_duration(step: ProcessStep, recipe: Optional[Recipe]) -> float:
+    """工序计划时长 (秒)：烘烤/生长取配方，其余取步骤预计时长"""
+    if recipe is not None:
+        if '烘烤' in step.name:
+            return recipe.bakeDuration * 3600
+        if '生长' in step.name and recipe.growthDuration > 0:
+            return recipe.growthDuration * 3600
+    return parse_duration(step.estimatedDuration)
+
+
+class CartTimeline:
+    """单辆小车的工艺时间线（编译后不再读取模型，直到小车进入新工序）"""
+    __slots__ = ('key', 'version', 'start', 'active_id', 'active_start', 'active_end', 'hold_end', 'pending', 'next_name')
+
+    def __init__(self, key: Tuple, version: int, cart: Cart, recipe: Optional[Recipe]):
+        self.key = key
+        self.version = version
+        # 时间线只保存步骤 ID 与名称，事件处理时在当前工作副本中按 ID 查找步骤
+        self.active_id: Optional[str] = None
+        self.active_start: Optional[float] = None
+        self.active_end: Optional[float] = None
+        # 烘烤恒温段结束时间（之后按设定曲线冷却到 active_end）
+        self.hold_end: Optional[float] = None
+        self.pending = 0.0
+        self.next_name: Optional[str] = None
+
+        starts = [t for t in (_timestamp(step.startTime) for step in cart.steps) if t is not None]
+        self.start = min(starts) if starts else _timestamp(cart.loadTime)
+
+        for i, step in enumerate(cart.steps):
+            if step.status == 'active' and self.active_id is None and step.startTime:
+                self.active_id = step.id
+                self.active_start = _timestamp(step.startTime)
+                duration = _planned_duration(step, recipe)
+                self.active_end = self.active_start + duration
+                if '烘烤' in step.name:
+                    self.hold_end = self.active_start + duration * BAKE_HOLD_RATIO
+                self.next_name = cart.steps[i + 1].name if i + 1 < len(cart.steps) else None
+            elif step.status == 'pending':
+                self.pending += _planned_duration(step, recipe)
+
+    def remaining(self, t: float) -> float:
+        """t 时刻的剩余计划时间 (秒)；进行中工序超时等待时只计后续工序"""
+        active_left = max(0.0, self.active_end - t) if self.active_end is not None else 0.0
+        return active_left + self.pending
+
+    def progress(self, t: float) -> float:
+        """t 时刻的整体进度 (0-100)：已用时间 / (已用时间 + 剩余时间)"""
+        remaining = self.remaining(t)
+        if remaining <= 0:
+            return 100.0
+        if self.start is None:
+            return 0.0
+        elapsed = max(0.0, t - self.start)
+        return 100.0 * elapsed / (elapsed + remaining)
+
+    def events(self) -> Iterable[Tuple[float, str]]:
+        if self.active_end is None:
+            return []
+        if self.hold_end is not None:
+            return [(self.hold_end, STEP_END), (self.active_end, COOLDOWN_DONE), (self.active_end, READY_TO_MOVE)]
+        return [(self.active_end, STEP_END), (self.active_end, READY_TO_MOVE)]
+
+
+class ProcessEventEngine:
+    """
+    小车工序事件的优先队列
+
+    队列元素为 (时刻, 小车 ID, 顺序, 事件, 时间线版本, 静默)。小车进入新工序时时间线版本递增，
+    旧版本的事件在出队时丢弃（惰性删除）。编译时已过期的事件（重启或回放起点之前）静默补齐，
+    只更新状态不再写日志。
+    """
+
+    def __init__(self):
+        self._queue: List[Tuple[float, str, int, str, int, bool]] = []
+        self._timelines: Dict[str, CartTimeline] = {}
+        self._versions: Dict[str, int] = {}
+        # 引擎自身改变了进行中工序的小车（最后一道工序完成），下次同步时重新检查
+        self._stale: Set[str] = set()
+        # 上次同步时的配方修订号；为 None 时下次同步检查全部小车
+        self._revision: Optional[int] = None
+        self.processed = 0
+
+    def clear(self):
+        self._queue = []
+        self._timelines = {}
+        self._stale = set()
+        self._revision = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._queue)
+
+    @staticmethod
+    def _key(cart: Cart, revision: int) -> Tuple:
+        active = next((step for step in cart.steps if step.status == 'active'), None)
+        return (
+            cart.recipeId, cart.currentTask, len(cart.steps),
+            active.id if active else None, active.startTime if active else None, revision,
+        )
+
+    def sync(self, carts: List[Cart], recipe_service, since: float, changed: Optional[Set[str]] = None):
+        """
+        为新进样、换工序或配方修订的小车重新编译时间线并排程；移除已删除的小车。
+        since 为上一 tick 的时刻：早于它的事件在此前的运行中已处理过，静默补齐。
+        changed 为自上次同步以来被修改的小车 ID（见 StateService.take_process_changes），
+        只检查这些小车；None、清空后首次同步或配方修订时检查全部小车。
+        """
+        revision = recipe_service.revision
+        if changed is None or revision != self._revision:
+            candidates = carts
+        else:
+            changed = changed | self._stale if self._stale else changed
+            candidates = [cart for cart in carts if cart.id in changed] if changed else ()
+        self._revision = revision
+        self._stale = set()
+        for cart in candidates:
+            key = self._key(cart, revision)
+            timeline = self._timelines.get(cart.id)
+            if timeline is not None and timeline.key == key:
+                continue
+            version = self._versions.get(cart.id, 0) + 1
+            self._versions[cart.id] = version
+            recipe = recipe_service.get_recipe(cart.recipeId) if cart.recipeId else None
+            timeline = CartTimeline(key, version, cart, recipe)
+            self._timelines[cart.id] = timeline
+            if not cart.steps:
+                # 没有工艺步骤（演示数据）的小车没有计划时间线，保持原有进度字段
+                continue
+            for when, kind in timeline.events():
+                self._push(when, cart.id, kind, version, when <= since)
+            # 编译时立即按当前网格刷新一次进度，其后每个网格点刷新
+            self._push(math.floor(since / PROGRESS_REFRESH) * PROGRESS_REFRESH, cart.id, PROGRESS, version, True)
+
+        if len(self._timelines) != len(carts):
+            present = {cart.id for cart in carts}
+            for cart_id in [cid for cid in self._timelines if cid not in present]:
+                del self._timelines[cart_id]
+                self._versions.pop(cart_id, None)
+
+    def _push(self, when: float, cart_id: str, kind: str, version: int, silent: bool = False):
+        heapq.heappush(self._queue, (when, cart_id, EVENT_ORDER[kind], kind, version, silent))
+
+    def advance(self, carts: List[Cart], now: float, log: Callable[[float, str, str], None]):
+        """处理时刻不晚于 now 的事件；log(时刻, 内容, 级别) 写系统日志"""
+        queue = self._queue
+        if not queue or queue[0][0] > now:
+            return
+        cart_by_id = {cart.id: cart for cart in carts}
+        while queue and queue[0][0] <= now:
+            when, cart_id, _, kind, version, silent = heapq.heappop(queue)
+            timeline = self._timelines.get(cart_id)
+            cart = cart_by_id.get(cart_id)
+            if timeline is None or cart is None or timeline.version != version:
+                continue
+            self.processed += 1
+            self._apply(cart, timeline, kind, when, now, silent, log)
+
+    def _apply(self, cart: Cart, timeline: CartTimeline, kind: str, when: float, now: float, silent: bool, log):
+        if kind == PROGRESS:
+            cart.progress = round(timeline.progress(when), 1)
+            cart.remainingTime = format_duration(timeline.remaining(when))
+            if cart.progress < 100.0:
+                # 对齐到下一个网格点；落后多个网格点时直接跳到 now 之后
+                upcoming = max(when, math.floor(now / PROGRESS_REFRESH) * PROGRESS_REFRESH) + PROGRESS_REFRESH
+                self._push(upcoming, cart.id, PROGRESS, timeline.version)
+            return
+
+        step = next((s for s in cart.steps if s.id == timeline.active_id), None)
+        if step is None:
+            return
+        if kind == STEP_END:
+            step.duration = format_duration(when - timeline.active_start)
+            if timeline.hold_end is not None:
+                cart.nextTask = '待冷却'
+        elif kind == COOLDOWN_DONE:
+            step.duration = format_duration(when - timeline.active_start)
+        elif kind == READY_TO_MOVE:
+            if timeline.next_name is not None:
+                cart.nextTask = f"待{timeline.next_name}"
+                if not silent:
+                    log(when, f"小车{cart.number}{step.name}已完成，可转入{timeline.next_name}", 'success')
+            else:
+                # 最后一道工序没有后续移动，到时即完成
+                step.status = 'completed'
+                step.endTime = datetime.datetime.fromtimestamp(when).isoformat()
+                cart.nextTask = '已完成'
+                self._stale.add(cart.id)
+                cart.progress = 100.0
+                cart.remainingTime = format_duration(0)
+                if not silent:
+                    log(when, f"小车{cart.number}全部工序已完成", 'success')
+
+    def observe(self, cart: Cart, now: float) -> Optional[dict]:
+        """读取时按 now 精确计算进度（不修改模型）"""
+        timeline = self._timelines.get(cart.id)
+        if timeline is None:
+            return None
+        remaining = timeline.remaining(now)
+        upcoming = sorted(
+            (when, kind) for when, cart_id, _, kind, version, _ in self._queue
+            if cart_id == cart.id and version == timeline.version and kind != PROGRESS
+        )
+        return {
+            'cartId': cart.id,
+            'currentTask': cart.currentTask,
+            'progress': timeline.progress(now),
+            'remainingSeconds': remaining,
+            'remainingTime': format_duration(remaining),
+            'activeStepEnd': timeline.active_end,
+            'upcomingEvents': [{'time': when, 'event': kind} for when, kind in upcoming],
+        }
@@ -0,0 +1,146 @@
+"""
+配方设定曲线 - 将 (配方, 小车当前工序) 预编译为分段线性的温度设定曲线
+
+曲线的断点是绝对时间 (epoch 秒)，工序开始时间只在编译时解析一次；
+每个 tick 的设定值计算退化为一次二分查找加线性插值。
+编译结果按小车缓存，小车换腔体、切换工序或配方修订号变化时失效。
+"""
+
+import datetime
+from bisect import bisect_right
+from typing import Dict, List, Optional, Tuple
+
+from app.models import Cart, Chamber, Recipe
+
+# 烘烤曲线：0-70% 时间恒温，70%-85% 降到出炉温度，85%-100% 降到常温
+BAKE_HOLD_RATIO = 0.7
+BAKE_COOL_RATIO = 0.85
+BAKE_RELEASE_TEMP = 70.0
+AMBIENT_TEMP = 25.0
+
+# 生长曲线：起始温度在前 5 小时线性降到配方生长温度，其后恒温
+GROWTH_START_TEMP = 230.0
+GROWTH_DROP_DURATION = 5 * 3600
+
+# 未配置生长时长时的默认值 (小时)
+DEFAULT_GROWTH_HOURS = 12.0
+
+
+class SetpointProfile:
+    """分段线性设定曲线（断点之外保持端点值）"""
+    __slots__ = ('times', 'inner', 'outer', 'growth_start', 'growth_duration')
+
+    def __init__(self, times: List[float], inner: List[float], outer: List[float]):
+        self.times = times
+        self.inner = inner
+        self.outer = outer
+        # 进行中的生长工序开始时间 (epoch 秒) 与计划时长 (秒)，供生长进度计算复用
+        self.growth_start: Optional[float] = None
+        self.growth_duration = DEFAULT_GROWTH_HOURS * 3600
+
+    @classmethod
+    def constant(cls, inner: float, outer: float) -> 'SetpointProfile':
+        return cls([0.0], [inner], [outer])
+
+    def evaluate(self, t: float) -> Tuple[float, float]:
+        """返回 t 时刻的 (内温设定, 外温设定)"""
+        times = self.times
+        i = bisect_right(times, t)
+        if i == 0:
+            return self.inner[0], self.outer[0]
+        if i == len(times):
+            return self.inner[-1], self.outer[-1]
+        t0, t1 = times[i - 1], times[i]
+        w = (t - t0) / (t1 - t0)
+        return (
+            self.inner[i - 1] + (self.inner[i] - self.inner[i - 1]) * w,
+            self.outer[i - 1] + (self.outer[i] - self.outer[i - 1]) * w,
+        )
+
+    def growth_progress(self, t: float) -> Optional[float]:
+        """生长进度 (0-100)，没有进行中的生长工序时返回 None"""
+        if self.growth_start is None:
+            return None
+        return min(100.0, (t - self.growth_start) / self.growth_duration * 100)
+
+
+def _active_step_start(cart: Cart, keyword: str) -> Optional[float]:
+    """名称包含 keyword 的进行中工序的开始时间 (epoch 秒)"""
+    for step in cart.steps:
+        if keyword in step.name and step.status == 'active' and step.startTime:
+            return datetime.datetime.fromisoformat(step.startTime).timestamp()
+    return None
+
+
+def compile_profile(recipe: Optional[Recipe], chamber: Chamber, cart: Cart) -> SetpointProfile:
+    """按配方与小车当前工序编译设定曲线"""
+    profile = _compile_setpoints(recipe, chamber, cart)
+    if '生长' in cart.currentTask:
+        profile.growth_start = _active_step_start(cart, '生长')
+    if recipe and recipe.growthDuration > 0:
+        profile.growth_duration = recipe.growthDuration * 3600
+    return profile
+
+
+def _compile_setpoints(recipe: Optional[Recipe], chamber: Chamber, cart: Cart) -> SetpointProfile:
+    task_name = cart.currentTask
+    if not recipe:
+        return SetpointProfile.constant(AMBIENT_TEMP, AMBIENT_TEMP)
+
+    # ========== 烘烤工艺 ==========
+    if '烘烤' in task_name or 'bake' in chamber.type.value:
+        target = recipe.bakeTargetTemp
+        start = _active_step_start(cart, '烘烤')
+        if start is None:
+            return SetpointProfile.constant(target, target + 20.0)
+        total = recipe.bakeDuration * 3600
+        inner = [target, target, BAKE_RELEASE_TEMP, AMBIENT_TEMP]
+        times = [start, start + total * BAKE_HOLD_RATIO, start + total * BAKE_COOL_RATIO, start + total]
+        return SetpointProfile(times, inner, [v + 20.0 for v in inner])
+
+    # ========== 生长工艺 (阴极) ==========
+    if '生长' in task_name and recipe.targetLineType == 'cathode':
+        end_temp = recipe.growthTargetTemp
+        start = _active_step_start(cart, '生长')
+        if start is None:
+            return SetpointProfile.constant(end_temp, end_temp)
+        inner = [GROWTH_START_TEMP, end_temp]
+        return SetpointProfile([start, start + GROWTH_DROP_DURATION], inner, list(inner))
+
+    # ========== 对接/铟封/其他 ==========
+    if '对接' in task_name:
+        target = recipe.indiumTemp if recipe.indiumTemp > 0 else 95.0
+        return SetpointProfile.constant(target, target + 30.0)
+    if '铟封' in task_name:
+        return SetpointProfile.constant(recipe.indiumTemp, recipe.indiumTemp + 20.0)
+    return SetpointProfile.constant(AMBIENT_TEMP, AMBIENT_TEMP)
+
+
+class ProfileCache:
+    """
+    按小车缓存已编译的设定曲线
+
+    缓存键为 (所在腔体, 配方 ID, 当前工序, 配方修订号)：小车移动会同时改变腔体与
+    工序开始时间，配方增删改会递增修订号，两者都会导致重新编译。
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[Tuple, SetpointProfile]] = {}
+
+    def get(self, cart: Cart, chamber: Chamber, recipe_service) -> SetpointProfile:
+        key = (cart.locationChamberId, cart.recipeId, cart.currentTask, recipe_service.revision)
+        entry = self._entries.get(cart.id)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        recipe = recipe_service.get_recipe(cart.recipeId) if cart.recipeId else None
+        profile = compile_profile(recipe, chamber, cart)
+        self._entries[cart.id] = (key, profile)
+        return profile
+
+    def prune(self, cart_ids):
+        """移除已不存在的小车的缓存"""
+        for cart_id in self._entries.keys() - set(cart_ids):
+            del self._entries[cart_id]
+
+    def clear(self):
+        self._entries.clear()
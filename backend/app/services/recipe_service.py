@@ -2,7 +2,7 @@ import json
 import os
 import uuid
 from threading import Lock
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from app.models import Recipe
 
@@ -23,6 +23,9 @@ class RecipeService:
 
     def _load_recipes(self):
         self.recipes: List[Recipe] = []
+        # 配方修订号：任何增删改都会递增，仿真据此使已编译的设定曲线失效
+        self.revision = 0
+        self._by_id: Dict[str, Recipe] = {}
         if not os.path.exists(DATA_DIR):
             os.makedirs(DATA_DIR, exist_ok=True)
             
@@ -36,6 +39,7 @@ class RecipeService:
                 self._init_defaults()
         else:
             self._init_defaults()
+        self._reindex()
 
     def _init_defaults(self):
         # Default Anode Recipe
@@ -84,7 +88,7 @@ class RecipeService:
         return self.recipes
 
     def get_recipe(self, recipe_id: str) -> Optional[Recipe]:
-        return next((r for r in self.recipes if r.id == recipe_id), None)
+        return self._by_id.get(recipe_id)
         
     def get_default_recipe(self, line_type: str) -> Optional[Recipe]:
         return next((r for r in self.recipes if r.isDefault and r.targetLineType == line_type), None)
@@ -131,6 +135,7 @@ class RecipeService:
             return False
 
     def save_recipes(self):
+        self._reindex()
         try:
             with open(RECIPES_FILE, 'w', encoding='utf-8') as f:
                 # model_dump_json for list? Pydantic V2
@@ -140,6 +145,10 @@ class RecipeService:
         except Exception as e:
             print(f"Error saving recipes: {e}")
 
+    def _reindex(self):
+        self._by_id = {r.id: r for r in self.recipes}
+        self.revision += 1
+
 # Global helper to get instance easily if needed (or just use class singleton)
 def get_recipe_service():
     return RecipeService()
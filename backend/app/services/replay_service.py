@@ -0,0 +1,77 @@
+"""
+仿真录制与回放
+
+录制内容：起始快照（状态、仿真簿记、仿真配置）、运行种子、每个 tick 的 (虚拟时间, dt)，
+以及按 tick 序号排列的外部输入（操作员指令、故障注入/清除、配置变更）。
+回放时以快进方式按相同的 tick 序列重新执行，外部输入在原来的 tick 之间按原虚拟时间施加，
+最终状态摘要与录制结束时一致即为逐位复现。
+"""
+
+import hashlib
+import threading
+from typing import Any, Dict, List, Tuple
+
+from pydantic_core import to_jsonable_python
+
+from app.models import BatchStep, SystemState
+
+# 回放时需要从 JSON 还原为模型列表的指令参数
+MODEL_ARGUMENTS = {
+    ('apply_batch', 'steps'): BatchStep,
+}
+
+
+def state_digest(state: SystemState) -> str:
+    """状态摘要（不含发布时间戳），用于比较回放结果"""
+    return hashlib.sha256(state.model_dump_json(exclude={'timestamp'}).encode('utf-8')).hexdigest()
+
+
+class SimulationRecorder:
+    """录制进行中的一次仿真运行（tick 与外部输入都在写者锁内追加，顺序一致）"""
+
+    def __init__(self, seed: int, snapshot: Dict[str, Any]):
+        self.seed = seed
+        self.snapshot = snapshot
+        self.ticks: List[Tuple[float, float]] = []
+        self.events: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def record_tick(self, now: float, dt: float):
+        with self._lock:
+            self.ticks.append((now, dt))
+
+    def record_event(self, kind: str, time: float, **payload):
+        with self._lock:
+            self.events.append({
+                'tick': len(self.ticks),
+                'time': time,
+                'kind': kind,
+                **to_jsonable_python(payload),
+            })
+
+    def finish(self, final_state: SystemState) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'seed': self.seed,
+                'snapshot': self.snapshot,
+                'ticks': list(self.ticks),
+                'events': list(self.events),
+                'digest': state_digest(final_state),
+            }
+
+
+def group_events(events: List[Dict[str, Any]]) -> Dict[int, List[Dict[str, Any]]]:
+    """按 tick 序号分组（保持录制顺序）"""
+    grouped: Dict[int, List[Dict[str, Any]]] = {}
+    for event in events:
+        grouped.setdefault(event['tick'], []).append(event)
+    return grouped
+
+
+def restore_arguments(method: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """把录制时序列化的模型参数还原"""
+    restored = dict(arguments)
+    for (name, arg), model in MODEL_ARGUMENTS.items():
+        if name == method and restored.get(arg) is not None:
+            restored[arg] = [model.model_validate(item) for item in restored[arg]]
+    return restored
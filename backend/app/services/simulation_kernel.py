@@ -0,0 +1,264 @@
+"""
+仿真物理内核 - 基于 NumPy 的结构化数组 (SoA) 向量化计算
+
+所有腔体的物理状态（内/外温度、压力）与输入（目标温度、泵/阀掩码、故障掩码）
+按列存放在连续数组中，每个 tick 用少量向量化运算完成一阶热滞后、指数抽气、
+泄漏与噪声，最后在发布时写回 Pydantic 模型。物理状态由内核持有，
+仅在拓扑（腔体集合）变化时从模型重新装载。
+
+腔体按线体、阳极/阴极序列顺序排列，传输阀打开的相邻腔体之间按流导均压：
+每个 tick 把连通的腔体链组成一批三对角线性系统（隐式欧拉）一次求解。
+"""
+
+import math
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.models import Chamber, DeviceStatus, ValveState
+
+# 热时间常数 (秒)
+THERMAL_TAU = 150.0
+
+# 显式欧拉温度步的最大子步长 (秒)：加热增益最多 2 倍，子步长 tau/4 保证 alpha <= 0.5
+MAX_THERMAL_STEP = THERMAL_TAU / 4
+
+# 真空度参数配置
+VACUUM_PARAMS = {
+    'roughing_target': 1.0,           # 粗抽泵目标压力 (Pa)
+    'roughing_time_const': 60.0,      # 粗抽时间常数 (秒)
+    'molecular_target': 1e-5,         # 分子泵目标压力 (Pa)
+    'molecular_target_growth': 1e-6,  # 生长仓超高真空目标 (Pa)
+    'molecular_time_const': 300.0,    # 分子泵时间常数 (秒)
+    'molecular_cutin_pressure': 10.0, # 分子泵可工作的最高压力 (Pa)
+    'leak_rate_bake': 1e-7,          # 烘烤仓泄漏率 (Pa/s)
+    'leak_rate_normal': 5e-8,        # 普通腔体泄漏率 (Pa/s)
+    'leak_rate_growth': 1e-8,        # 生长仓泄漏率 (Pa/s, 超高真空)
+    'leak_rate_fault': 100.0,        # 泄漏故障 (Pa/s)
+    'vent_time_const': 10.0,         # 放气时间常数 (秒)
+    'atm_pressure': 101325.0,        # 大气压 (Pa)
+    'min_pressure': 1e-9,
+    'chamber_volume': 0.1,            # 腔体容积 (m³)
+    'valve_conductance': 0.5,         # 传输阀分子流流导 (m³/s)
+    'valve_conductance_viscous': 0.01, # 粘滞流流导系数 (m³/s/Pa)，随两侧平均压力增大
+    'max_equalization_rate': 1e3,     # 均压速率上限 (1/s)，超过后一步内即视为完全均压
+}
+
+
+def solve_tridiagonal(diagonal: np.ndarray, off: np.ndarray, rhs: np.ndarray) -> np.ndarray:
+    """
+    批量求解对称三对角方程组（Thomas 算法，不选主元）：diagonal / rhs 为 (批量, m)，
+    off 为 (批量, m-1) 的次对角元。要求矩阵对角占优（均压方程满足），消元沿链长循环、沿批量向量化
+    """
+    m = diagonal.shape[1]
+    upper = np.empty(off.shape)
+    x = np.empty(rhs.shape)
+    pivot = diagonal[:, 0]
+    x[:, 0] = rhs[:, 0] / pivot
+    for j in range(1, m):
+        upper[:, j - 1] = off[:, j - 1] / pivot
+        pivot = diagonal[:, j] - off[:, j - 1] * upper[:, j - 1]
+        x[:, j] = (rhs[:, j] - off[:, j - 1] * x[:, j - 1]) / pivot
+    for j in range(m - 2, -1, -1):
+        x[:, j] -= upper[:, j] * x[:, j + 1]
+    return x
+
+
+class ChamberKernel:
+    """腔体物理状态的结构化数组与向量化步进"""
+
+    def __init__(self, seed: Optional[int] = None):
+        self.rng = np.random.default_rng(seed)
+        self.ids: Tuple[str, ...] = ()
+        self.index: Dict[str, int] = {}
+        self._allocate(0)
+
+    def _allocate(self, n: int):
+        # 物理状态（内核持有）
+        self.temperature = np.full(n, 25.0)
+        self.outer_temperature = np.full(n, 25.0)
+        self.pressure = np.full(n, 1e-5)
+        # 每 tick 输入
+        self.target_inner = np.full(n, 25.0)
+        self.target_outer = np.full(n, 25.0)
+        self.heating = np.zeros(n, dtype=bool)
+        self.manual_heating = np.zeros(n, dtype=bool)
+        self.roughing = np.zeros(n, dtype=bool)
+        self.molecular = np.zeros(n, dtype=bool)
+        self.vent_open = np.zeros(n, dtype=bool)
+        self.fault_runaway = np.zeros(n, dtype=bool)
+        self.fault_leak = np.zeros(n, dtype=bool)
+        # link_next[i]: chambers[i] 与 chambers[i + 1] 之间的传输阀打开
+        self.link_next = np.zeros(n, dtype=bool)
+        # 静态参数（随拓扑确定）
+        self.leak_rate = np.full(n, VACUUM_PARAMS['leak_rate_normal'])
+        self.growth = np.zeros(n, dtype=bool)
+
+    def reseed(self, seed: int):
+        self.rng = np.random.default_rng(seed)
+
+    def invalidate(self):
+        """下次 sync 时从模型重新装载物理状态"""
+        self.ids = ()
+
+    @property
+    def size(self) -> int:
+        return len(self.ids)
+
+    def sync(self, chambers: List[Chamber], adjacent: Optional[List[bool]] = None):
+        """
+        读取本 tick 的执行机构输入（泵/阀/加热模式）。
+        腔体集合变化时重建数组并从模型装载物理状态。
+        adjacent[i] 表示 chambers[i + 1] 是同一序列中的下一个腔体（二者之间是 chambers[i] 的传输阀）；
+        不提供时各腔体互不连通。
+        """
+        ids = tuple(c.id for c in chambers)
+        if ids != self.ids:
+            self._rebuild(chambers, ids)
+
+        for i, chamber in enumerate(chambers):
+            self.roughing[i] = chamber.roughingPump
+            self.molecular[i] = chamber.molecularPump
+            self.vent_open[i] = chamber.valves.vent_valve == ValveState.open
+            self.manual_heating[i] = chamber.heatingMode in ('manual', 'program')
+            self.heating[i] = chamber.isHeating
+            self.link_next[i] = bool(adjacent and adjacent[i]) and chamber.valves.transfer_valve == ValveState.open
+
+    def _rebuild(self, chambers: List[Chamber], ids: Tuple[str, ...]):
+        self.ids = ids
+        self.index = {cid: i for i, cid in enumerate(ids)}
+        self._allocate(len(ids))
+        for i, chamber in enumerate(chambers):
+            self.temperature[i] = chamber.temperature
+            self.outer_temperature[i] = chamber.outerTemperature
+            self.pressure[i] = chamber.highVacPressure if chamber.highVacPressure > 0 else 1e-7
+            chamber_type = chamber.type.value
+            if 'hk' in chamber.id or 'bake' in chamber_type:
+                self.leak_rate[i] = VACUUM_PARAMS['leak_rate_bake']
+            elif 'sz' in chamber.id or 'growth' in chamber_type:
+                self.leak_rate[i] = VACUUM_PARAMS['leak_rate_growth']
+            self.growth[i] = 'sz' in chamber.id or 'growth' in chamber_type
+
+    def step(self, dt: float, time_multiplier: float, noise: bool):
+        """
+        推进一个物理步：温度与真空。
+        高倍率下 dt 可能远大于热时间常数，温度按 MAX_THERMAL_STEP 自动细分子步
+        （噪声只在最后一个子步叠加，幅度与不细分时一致）；真空模型为指数精确解，无需细分，
+        腔体间均压为隐式欧拉步，任意 dt 下都稳定。
+        """
+        substeps = max(1, math.ceil(dt / MAX_THERMAL_STEP))
+        sub_dt = dt / substeps
+        for k in range(substeps):
+            self.step_temperature(sub_dt, time_multiplier, noise and k == substeps - 1)
+        self.step_vacuum(dt)
+        self.step_equalization(dt)
+
+    def step_temperature(self, dt: float, time_multiplier: float, noise: bool):
+        """一阶热滞后（低通滤波模拟热惯性），加热时按温差增强换热"""
+        T = self.temperature
+        alpha_base = dt / THERMAL_TAU
+
+        # 自动模式：目标温度高于当前温度 1度以上视为加热；手动/程序模式保持用户设定
+        self.heating[:] = np.where(self.manual_heating, self.heating, self.target_inner > T + 1.0)
+
+        # 距离目标越远，热交换效率越高（每 100度 增加一倍速率，最多 2 倍）
+        boost = np.minimum(2.0, 1.0 + (self.target_inner - T) / 100.0)
+        alpha = np.where(self.heating, alpha_base * boost, alpha_base)
+
+        T *= (1 - alpha)
+        T += self.target_inner * alpha
+        self.outer_temperature *= (1 - alpha)
+        self.outer_temperature += self.target_outer * alpha
+
+        # 温度失控故障：极速升温
+        T += np.where(self.fault_runaway, 5.0 * dt * time_multiplier, 0.0)
+
+        if noise:
+            T += self.rng.uniform(-0.1, 0.1, T.shape)
+            self.outer_temperature += self.rng.uniform(-0.1, 0.1, T.shape)
+
+    def step_vacuum(self, dt: float):
+        """抽气（指数逼近）/ 放气 / 泄漏（线性）模型"""
+        p = self.pressure
+        atm = VACUUM_PARAMS['atm_pressure']
+
+        pumping = self.roughing | self.molecular
+        leaking = ~self.vent_open & ~pumping
+        # 分子泵只有在前级压力足够低时才进入高真空阶段
+        high_vac = self.molecular & (p <= VACUUM_PARAMS['molecular_cutin_pressure'])
+
+        target = np.full(p.shape, atm)
+        tau = np.full(p.shape, VACUUM_PARAMS['vent_time_const'])
+        rough = pumping & ~self.vent_open & ~high_vac
+        target[rough] = VACUUM_PARAMS['roughing_target']
+        tau[rough] = VACUUM_PARAMS['roughing_time_const']
+        hv = high_vac & ~self.vent_open
+        target[hv] = np.where(self.growth[hv], VACUUM_PARAMS['molecular_target_growth'], VACUUM_PARAMS['molecular_target'])
+        tau[hv] = VACUUM_PARAMS['molecular_time_const']
+
+        # P(t) = P_target + (P_current - P_target) * exp(-dt / tau)
+        approached = np.clip(target + (p - target) * np.exp(-dt / tau), VACUUM_PARAMS['min_pressure'], atm)
+
+        # 泵关闭且未放气：线性泄漏
+        leak_rate = np.where(self.fault_leak, VACUUM_PARAMS['leak_rate_fault'], self.leak_rate)
+        leaked = np.minimum(p + leak_rate * dt, atm)
+
+        p[:] = np.where(leaking, leaked, approached)
+
+    def step_equalization(self, dt: float):
+        """
+        传输阀打开的相邻腔体之间的气体流动：Q = C (p_i - p_j)，等容积腔体 dp/dt = -(C/V) L p，
+        L 为连通链上的加权拉普拉斯矩阵。每条连通链按隐式欧拉 (I + dt·K·L) p' = p 求解，
+        总气量守恒且任意 dt 下不振荡（dt 很大时趋于完全均压）。
+        流导 C 取分子流流导加上与两侧平均压力成正比的粘滞流项，按步初压力计算。
+        所有连通链补齐到同一长度后按三对角消元 (Thomas) 批量求解，计算量与批量 × 链长成正比。
+        腔体之间只经传输阀连通；插板阀 (gate_valve) 隔离腔体与自身的泵组，不参与均压
+        （真空模型以泵的启停为输入，插板阀也不单独建模）。
+        """
+        link = self.link_next
+        n = len(link)
+        if n < 2 or not link[:-1].any():
+            return
+        p = self.pressure
+        # 最后一个腔体没有下游腔体
+        link = link.copy()
+        link[-1] = False
+
+        # 连通链：连续的 link_next 段 [start, end)，链上腔体为 start .. end（含）
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], link.view(np.int8), [0]))))
+        starts, ends = edges[0::2], edges[1::2]
+        sizes = ends - starts + 1
+        m = int(sizes.max())
+        offsets = np.arange(m)
+        members = offsets < sizes[:, None]                          # (批量, m)
+        idx = np.minimum(starts[:, None] + offsets, n - 1)          # 链上各腔体在数组中的位置
+        pc = np.where(members, p[idx], 0.0)
+
+        # 链上第 j 条边连接第 j 与 j+1 个腔体
+        edge_valid = offsets[:-1] < (sizes - 1)[:, None]            # (批量, m-1)
+        mean = (pc[:, :-1] + pc[:, 1:]) / 2
+        conductance = VACUUM_PARAMS['valve_conductance'] + VACUUM_PARAMS['valve_conductance_viscous'] * mean
+        rate = np.minimum(conductance / VACUUM_PARAMS['chamber_volume'], VACUUM_PARAMS['max_equalization_rate'])
+        w = np.where(edge_valid, rate * dt, 0.0)
+
+        diagonal = np.ones(pc.shape)
+        diagonal[:, :-1] += w
+        diagonal[:, 1:] += w
+        solved = solve_tridiagonal(diagonal, -w, pc)
+
+        p[idx[members]] = np.clip(solved[members], VACUUM_PARAMS['min_pressure'], VACUUM_PARAMS['atm_pressure'])
+
+    def write_back(self, chambers: List[Chamber]):
+        """将物理状态写回模型（发布前调用）"""
+        temperature = self.temperature.tolist()
+        outer = self.outer_temperature.tolist()
+        pressure = self.pressure.tolist()
+        heating = self.heating.tolist()
+        fault = (self.fault_runaway | (self.fault_leak & ~(self.roughing | self.molecular | self.vent_open))).tolist()
+        for i, chamber in enumerate(chambers):
+            chamber.temperature = temperature[i]
+            chamber.outerTemperature = outer[i]
+            chamber.highVacPressure = pressure[i]
+            chamber.isHeating = heating[i]
+            if fault[i]:
+                chamber.state = DeviceStatus.error
@@ -1,76 +1,392 @@
+import copy
 import time
 import math
-import random
+import secrets
 import threading
-from typing import Optional
+from typing import Any, Dict, List, Optional
 
 from app.services.state_service import StateService
 from app.services.history_service import get_history_service
-from app.models import Chamber, ValveState, DeviceStatus, SimulationConfig, SimulationFault, FaultType
+from app.services.ingest_aggregator import get_ingest_aggregator
+from app.services.alarm_engine import get_alarm_engine
+from app.services.simulation_kernel import ChamberKernel
+from app.services.recipe_profile import ProfileCache
+from app.services.process_events import ProcessEventEngine
+from app.services.clock_service import get_clock
+from app.services.settings_service import SettingsService
+from app.services.tick_scheduler import TickScheduler
+from app.services.random_streams import RandomStreams, derive_seed
+from app.services.replay_service import SimulationRecorder, group_events, restore_arguments, state_digest
+from app.models import Cart, Chamber, SystemState, SimulationConfig, SimulationFault, FaultType
 import uuid
 
+
+class TickIndex:
+    """
+    单个 tick 内各仿真阶段共享的索引（在写事务内基于工作副本构建一次）
+
+    - chambers: 全部腔体（按线体、阳极/阴极顺序）
+    - chamber_by_id: 腔体 ID -> 腔体
+    - cart_by_chamber: 腔体 ID -> 其中的第一辆小车
+    - adjacent: adjacent[i] 表示 chambers[i + 1] 与 chambers[i] 在同一阳极/阴极序列中相邻
+    """
+    __slots__ = ('chambers', 'chamber_by_id', 'cart_by_chamber', 'adjacent')
+
+    def __init__(self, state: SystemState):
+        self.chambers: List[Chamber] = []
+        self.adjacent: List[bool] = []
+        for line in state.lines:
+            for sequence in (line.anodeChambers, line.cathodeChambers):
+                self.chambers.extend(sequence)
+                self.adjacent.extend([True] * (len(sequence) - 1) + [False] * bool(sequence))
+        self.chamber_by_id: Dict[str, Chamber] = {c.id: c for c in self.chambers}
+        self.cart_by_chamber: Dict[str, Cart] = {}
+        for cart in state.carts:
+            self.cart_by_chamber.setdefault(cart.locationChamberId, cart)
+
+
 class SimulationService:
+    """
+    仿真引擎（全局唯一，由 get_simulation_service() 获取，应用 lifespan 负责启动/关闭）
+
+    生命周期：stopped -> running <-> paused -> stopped。暂停时冻结虚拟时钟，
+    可在暂停或停止状态下单步推进；恢复后从暂停时刻继续。
+    """
+    # 快进模式默认参数：仿真步长 (虚拟秒)、历史记录间隔 (虚拟秒)、每次发布包含的 tick 数
+    FAST_FORWARD_STEP = 10.0
+    FAST_FORWARD_RECORD_INTERVAL = 60.0
+    FAST_FORWARD_PUBLISH_TICKS = 360
+
     def __init__(self):
         self.state_service = StateService()
+        # 生命周期状态：stopped / running / paused；running 表示实时循环线程在运行
+        self.status = 'stopped'
         self.running = False
         self.thread: Optional[threading.Thread] = None
-        self._last_update = time.time()
         
         # Simulation Configuration
         self._config = SimulationConfig()
         
+        # 虚拟时钟：所有仿真时间（配方阶段、工序耗时、历史时间戳）都从这里读取
+        self.clock = get_clock()
+        self._last_update = self.clock.now()
+        self._clock_epoch = self.clock.epoch
+        self._fast_forward_lock = threading.Lock()
+        # 实时循环的固定频率调度器（周期取自 HardwareConfig.pollingInterval）
+        self._scheduler = TickScheduler(self._tick_period(), self._config.tickPolicy)
+        
+        # 腔体物理状态的向量化内核
+        self._kernel = ChamberKernel()
+        # 按实体划分的种子随机流；未配置种子时随机选取（录制时记录下来）
+        self._streams = RandomStreams(0)
+        self._reseed(self._config.seed if self._config.seed is not None else secrets.randbits(32))
+        self._recorder: Optional[SimulationRecorder] = None
+        # 回放期间为 True：不产生原始样本抓取等外部副作用
+        self._replaying = False
+        # 按小车缓存的已编译配方设定曲线
+        self._profiles = ProfileCache()
+        # 小车工序的离散事件队列（工序到时、冷却完成、可转移、进度刷新）
+        self._process_events = ProcessEventEngine()
+        # 采集驱动启用时为 True：腔体物理量以采集值为准，跳过物理步进与腔体历史记录
+        self.external_physics = False
+        # 故障索引：腔体 ID -> 生效中的故障，注入/清除/更新配置时重建
+        self._fault_index: Dict[str, List[SimulationFault]] = {}
+        
+        # 仿真簿记随状态一起持久化（journal aux），重启后继续生效
+        bookkeeping = self.state_service.get_aux('simulation', {})
         # 小车位置追踪：{cart_id: {'chamber_id': str, 'enter_time': float}}
-        self._cart_locations = {}
+        self._cart_locations = bookkeeping.get('cart_locations', {})
         # 温度突降事件追踪：{cart_id: {'temp_drop': float, 'start_time': float}}
-        self._temp_drop_events = {}
+        self._temp_drop_events = bookkeeping.get('temp_drop_events', {})
+        # 虚拟时钟相对墙上时间的偏移（加速/快进后重启时保持时间线连续）
+        clock_offset = bookkeeping.get('clock_offset', 0)
+        if clock_offset:
+            self.clock.set(time.time() + clock_offset)
+            self._last_update = self.clock.now()
+            self._clock_epoch = self.clock.epoch
 
     def get_config(self) -> SimulationConfig:
         return self._config
 
     def update_config(self, config: SimulationConfig) -> SimulationConfig:
-        self._config = config
+        # 与 tick 互斥，录制时外部输入落在确定的 tick 之间
+        with self.state_service.mutate():
+            self._record_event('config', config=config)
+            self._config = config
+            self.clock.set_rate(config.timeMultiplier)
+            self._scheduler.set_policy(config.tickPolicy)
+            if config.seed is not None and config.seed != self._streams.seed:
+                self._reseed(config.seed)
+            self._reindex_faults()
         return self._config
 
     def inject_fault(self, fault_type: FaultType, line_id: str, chamber_id: str) -> SimulationFault:
-        fault = SimulationFault(
-            id=str(uuid.uuid4()),
-            type=fault_type,
-            targetLineId=line_id,
-            targetChamberId=chamber_id,
-            startTime=time.time(),
-            description=f"Manual injection of {fault_type} at {chamber_id}"
-        )
-        self._config.activeFaults.append(fault)
+        with self.state_service.mutate():
+            self._record_event('fault', fault_type=fault_type, line_id=line_id, chamber_id=chamber_id)
+            fault = SimulationFault(
+                id=str(uuid.UUID(int=self._streams.get('faults').getrandbits(128), version=4)),
+                type=fault_type,
+                targetLineId=line_id,
+                targetChamberId=chamber_id,
+                startTime=self.clock.now(),
+                description=f"Manual injection of {fault_type} at {chamber_id}"
+            )
+            self._config.activeFaults.append(fault)
+            self._reindex_faults()
+        # 故障视同报警：抓取该腔体故障前后的原始样本（回放重放的故障不抓取）
+        if not self._replaying:
+            get_ingest_aggregator().capture([chamber_id], fault.startTime, f"fault:{fault_type.value}")
         return fault
 
     def clear_faults(self):
-        self._config.activeFaults = []
+        with self.state_service.mutate():
+            self._record_event('clear_faults')
+            self._config.activeFaults = []
+            self._reindex_faults()
+
+    def set_external_physics(self, external: bool):
+        """
+        采集服务接管/交还腔体物理量（与 tick 互斥）。接管期间内核持有的物理状态没有推进，
+        交还时须从模型（最后的采集值）重新装载；接管时同样标记失效，使交还前不会沿用旧数组
+        """
+        with self.state_service.mutate():
+            self.external_physics = external
+            self._kernel.invalidate()
+
+    # ==================== 种子与录制/回放 ====================
+
+    def _reseed(self, seed: int):
+        """重置全部随机流：实体噪声、向量化内核噪声与状态服务的 ID 生成"""
+        self._streams.reseed(seed)
+        self._kernel.reseed(derive_seed(seed, 'kernel'))
+        self.state_service.reseed_ids(derive_seed(seed, 'ids'))
+
+    def _record_event(self, kind: str, **payload):
+        if self._recorder is not None:
+            self._recorder.record_event(kind, self.clock.now(), **payload)
+
+    def _capture(self) -> Dict[str, Any]:
+        """录制/回放的起点：状态快照、仿真簿记与配置（需持有写者锁）"""
+        return {
+            'state': self.state_service.snapshot(),
+            'bookkeeping': copy.deepcopy({
+                'cart_locations': self._cart_locations,
+                'temp_drop_events': self._temp_drop_events,
+            }),
+            'config': self._config.model_dump(mode='json'),
+        }
+
+    def _load(self, capture: Dict[str, Any], seed: int):
+        """从起点恢复（需持有写者锁）：内核与设定曲线缓存从模型重建，时间倍率与节拍策略随配置恢复"""
+        self.state_service.restore(capture['state'])
+        bookkeeping = copy.deepcopy(capture['bookkeeping'])
+        self._cart_locations = bookkeeping['cart_locations']
+        self._temp_drop_events = bookkeeping['temp_drop_events']
+        self._config = SimulationConfig.model_validate(capture['config'])
+        self.clock.set_rate(self._config.timeMultiplier)
+        self._scheduler.set_policy(self._config.tickPolicy)
+        self._reindex_faults()
+        self._kernel.invalidate()
+        self._profiles.clear()
+        self._process_events.clear()
+        self._reseed(seed)
+
+    def start_recording(self, seed: Optional[int] = None) -> int:
+        """开始录制：从当前状态起记录 tick 序列与外部输入，返回运行种子"""
+        with self.state_service.mutate():
+            seed = seed if seed is not None else secrets.randbits(32)
+            # 起点状态经过一次序列化往返，录制与回放从完全相同的模型开始
+            capture = self._capture()
+            self._load(capture, seed)
+            self._recorder = SimulationRecorder(seed, capture)
+            self.state_service.set_recorder(self._recorder)
+        return seed
+
+    def stop_recording(self) -> Optional[Dict[str, Any]]:
+        """结束录制，返回录制数据（含最终状态摘要）"""
+        with self.state_service.mutate():
+            recorder, self._recorder = self._recorder, None
+            self.state_service.set_recorder(None)
+        if recorder is None:
+            return None
+        return recorder.finish(self.state_service.get_state())
+
+    def replay(self, recording: Dict[str, Any], restore: bool = True) -> dict:
+        """
+        以快进方式逐 tick 重放录制，返回最终状态摘要及是否与录制一致。
+        restore=True 时回放结束后恢复回放前的状态、配置与虚拟时钟。
+        回放期间其他写者等待，重放的指令日志不写入历史事件，中间状态不写入 journal。
+        """
+        if self._recorder is not None:
+            raise ValueError("Cannot replay while recording")
+        events = group_events(recording['events'])
+        ticks = recording['ticks']
+
+        with self._fast_forward_lock:
+            was_running = self.running
+            if was_running:
+                self._stop_loop()
+            clock = self.clock
+            was_frozen = clock.frozen
+            live_time, live_offset = clock.now(), clock.offset
+            clock.freeze()
+            started_at = time.perf_counter()
+            self._replaying = True
+            try:
+                with self.state_service.detached():
+                    with self.state_service.mutate():
+                        previous = self._capture()
+                        previous_seed = self._streams.seed
+                        self._load(recording['snapshot'], recording['seed'])
+                    for i in range(len(ticks) + 1):
+                        with self.state_service.mutate() as state:
+                            for event in events.get(i, []):
+                                self._apply_event(event)
+                            if i < len(ticks):
+                                now, dt = ticks[i]
+                                clock.set(now)
+                                self._tick(state, dt, now, alarms=False)
+                    digest = state_digest(self.state_service.get_state())
+                    if restore:
+                        with self.state_service.mutate():
+                            self._load(previous, previous_seed)
+                        # 暂停时回到暂停时刻；运行中保持回放前相对墙上时间的偏移
+                        clock.set(live_time if was_frozen else time.time() + live_offset)
+            finally:
+                self._replaying = False
+                if not was_frozen:
+                    clock.unfreeze()
+                if was_running:
+                    self._start_loop()
+
+        return {
+            'ticks': len(ticks),
+            'events': len(recording['events']),
+            'digest': digest,
+            'expectedDigest': recording.get('digest'),
+            'match': digest == recording.get('digest'),
+            'wallSeconds': time.perf_counter() - started_at,
+        }
+
+    def _apply_event(self, event: Dict[str, Any]):
+        """在录制时的虚拟时间重放一条外部输入（指令失败与录制时一致，忽略）"""
+        with self.clock.pinned(event['time']):
+            kind = event['kind']
+            if kind == 'command':
+                method = getattr(self.state_service, event['method'])
+                try:
+                    method(**restore_arguments(event['method'], event['arguments']))
+                except ValueError:
+                    pass
+            elif kind == 'fault':
+                self.inject_fault(FaultType(event['fault_type']), event['line_id'], event['chamber_id'])
+            elif kind == 'clear_faults':
+                self.clear_faults()
+            elif kind == 'config':
+                self.update_config(SimulationConfig.model_validate(event['config']))
+
+    def _reindex_faults(self):
+        index: Dict[str, List[SimulationFault]] = {}
+        for fault in self._config.activeFaults:
+            if fault.active:
+                index.setdefault(fault.targetChamberId, []).append(fault)
+        self._fault_index = index
+
 
+    # ==================== 生命周期 ====================
 
     def start(self):
-        if self.running:
+        if self.status == 'running':
+            return
+        if self.status == 'paused':
+            self.resume()
             return
         
         # 启动前先检查并生成模拟历史数据
         self.generate_initial_mock_data()
-        
+        self._start_loop()
+        self.status = 'running'
+
+    def pause(self):
+        """暂停实时循环并冻结虚拟时钟（配方进度、工序计时随之停止）"""
+        if self.status != 'running':
+            raise ValueError("Simulation is not running")
+        self._stop_loop()
+        self.clock.freeze()
+        self.status = 'paused'
+
+    def resume(self):
+        """从暂停时刻继续（解冻时钟的跳变不计入物理步长）"""
+        if self.status != 'paused':
+            raise ValueError("Simulation is not paused")
+        self.clock.unfreeze()
+        self._start_loop()
+        self.status = 'running'
+
+    def step(self, count: int = 1, dt: Optional[float] = None) -> dict:
+        """
+        在暂停或停止状态下推进 count 个 tick。
+        dt 默认为实时循环一个节拍对应的虚拟时长（轮询周期 × 时间倍率）。
+        """
+        if self.status == 'running':
+            raise ValueError("Pause the simulation before stepping")
+        if count < 1:
+            raise ValueError("count must be positive")
+        dt = dt or self._tick_period() * self._config.timeMultiplier
+        return self.fast_forward(count * dt, step=dt)
+
+    def get_status(self) -> dict:
+        """引擎状态：生命周期、节拍频率、延迟与实体数量"""
+        state = self.state_service.get_state()
+        metrics = self._scheduler.metrics()
+        return {
+            'status': self.status,
+            'tickRate': metrics['tickRate'],
+            'measuredTickRate': metrics['measuredTickRate'],
+            'ticks': metrics['ticks'],
+            'lag': metrics['lastLateness'],
+            'meanLag': metrics['meanLateness'],
+            'maxLag': metrics['maxLateness'],
+            'tickDuration': metrics['lastDuration'],
+            'virtualTime': self.clock.now(),
+            'timeMultiplier': self._config.timeMultiplier,
+            'pendingEvents': self._process_events.pending,
+            'entities': {
+                'lines': len(state.lines),
+                'chambers': sum(len(line.anodeChambers) + len(line.cathodeChambers) for line in state.lines),
+                'carts': len(state.carts),
+            },
+        }
+
+    def _start_loop(self):
         self.running = True
+        self._last_update = self.clock.now()
+        self._clock_epoch = self.clock.epoch
         self.thread = threading.Thread(target=self._update_loop, daemon=True)
         self.thread.start()
 
     def stop(self):
         """优雅关闭模拟服务"""
+        if self.status == 'stopped' and not self.running:
+            return
+        if self.status == 'paused':
+            self.clock.unfreeze()
+        self._stop_loop()
+        self.status = 'stopped'
+        print("SimulationService stopped.")
+
+    def _stop_loop(self):
         if not self.running:
             return
         
         self.running = False
+        self._scheduler.wake()
         
         # 等待后台线程结束（最多等待2秒）
         if self.thread and self.thread.is_alive():
             self.thread.join(timeout=2.0)
         
         self.thread = None
-        print("SimulationService stopped.")
 
     def generate_initial_mock_data(self):
         """生成初始模拟数据（如果历史数据为空）"""
@@ -97,7 +413,7 @@ class SimulationService:
         print("Generating mock history data for chambers...")
         
         # 生成过去24小时的数据，每5分钟一个点
-        now = time.time()
+        now = self.clock.now()
         start_time = now - 24 * 3600
         step = 300  # 5 minutes
         
@@ -159,25 +475,27 @@ class SimulationService:
             inner_temp = 25.0
             
         # 添加随机噪声
-        return inner_temp + random.uniform(-1, 1)
+        return inner_temp + self._streams.get(chamber.id, 'mock').uniform(-1, 1)
 
     def _calculate_mock_vacuum(self, chamber: Chamber, timestamp: float) -> float:
         """计算模拟真空度"""
         # 简单逻辑：烘烤/生长仓高真空，其他低真空或大气
+        rng = self._streams.get(chamber.id, 'mock')
         if 'hk' in chamber.id or 'sz' in chamber.id:
             base = 1e-4 if 'hk' in chamber.id else 1e-5
             # log normal noise
-            val = base * (10 ** random.uniform(-0.5, 0.5))
+            val = base * (10 ** rng.uniform(-0.5, 0.5))
             return min(val, 101325.0)
         elif 'process' in chamber.type.value:
-            return 1e-3 * (10 ** random.uniform(-0.5, 0.5))
+            return 1e-3 * (10 ** rng.uniform(-0.5, 0.5))
         else:
             return 101325.0  # 大气压
 
-    def _record_chamber_history(self):
-        """记录所有腔体的历史数据"""
-        state = self.state_service.get_state()
-        history_service = get_history_service()
+    def _record_chamber_history(self, state: Optional[SystemState] = None):
+        """记录所有腔体的历史数据（经预聚合层写入）"""
+        if state is None:
+            state = self.state_service.get_state()
+        timestamp = self.clock.now()
         
         batch_data = []
         for line in state.lines:
@@ -188,281 +506,205 @@ class SimulationService:
                     'entity_id': chamber.id,
                     'temperature': chamber.temperature,
                     'vacuum': chamber.highVacPressure,
-                    'timestamp': time.time()
+                    'timestamp': timestamp
                 })
         
         if batch_data:
-            history_service.record_data_batch(batch_data)
+            get_ingest_aggregator().ingest(batch_data)
+
+    @staticmethod
+    def _tick_period() -> float:
+        """实时 tick 周期 (秒)，与硬件采集轮询间隔一致"""
+        return SettingsService().get_settings().hardware.pollingInterval / 1000.0
+
+    def get_scheduler_metrics(self) -> dict:
+        """实时循环的节拍指标：周期、跳过/补跑的 tick 数、迟到时间与 tick 耗时 (秒)"""
+        return self._scheduler.metrics()
 
     def _update_loop(self):
+        scheduler = self._scheduler
+        scheduler.reset()
         while self.running:
-            now = time.time()
-            real_dt = now - self._last_update
+            # 轮询间隔可在运行中修改，从下一个节拍起生效
+            scheduler.set_period(self._tick_period())
+            if not scheduler.wait():
+                continue
+            if not self.running:
+                break
+            tick_started = time.monotonic()
+
+            # 虚拟时钟已按 timeMultiplier 推进，dt 即虚拟时间增量
+            now = self.clock.now()
+            if self.clock.epoch != self._clock_epoch:
+                # 时钟发生跳变（快进/设定时间），不把跳变量计入物理步长
+                self._clock_epoch = self.clock.epoch
+                self._last_update = now
+            dt = now - self._last_update
             self._last_update = now
             
-            # Apply Time Multiplier
-            dt = real_dt * self._config.timeMultiplier
-            
-            # Update Logic (every ~1s is handled by sleep, but using dt for smooth calc)
-            self._simulate_temperature(dt)
-            self._simulate_vacuum(dt)
-            self._update_mes_data(dt)
-            self._update_cart_progress(dt)
-            
-            # 记录腔体历史数据
-            self._record_chamber_history()
+            # 整个 tick 作为一次写事务，结束后发布新一代状态供读者无锁读取
+            with self.state_service.mutate() as state:
+                cart_batch_data = self._tick(state, dt, now)
             
-            time.sleep(1.0) # Tick every 1 second (independent of simulation speed)
+            # 记录腔体/小车历史数据（基于已发布的一代，不占用写者锁）
+            if not self.external_physics:
+                self._record_chamber_history()
+            if cart_batch_data:
+                get_ingest_aggregator().ingest(cart_batch_data)
 
-    def _simulate_temperature(self, dt: float):
-        """温度趋势模拟 - 基于配方与物理模型"""
-        state = self.state_service.get_state()
-        current_time = time.time()
+            scheduler.advance(tick_started)
+
+    def _tick(self, state: SystemState, dt: float, now: float, alarms: bool = True):
+        """
+        在工作副本上推进一个仿真步（tick 内虚拟时间固定为 now），返回待记录的小车历史数据。
+        alarms=False 时不评估报警（回放不应改变实时的报警状态）
+        """
+        if self._recorder is not None:
+            self._recorder.record_tick(now, dt)
+        # 物理步进与 MES 参数每个 tick 都会改写全部腔体与小车
+        self.state_service.touch_all()
+        with self.clock.pinned(now):
+            index = TickIndex(state)
+            if not self.external_physics:
+                self._simulate_physics(state, dt, index)
+            cart_batch_data = self._update_mes_data(state, dt, index)
+            self._advance_process_events(state, now - dt, now)
+            if alarms:
+                # 外部采集模式下同样评估（读数已由采集服务写入状态）
+                get_alarm_engine().evaluate(state, index.chambers, now, index.cart_by_chamber)
+        return cart_batch_data
+
+    def fast_forward(
+        self,
+        duration: float,
+        step: Optional[float] = None,
+        start: Optional[float] = None,
+        record_interval: Optional[float] = None,
+        record_history: bool = True
+    ) -> dict:
+        """
+        快进 (headless) 模式：冻结虚拟时钟，按固定步长尽可能快地推进 duration 虚拟秒（不 sleep）。
+
+        :param start: 快进起点 (epoch 秒)，例如 now - 24h 用于回填历史；默认从当前虚拟时间开始
+        :param record_interval: 历史记录间隔 (虚拟秒)
+        实时循环在快进期间暂停，结束后从到达的虚拟时间继续。
+        """
+        step = step or self.FAST_FORWARD_STEP
+        record_interval = record_interval or self.FAST_FORWARD_RECORD_INTERVAL
+        if duration <= 0 or step <= 0:
+            raise ValueError("duration and step must be positive")
+
+        with self._fast_forward_lock:
+            was_running = self.running
+            if was_running:
+                self._stop_loop()
+
+            # 快进可能从过去的时刻开始回填：先结束实时时间桶，结束后再写出快进的最后一个时间桶
+            aggregator = get_ingest_aggregator()
+            aggregator.flush()
+            clock = self.clock
+            was_frozen = clock.frozen
+            clock.freeze()
+            if start is not None:
+                clock.set(start)
+            started_at = time.perf_counter()
+            begin = clock.now()
+            ticks = 0
+            next_record = begin
+            try:
+                elapsed = 0.0
+                while elapsed < duration:
+                    # 多个 tick 合并为一次写事务，减少发布与 journal 记录
+                    with self.state_service.mutate() as state:
+                        for _ in range(self.FAST_FORWARD_PUBLISH_TICKS):
+                            if elapsed >= duration:
+                                break
+                            dt = min(step, duration - elapsed)
+                            clock.advance(dt)
+                            elapsed += dt
+                            ticks += 1
+                            cart_batch_data = self._tick(state, dt, clock.now())
+                            if record_history and clock.now() >= next_record:
+                                next_record += record_interval
+                                self._record_chamber_history(state)
+                                if cart_batch_data:
+                                    aggregator.ingest(cart_batch_data)
+            finally:
+                aggregator.flush()
+                # 暂停状态下单步推进后保持冻结
+                if not was_frozen:
+                    clock.unfreeze()
+                if was_running:
+                    self._start_loop()
+
+            return {
+                'ticks': ticks,
+                'virtualStart': begin,
+                'virtualEnd': clock.now(),
+                'wallSeconds': time.perf_counter() - started_at,
+            }
+
+    def _simulate_physics(self, state: SystemState, dt: float, index: Optional[TickIndex] = None):
+        """温度/真空物理模拟：配方目标逐腔体计算，物理步进由向量化内核完成"""
+        if index is None:
+            index = TickIndex(state)
+        kernel = self._kernel
+        chambers = index.chambers
+        kernel.sync(chambers, index.adjacent)
+        if not kernel.size:
+            return
+
+        self._compute_temperature_targets(state, index)
+
+        # 故障掩码（只遍历有故障的腔体）
+        kernel.fault_runaway[:] = False
+        kernel.fault_leak[:] = False
+        for chamber_id, faults in self._fault_index.items():
+            i = kernel.index.get(chamber_id)
+            if i is None:
+                continue
+            for fault in faults:
+                if fault.type == FaultType.temp_runaway:
+                    kernel.fault_runaway[i] = True
+                elif fault.type == FaultType.vacuum_leak:
+                    kernel.fault_leak[i] = True
+
+        kernel.step(dt, self._config.timeMultiplier, self._config.noiseEnabled)
+        kernel.write_back(chambers)
+
+    def _compute_temperature_targets(self, state: SystemState, index: TickIndex):
+        """温度目标计算 - 查表已编译的配方设定曲线，结果写入内核的目标温度数组"""
+        kernel = self._kernel
+        current_time = self.clock.now()
         
-        # 获取配方服务
         from app.services.recipe_service import get_recipe_service
         recipe_service = get_recipe_service()
+        self._profiles.prune(c.id for c in state.carts)
         
-        # 缓存配方以减少IO (每秒一次不必每次都读，服务有内存缓存)
-        
-        for line in state.lines:
-            all_chambers = line.anodeChambers + line.cathodeChambers
-            for chamber in all_chambers:
-                target_inner = 25.0
-                target_outer = 25.0
-                
-                cart_in_chamber = next((c for c in state.carts if c.locationChamberId == chamber.id), None)
-                
-                if cart_in_chamber and cart_in_chamber.recipeId:
-                    recipe = recipe_service.get_recipe(cart_in_chamber.recipeId)
-                    if recipe:
-                        # 基于当前任务决定目标温度
-                        task_name = cart_in_chamber.currentTask
-                        
-                        # ========== 烘烤工艺 ==========
-                        if '烘烤' in task_name or 'bake' in chamber.type.value:
-                            # 查找烘烤工序的开始时间
-                            start_time = None
-                            for step in cart_in_chamber.steps:
-                                if '烘烤' in step.name and step.status == 'active' and step.startTime:
-                                    import datetime
-                                    st = datetime.datetime.fromisoformat(step.startTime)
-                                    start_time = st.timestamp()
-                                    break
-                            
-                            if start_time:
-                                elapsed = current_time - start_time
-                                total_duration = recipe.bakeDuration * 3600
-                                
-                                # 简单曲线: 
-                                # 0 - 70% 时间: 升温/恒温到 Target
-                                # 70% - 85% 时间: 开始降温
-                                # 85% - 100% 时间: 降温到出炉温度 (e.g. 70C)
-                                
-                                heat_phase = total_duration * 0.7
-                                cool_phase_1 = total_duration * 0.85
-                                
-                                if elapsed < heat_phase:
-                                    # 升温/恒温
-                                    target_inner = recipe.bakeTargetTemp
-                                elif elapsed < cool_phase_1:
-                                    # 降温阶段 1
-                                    target_inner = 70.0 + (recipe.bakeTargetTemp - 70.0) * (1 - (elapsed - heat_phase) / (cool_phase_1 - heat_phase))
-                                elif elapsed < total_duration:
-                                    # 降温阶段 2
-                                    target_inner = 70.0 - (70.0 - 25.0) * ((elapsed - cool_phase_1) / (total_duration - cool_phase_1))
-                                else:
-                                    target_inner = 25.0
-                                    
-                                target_outer = target_inner + 20.0 # 外温略高
-                            else:
-                                target_inner = recipe.bakeTargetTemp
-                                target_outer = target_inner + 20.0
-
-                        # ========== 生长工艺 (阴极) ==========
-                        elif '生长' in task_name and recipe.targetLineType == 'cathode':
-                             # 查找生长工序
-                            start_time = None
-                            for step in cart_in_chamber.steps:
-                                if '生长' in step.name and step.status == 'active' and step.startTime:
-                                    import datetime
-                                    st = datetime.datetime.fromisoformat(step.startTime)
-                                    start_time = st.timestamp()
-                                    break
-                            
-                            if start_time:
-                                elapsed = current_time - start_time
-                                # 生长过程降温: 230 -> 110 (或配置)
-                                # 假设起始温度是烘烤后的余温或者特定生长起始温
-                                start_temp = 230.0 
-                                end_temp = recipe.growthTargetTemp
-                                
-                                # 假设降温过程占 5 小时，其余时间恒温
-                                drop_duration = 5 * 3600
-                                
-                                if elapsed < drop_duration:
-                                    target_inner = start_temp - (start_temp - end_temp) * (elapsed / drop_duration)
-                                else:
-                                    target_inner = end_temp
-                                    
-                                target_outer = target_inner
-                            else:
-                                target_inner = recipe.growthTargetTemp
-                                target_outer = target_inner
-
-                        # ========== 对接/铟封/其他 ==========
-                        elif '对接' in task_name:
-                            target_inner = recipe.indiumTemp if recipe.indiumTemp > 0 else 95.0
-                            target_outer = target_inner + 30.0
-                        elif '铟封' in task_name:
-                             target_inner = recipe.indiumTemp
-                             target_outer = target_inner + 20.0
-                        
-                # 无小车或无配方，按照腔体自身的设定温度逐渐恢复
-                if not cart_in_chamber:
-                    target_inner = chamber.targetTemperature
-                    target_outer = target_inner + 10.0 # 外温略高
-                
-                # 更新加热指示状态
-                # 如果用户手动设置了加热模式（manual/program），尊重用户设置
-                # 只有在 heatingMode 为 off 或未设置时，才根据温度差自动判断
-                if chamber.heatingMode in ('manual', 'program'):
-                    # 用户手动控制，保持当前 isHeating 状态不变
-                    pass
-                else:
-                    # 自动模式：如果目标温度高于当前温度 1度以上，认为是在加热
-                    chamber.isHeating = target_inner > chamber.temperature + 1.0
-                
-                # 应用更新 (低通滤波模拟热惯性)
-                # dt 约 1s
-                # 热时间常数 tau ~ 150s (从 300s 调快，使趋势更明显)
-                tau = 150.0
-                
-                # 如果正在加热，可以使用非线性加速（前期升温快）
-                if chamber.isHeating:
-                    # 距离目标越远，热交换效率越高，这里稍微增强 alpha
-                    temp_diff = target_inner - chamber.temperature
-                    boost = 1.0 + (temp_diff / 100.0) # 每 100度 增加一倍速率
-                    alpha = (dt / tau) * min(2.0, boost)
-                else:
-                    alpha = dt / tau
-                    
-                chamber.temperature = chamber.temperature * (1 - alpha) + target_inner * alpha
-                chamber.outerTemperature = chamber.outerTemperature * (1 - alpha) + target_outer * alpha
-                
-                # Check for active faults
-                for fault in self._config.activeFaults:
-                    if fault.active and fault.targetChamberId == chamber.id:
-                        if fault.type == FaultType.temp_runaway:
-                            # 模拟温度失控：极速升温
-                            chamber.temperature += 5.0 * dt * self._config.timeMultiplier 
-                            chamber.state = DeviceStatus.error
-
-                # 加上微小随机波动 (如果开启)
-                if self._config.noiseEnabled:
-                    chamber.temperature += random.uniform(-0.1, 0.1)
-                    chamber.outerTemperature += random.uniform(-0.1, 0.1)
-
-
-    def _simulate_vacuum(self, dt: float):
-        """真空度趋势模拟 - 详细物理模型"""
-        state = self.state_service.get_state()
-
-        # 真空度参数配置
-        VACUUM_PARAMS = {
-            'roughing_target': 1.0,           # 粗抽泵目标压力 (Pa)
-            'roughing_time_const': 60.0,      # 粗抽时间常数 (秒)
-            'molecular_target': 1e-5,         # 分子泵目标压力 (Pa)
-            'molecular_time_const': 300.0,    # 分子泵时间常数 (秒)
-            'leak_rate_bake': 1e-7,          # 烘烤仓泄漏率 (Pa/s)
-            'leak_rate_normal': 5e-8,        # 普通腔体泄漏率 (Pa/s)
-            'leak_rate_growth': 1e-8,        # 生长仓泄漏率 (Pa/s, 超高真空)
-            'vent_time_const': 10.0,         # 放气时间常数 (秒)
-            'atm_pressure': 101325.0,        # 大气压 (Pa)
-        }
-
-        for line in state.lines:
-            all_chambers = line.anodeChambers + line.cathodeChambers
-            for chamber in all_chambers:
-                current_p = chamber.highVacPressure
-                target_p = VACUUM_PARAMS['atm_pressure']
-                time_const = 1.0
-                
-                # 防止压力值异常
-                if current_p <= 0:
-                    current_p = 1e-7
-                    chamber.highVacPressure = current_p
-                
-                # ========== 判断设备状态 ==========
-                roughing_on = chamber.roughingPump
-                molecular_on = chamber.molecularPump
-                vent_open = chamber.valves.vent_valve == ValveState.open
-                
-                # ========== 放气阶段（优先级最高）==========
-                if vent_open:
-                    target_p = VACUUM_PARAMS['atm_pressure']
-                    time_const = VACUUM_PARAMS['vent_time_const']
-                
-                # ========== 抽真空阶段 ==========
-                elif roughing_on or molecular_on:
-                    if roughing_on and not molecular_on:
-                        # 仅粗抽：降到 1 Pa
-                        target_p = VACUUM_PARAMS['roughing_target']
-                        time_const = VACUUM_PARAMS['roughing_time_const']
-                    elif molecular_on:
-                        # 分子泵：降到 1e-5 Pa（需要前级粗抽泵配合）
-                        if current_p > 10.0:
-                            # 压力太高，分子泵效率低，先粗抽
-                            target_p = VACUUM_PARAMS['roughing_target']
-                            time_const = VACUUM_PARAMS['roughing_time_const']
-                        else:
-                            # 高真空阶段
-                            target_p = VACUUM_PARAMS['molecular_target']
-                            # 根据腔体类型调整目标真空度
-                            if 'sz' in chamber.id or 'growth' in chamber.type.value:
-                                target_p = 1e-6  # 生长仓超高真空
-                            time_const = VACUUM_PARAMS['molecular_time_const']
-                
-                # ========== 泄漏阶段（泵关闭且未放气）==========
-                else:
-                    # 根据腔体类型选择泄漏率
-                    if 'hk' in chamber.id or 'bake' in chamber.type.value:
-                        leak_rate = VACUUM_PARAMS['leak_rate_bake']
-                    elif 'sz' in chamber.id or 'growth' in chamber.type.value:
-                        leak_rate = VACUUM_PARAMS['leak_rate_growth']
-                    else:
-                        leak_rate = VACUUM_PARAMS['leak_rate_normal']
-                    
-                    # 检查故障注入
-                    for fault in self._config.activeFaults:
-                        if fault.active and fault.targetChamberId == chamber.id:
-                            if fault.type == FaultType.vacuum_leak:
-                                leak_rate = 100.0 # 严重泄漏
-                                chamber.state = DeviceStatus.error
-                    
-                    # 线性泄漏模型
-                    delta_p = leak_rate * dt
-                    new_p = current_p + delta_p
-                    chamber.highVacPressure = min(new_p, VACUUM_PARAMS['atm_pressure'])
-                    continue  # 跳过指数逼近
-                
-                # ========== 指数逼近模型 ==========
-                # P(t) = P_target + (P_current - P_target) * exp(-dt / tau)
-                if target_p < current_p:
-                    # 抽真空（压力下降）
-                    chamber.highVacPressure = target_p + (current_p - target_p) * math.exp(-dt / time_const)
-                else:
-                    # 放气或泄漏（压力上升）
-                    chamber.highVacPressure = target_p - (target_p - current_p) * math.exp(-dt / time_const)
-                
-                chamber.highVacPressure = max(1e-9, min(chamber.highVacPressure, VACUUM_PARAMS['atm_pressure']))
+        for i, chamber in enumerate(index.chambers):
+            cart_in_chamber = index.cart_by_chamber.get(chamber.id)
+            
+            if cart_in_chamber:
+                profile = self._profiles.get(cart_in_chamber, chamber, recipe_service)
+                target_inner, target_outer = profile.evaluate(current_time)
+            else:
+                # 无小车，按照腔体自身的设定温度逐渐恢复
+                target_inner = chamber.targetTemperature
+                target_outer = target_inner + 10.0 # 外温略高
+            
+            kernel.target_inner[i] = target_inner
+            kernel.target_outer[i] = target_outer
 
-    def _update_mes_data(self, dt: float):
-        """更新小车MES数据"""
-        state = self.state_service.get_state()
-        current_time = time.time()
+    def _update_mes_data(self, state: SystemState, dt: float, index: Optional[TickIndex] = None):
+        """更新小车MES数据，返回待记录的小车历史数据"""
+        if index is None:
+            index = TickIndex(state)
+        current_time = self.clock.now()
         cart_batch_data = []
         
+        from app.services.recipe_service import get_recipe_service
+        recipe_service = get_recipe_service()
+        
         for cart in state.carts:
             # ========== 位置变化检测 ==========
             current_chamber_id = cart.locationChamberId
@@ -487,7 +729,7 @@ class SimulationService:
                 # 检查是否是阴极小车进入烘烤仓
                 if cart.number.startswith('C') and 'hk' in current_chamber_id:
                     # 触发温度突降事件：下降3-5℃
-                    temp_drop = random.uniform(3.0, 5.0)
+                    temp_drop = self._streams.get(cart.id, 'event').uniform(3.0, 5.0)
                     self._temp_drop_events[cart.id] = {
                         'temp_drop': temp_drop,
                         'start_time': current_time,
@@ -495,16 +737,7 @@ class SimulationService:
                     }
             
             # 查找小车所在腔体
-            chamber = None
-            for line in state.lines:
-                anode_chambers = line.anodeChambers or []
-                cathode_chambers = line.cathodeChambers or []
-                for ch in anode_chambers + cathode_chambers:
-                    if ch.id == cart.locationChamberId:
-                        chamber = ch
-                        break
-                if chamber:
-                    break
+            chamber = index.chamber_by_id.get(cart.locationChamberId)
             
             if not chamber:
                 continue
@@ -531,21 +764,22 @@ class SimulationService:
             
             # 根据当前工艺阶段更新工艺参数
             current_task = cart.currentTask.lower()
+            rng = self._streams.get(cart.id, 'mes')
             
             # ========== 阳极小车MES参数 ==========
             if cart.number.startswith('A'):
                 # 清刷工艺：电子枪参数
                 if '清刷' in current_task or 'scrub' in current_task:
-                    cart.eGunVoltage = 5.0 + random.uniform(-0.2, 0.2)
-                    cart.eGunCurrent = 300.0 + random.uniform(-10, 10)
+                    cart.eGunVoltage = 5.0 + rng.uniform(-0.2, 0.2)
+                    cart.eGunCurrent = 300.0 + rng.uniform(-10, 10)
                 else:
                     cart.eGunVoltage = 0.0
                     cart.eGunCurrent = 0.0
                 
                 # 铟封工艺：铟封参数
                 if '铟封' in current_task or 'seal' in current_task:
-                    cart.indiumTemp = 100.0 + random.uniform(-5, 5)
-                    cart.sealPressure = 1200.0 + random.uniform(-50, 50)
+                    cart.indiumTemp = 100.0 + rng.uniform(-5, 5)
+                    cart.sealPressure = 1200.0 + rng.uniform(-50, 50)
                 else:
                     cart.indiumTemp = chamber.temperature
                     cart.sealPressure = 0.0
@@ -565,21 +799,15 @@ class SimulationService:
             elif cart.number.startswith('C'):
                 # 生长工艺：铯源和光电流参数
                 if '生长' in current_task or 'growth' in current_task:
-                    cart.csCurrent = 4.0 + random.uniform(-0.2, 0.2)
-                    cart.o2Pressure = 2e-5 + random.uniform(-1e-6, 1e-6)
-                    cart.photoCurrent = 550.0 + random.uniform(-20, 20)
+                    cart.csCurrent = 4.0 + rng.uniform(-0.2, 0.2)
+                    cart.o2Pressure = 2e-5 + rng.uniform(-1e-6, 1e-6)
+                    cart.photoCurrent = 550.0 + rng.uniform(-20, 20)
                     
-                    # 计算生长进度
-                    if cart.steps:
-                        for step in cart.steps:
-                            if '生长' in step.name and step.status == 'active' and step.startTime:
-                                import datetime
-                                start = datetime.datetime.fromisoformat(step.startTime)
-                                now = datetime.datetime.now()
-                                elapsed_hours = (now - start).total_seconds() / 3600
-                                # 假设生长工艺12小时
-                                cart.growthProgress = min(100.0, (elapsed_hours / 12.0) * 100)
-                                break
+                    # 计算生长进度（工序开始时间与时长取自已编译的设定曲线）
+                    profile = self._profiles.get(cart, chamber, recipe_service)
+                    growth_progress = profile.growth_progress(current_time)
+                    if growth_progress is not None:
+                        cart.growthProgress = growth_progress
                 else:
                     cart.csCurrent = 0.0
                     cart.o2Pressure = 1e-7
@@ -606,13 +834,40 @@ class SimulationService:
                 'timestamp': current_time
             })
 
-        if cart_batch_data:
-            history_service = get_history_service()
-            history_service.record_data_batch(cart_batch_data)
+        # 簿记有变化时随本次发布写入 journal
+        self.state_service.set_aux('simulation', {
+            'cart_locations': self._cart_locations,
+            'temp_drop_events': self._temp_drop_events,
+            'clock_offset': round(self.clock.offset),
+        })
+
+        return cart_batch_data
+
+    def _advance_process_events(self, state: SystemState, since: float, now: float):
+        """为被指令修改过的小车重新排程，并处理 (since, now] 内到期的工序事件"""
+        from app.services.recipe_service import get_recipe_service
+        events = self._process_events
+        events.sync(state.carts, get_recipe_service(), since, self.state_service.take_process_changes())
+        events.advance(state.carts, now, self._process_log)
+
+    def _process_log(self, when: float, content: str, level: str):
+        # 日志时间戳取事件发生的虚拟时刻，而不是处理它的 tick
+        with self.clock.pinned(when):
+            self.state_service.add_system_log(content, level)
+
+    def observe_cart(self, cart_id: str) -> Optional[dict]:
+        """按当前虚拟时间精确计算小车进度与后续工序事件"""
+        cart = next((c for c in self.state_service.get_state().carts if c.id == cart_id), None)
+        if cart is None:
+            return None
+        return self._process_events.observe(cart, self.clock.now())
+
+
+# 全局单例：应用内唯一的仿真引擎
+_simulation_service_instance: Optional[SimulationService] = None
 
-    def _update_cart_progress(self, dt: float):
-         state = self.state_service.get_state()
-         for cart in state.carts:
-             if cart.status == 'normal' and cart.progress < 100:
-                 # Add some progress (e.g. 1% every few seconds)
-                 cart.progress = min(100.0, cart.progress + 0.5 * dt)
+def get_simulation_service() -> SimulationService:
+    global _simulation_service_instance
+    if _simulation_service_instance is None:
+        _simulation_service_instance = SimulationService()
+    return _simulation_service_instance
@@ -0,0 +1,134 @@
+"""
+状态投影 - /api/state 的范围与字段裁剪
+
+线体详情页只需要一条线体，且往往不需要日志、工艺步骤或 MES 参数。
+投影在序列化阶段直接裁剪（只序列化请求的子树），结果按 (状态代, 投影) 缓存。
+"""
+
+from typing import Dict, FrozenSet, Optional, Tuple
+
+from app.models import SystemState
+
+# 可选数据段
+SECTION_LOGS = 'logs'
+SECTION_STEPS = 'steps'
+SECTION_MES = 'mes'
+SECTIONS = (SECTION_LOGS, SECTION_STEPS, SECTION_MES)
+
+# 小车 MES 参数字段
+CART_MES_FIELDS = (
+    'temperature', 'vacuum', 'targetTemp', 'targetVacuum',
+    'eGunVoltage', 'eGunCurrent', 'indiumTemp', 'sealPressure',
+    'csCurrent', 'o2Pressure', 'photoCurrent', 'growthProgress',
+    'recipeVer', 'loadTime', 'batchNo',
+)
+
+# 列表类型字段（稀疏字段路径经过它们时对每个元素生效）
+LIST_FIELDS = frozenset({
+    'lines', 'carts', 'anodeChambers', 'cathodeChambers',
+    'steps', 'cartIds', 'systemLogs', 'operationLogs',
+})
+
+
+def _split(value: Optional[str]) -> FrozenSet[str]:
+    if not value:
+        return frozenset()
+    return frozenset(part.strip() for part in value.split(',') if part.strip())
+
+
+class StateProjection:
+    """
+    /api/state 的投影参数
+
+    - line_id: 只返回该线体及位于其腔体中的小车
+    - include / exclude: 可选数据段 logs, steps, mes（逗号分隔）；给出 include 时只保留其中的数据段
+    - fields: 稀疏字段路径（逗号分隔），如 "timestamp,lines.id,lines.anodeChambers.temperature"
+    """
+
+    def __init__(
+        self,
+        line_id: Optional[str] = None,
+        include: Optional[str] = None,
+        exclude: Optional[str] = None,
+        fields: Optional[str] = None
+    ):
+        included = _split(include)
+        excluded = _split(exclude)
+        unknown = (included | excluded) - set(SECTIONS)
+        if unknown:
+            raise ValueError(f"Unknown sections: {', '.join(sorted(unknown))}")
+
+        sections = set(included) if included else set(SECTIONS)
+        self.line_id = line_id
+        self.sections: FrozenSet[str] = frozenset(sections - excluded)
+        self.fields: FrozenSet[str] = _split(fields)
+
+    @property
+    def is_full(self) -> bool:
+        return self.line_id is None and not self.fields and len(self.sections) == len(SECTIONS)
+
+    @property
+    def key(self) -> Tuple:
+        return (self.line_id, tuple(sorted(self.sections)), tuple(sorted(self.fields)))
+
+    def render(self, state: SystemState) -> str:
+        """按投影序列化状态（不复制模型，只在序列化时裁剪）"""
+        lines = state.lines
+        carts = state.carts
+        if self.line_id is not None:
+            line = next((l for l in state.lines if l.id == self.line_id), None)
+            if not line:
+                raise ValueError(f"Line not found: {self.line_id}")
+            chamber_ids = {c.id for c in line.anodeChambers + line.cathodeChambers}
+            lines = [line]
+            carts = [c for c in state.carts if c.locationChamberId in chamber_ids]
+
+        scoped = SystemState.model_construct(
+            lines=lines,
+            carts=carts,
+            timestamp=state.timestamp,
+            systemLogs=state.systemLogs,
+            operationLogs=state.operationLogs,
+        )
+        return scoped.model_dump_json(include=self._include_spec(), exclude=self._exclude_spec())
+
+    def _exclude_spec(self) -> Optional[Dict]:
+        spec: Dict = {}
+        if SECTION_LOGS not in self.sections:
+            spec['systemLogs'] = True
+            spec['operationLogs'] = True
+        cart_fields = {}
+        if SECTION_STEPS not in self.sections:
+            cart_fields['steps'] = True
+        if SECTION_MES not in self.sections:
+            cart_fields.update({name: True for name in CART_MES_FIELDS})
+        if cart_fields:
+            spec['carts'] = {'__all__': cart_fields}
+        return spec or None
+
+    def _include_spec(self) -> Optional[Dict]:
+        if not self.fields:
+            return None
+        spec: Dict = {}
+        for path in self.fields:
+            node = spec
+            parts = path.split('.')
+            for i, name in enumerate(parts):
+                last = i == len(parts) - 1
+                if name in LIST_FIELDS:
+                    entry = node.setdefault(name, {'__all__': {}})
+                    if entry is True:
+                        break
+                    if last:
+                        node[name] = True
+                        break
+                    node = entry['__all__']
+                else:
+                    if last:
+                        node[name] = True
+                        break
+                    entry = node.setdefault(name, {})
+                    if entry is True:
+                        break
+                    node = entry
+        return spec
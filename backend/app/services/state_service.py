@@ -1,7 +1,13 @@
-import uuid
+import copy
+import functools
+import inspect
+import random
 import time
-from typing import List
-from threading import Lock
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional, Set, Tuple
+from threading import Lock, RLock
 
 from app.models import (
     ValveState,
@@ -11,7 +17,87 @@ from app.models import (
     LineData,
     SystemState,
     LogEntry,
+    BatchStep,
+    BatchStepResult,
 )
+from app.services.settings_service import SettingsService
+from app.services.clock_service import get_clock
+from app.services.journal_service import StateJournal
+from app.services.state_projection import StateProjection
+
+# 腔体类型对应的工艺步骤名称（小车转入腔体时激活同名步骤）
+PROCESS_BY_CHAMBER_TYPE = {
+    'load_lock': '进样', 'bake': '烘烤工艺', 'cleaning': '清刷工艺', 'docking': '对接工艺', 'sealing': '铟封工艺', 'growth': '生长工艺', 'unload': '出样',
+}
+
+
+def device_key(kind: str, chamber_id: str, target: str) -> str:
+    """设备键：同一设备上的指令按提交顺序串行执行（阀门与泵分别以名称区分）"""
+    return f"{chamber_id}/{target}" if kind == 'valve' else f"{chamber_id}/{target}_pump"
+
+
+def recorded(method):
+    """
+    操作员指令：执行期间虚拟时间固定（日志与工序时间戳一致），
+    录制仿真时按参数记录，回放时以相同参数重放。嵌套调用只记录最外层。
+    """
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._write_lock:
+            if self._write_depth > 0:
+                return method(self, *args, **kwargs)
+            clock = get_clock()
+            now = clock.now()
+            if self._recorder is not None:
+                arguments = signature.bind(self, *args, **kwargs).arguments
+                arguments.pop('self')
+                self._recorder.record_event('command', now, method=method.__name__, arguments=dict(arguments))
+            with clock.pinned(now):
+                return method(self, *args, **kwargs)
+    return wrapper
+
+
+class StateGeneration:
+    """
+    不可变的状态代 (Copy-on-Write)
+
+    写者在工作副本上修改后发布新的一代并原子替换引用；读者拿到的某一代发布后
+    不再被修改，因此无需加锁即可得到一致视图。序列化结果按代缓存。
+    未被修改的线体/小车对象在相邻两代之间共享，发布只复制写事务中标记过的实体。
+    """
+    __slots__ = ('number', 'state', '_json', '_projections', 'variants')
+
+    # 每一代最多缓存的投影数
+    MAX_PROJECTIONS = 64
+
+    def __init__(self, number: int, state: SystemState):
+        self.number = number
+        self.state = state
+        self._json: Optional[str] = None
+        self._projections: Dict[Tuple, str] = {}
+        # 编码变体缓存（压缩后的字节），由 app.encoding 读写
+        self.variants: Dict[Tuple, bytes] = {}
+
+    def to_json(self) -> str:
+        # 并发下可能重复计算一次，但结果相同，无需加锁
+        if self._json is None:
+            self._json = self.state.model_dump_json()
+        return self._json
+
+    def project(self, projection: StateProjection) -> str:
+        """按投影序列化（按投影缓存），无效线体抛出 ValueError"""
+        if projection.is_full:
+            return self.to_json()
+        key = projection.key
+        cached = self._projections.get(key)
+        if cached is None:
+            cached = projection.render(self.state)
+            if len(self._projections) < self.MAX_PROJECTIONS:
+                self._projections[key] = cached
+        return cached
+
 
 # Simple in-memory singleton service
 class StateService:
@@ -27,6 +113,63 @@ class StateService:
         return cls._instance
 
     def _init_state(self):
+        # 优先从持久化的检查点 + journal 恢复，否则使用内置的初始数据（只读取，写线程由 start_journal 启动）
+        self._journal = StateJournal()
+        restored = self._journal.load()
+        if restored:
+            self._state, self._aux = restored
+            self._settle_valves(self._state)
+        else:
+            self._state, self._aux = self._build_default_state(), {}
+        self._aux_changes: Dict[str, Any] = {}
+
+        # 日志使用定长环形缓冲，追加为 O(1)；只有发生变化的那类日志在发布时转换为元组
+        capacity = SettingsService().get_settings().data.logCapacity
+        self._system_logs: Deque[LogEntry] = deque(self._state.systemLogs, maxlen=capacity)
+        self._operation_logs: Deque[LogEntry] = deque(self._state.operationLogs, maxlen=capacity)
+        self._state.systemLogs = tuple(self._system_logs)
+        self._state.operationLogs = tuple(self._operation_logs)
+        # 本次写事务追加的日志（journal 只记录新增条目），以及被清空/整体替换的日志类型
+        self._log_appends: Dict[str, List[LogEntry]] = {'system': [], 'operation': []}
+        self._log_resets: Set[str] = set()
+
+        # 写者锁与发布计数：所有写操作在工作副本 self._state 上进行，最外层写事务结束时发布新一代
+        self._write_lock = RLock()
+        self._write_depth = 0
+        # 本次写事务修改过的线体/小车 ID（发布时只复制这些实体），_dirty_all 表示整体重建；
+        # _journal_* 为其中的指令级修改（写入 journal），物理量的连续改写只由检查点持久化
+        self._dirty_lines: Set[str] = set()
+        self._dirty_carts: Set[str] = set()
+        self._dirty_all = False
+        self._journal_lines: Set[str] = set()
+        self._journal_carts: Set[str] = set()
+        self._journal_all = False
+        # 自上次取走以来被指令修改（移动、进样、更新）的小车：仿真只为这些小车重新检查工序时间线；
+        # _process_all 表示整体替换（启动、恢复快照），需要全部重新检查
+        self._process_carts: Set[str] = set()
+        self._process_all = True
+        # 指令最近一次改变阀门/泵的时刻（设备键 -> time.monotonic()），采集读数在保持期内不覆盖这些设备
+        self._commanded: Dict[str, float] = {}
+        self._generation = StateGeneration(0, self._state.model_copy(deep=True))
+
+        # 实体 ID 生成器（仿真设定种子后可复现）与仿真录制器
+        self._id_rng = random.Random()
+        self._recorder = None
+        # 仿真回放期间为 True：发布不写 journal，日志不写入历史事件
+        self._detached = False
+
+    @staticmethod
+    def _settle_valves(state: SystemState):
+        """上次运行中断时未完成的阀门动作没有执行，恢复为动作前的状态"""
+        settled = {ValveState.opening: ValveState.closed, ValveState.closing: ValveState.open}
+        for line in state.lines:
+            for chamber in line.anodeChambers + line.cathodeChambers:
+                for valve_name in ChamberValves.model_fields:
+                    value = getattr(chamber.valves, valve_name)
+                    if value in settled:
+                        setattr(chamber.valves, valve_name, settled[value])
+
+    def _build_default_state(self) -> SystemState:
         # Initialize mock data similar to frontend mockData
         def create_chamber(id: str, line: str, name: str, type_: str) -> Chamber:
             return Chamber(
@@ -96,7 +239,7 @@ class StateService:
         ]
 
         # Use new 'lines' field - each line contains both anode and cathode chambers
-        self.state = SystemState(
+        return SystemState(
             lines=[
                 LineData(
                     id='line-1', 
@@ -106,13 +249,13 @@ class StateService:
                 ),
             ],
             carts=carts,
-            timestamp=time.time() * 1000,
+            timestamp=get_clock().now_ms(),
             systemLogs=[],
             operationLogs=[
                 # Initial mock log in new format
                 LogEntry(
                     id='init-log-1',
-                    timestamp=time.time() * 1000,
+                    timestamp=get_clock().now_ms(),
                     type='operation',
                     content='系统管理员 admin 初始化了 1# 产线监控系统',
                     level='info'
@@ -121,20 +264,246 @@ class StateService:
         )
 
     def get_state(self) -> SystemState:
-        return self.state
+        """返回当前已发布的一代状态（只读，调用方不得修改）"""
+        return self._generation.state
+
+    def get_generation(self) -> StateGeneration:
+        return self._generation
+
+    @property
+    def state(self) -> SystemState:
+        # 兼容旧脚本的只读访问
+        return self._generation.state
+
+    @contextmanager
+    def mutate(self) -> Iterator[SystemState]:
+        """
+        写事务：持有写者锁修改工作副本，最外层退出时发布新一代。
+        可重入，嵌套调用只在最外层发布一次。
+        修改线体/小车的写者需在事务内调用 touch_line / touch_cart / touch_all 标记，
+        未标记的实体沿用上一代的对象；新增、删除与重排序无需标记。
+        """
+        with self._write_lock:
+            self._write_depth += 1
+            try:
+                yield self._state
+            finally:
+                self._write_depth -= 1
+                if self._write_depth == 0:
+                    self._publish()
+
+    @contextmanager
+    def locked(self) -> Iterator[SystemState]:
+        """
+        只持有写者锁、不发布：需要在检查与随后的写事务之间排除其他写者时使用
+        （例如按指令队列的状态决定批量指令能否执行）。可与 mutate() 嵌套
+        """
+        with self._write_lock:
+            yield self._state
+
+    def touch_line(self, line_id: str, journal: bool = True):
+        """
+        标记线体（含其腔体）在本次写事务中被修改（需在 mutate() 内调用）。
+        journal=False 用于采集读数等物理量的连续改写：不写入 journal，由检查点持久化
+        """
+        self._dirty_lines.add(line_id)
+        if journal:
+            self._journal_lines.add(line_id)
+
+    def touch_cart(self, cart_id: str):
+        """标记小车在本次写事务中被修改（需在 mutate() 内调用）；工序时间线随之重新检查"""
+        self._dirty_carts.add(cart_id)
+        self._journal_carts.add(cart_id)
+        self._process_carts.add(cart_id)
+
+    def take_process_changes(self) -> Optional[Set[str]]:
+        """取走并清空自上次调用以来被修改的小车 ID；None 表示需要全部重新检查（需持有写者锁）"""
+        changed = None if self._process_all else self._process_carts
+        self._process_carts = set()
+        self._process_all = False
+        return changed
+
+    def mark_commanded(self, kind: str, chamber_id: str, target: str):
+        """记录指令改变了设备（阀门/泵）"""
+        self._commanded[device_key(kind, chamber_id, target)] = time.monotonic()
+
+    def commanded_devices(self, hold: float) -> Set[str]:
+        """最近 hold 秒内被指令改变的设备键，见 device_key（需持有写者锁）"""
+        cutoff = time.monotonic() - hold
+        self._commanded = {key: at for key, at in self._commanded.items() if at >= cutoff}
+        return set(self._commanded)
+
+    def touch_all(self):
+        """标记全部线体与小车被修改（仿真 tick）；不写入 journal，由检查点持久化"""
+        self._dirty_all = True
+
+    def _touch_chamber(self, chamber_id: str):
+        line, _, _ = self._find_chamber(chamber_id)
+        if line is not None:
+            self.touch_line(line.id)
+
+    def _publish(self):
+        state = self._state
+        state.timestamp = get_clock().now_ms()
+        # 日志条目发布后不再修改：只重建有变化的那类日志，未变化的元组在各代之间共享
+        log_changes: Dict[str, Tuple[bool, Tuple[LogEntry, ...]]] = {}
+        for log_type, field, logs in (('system', 'systemLogs', self._system_logs), ('operation', 'operationLogs', self._operation_logs)):
+            appended = self._log_appends[log_type]
+            if log_type in self._log_resets:
+                setattr(state, field, tuple(logs))
+                log_changes[log_type] = (True, getattr(state, field))
+            elif appended:
+                setattr(state, field, tuple(logs))
+                log_changes[log_type] = (False, tuple(reversed(appended)))
+            appended.clear()
+        self._log_resets.clear()
+        previous = self._generation.state
+        self._generation = StateGeneration(
+            self._generation.number + 1,
+            SystemState.model_construct(
+                lines=self._publish_entities(state.lines, previous.lines, self._dirty_lines),
+                carts=self._publish_entities(state.carts, previous.carts, self._dirty_carts),
+                timestamp=state.timestamp,
+                systemLogs=state.systemLogs,
+                operationLogs=state.operationLogs,
+            )
+        )
+        # 持久化：两代都是不可变对象，记录的生成与落盘在 journal 写线程中完成
+        if not self._detached:
+            self._journal.submit(
+                previous, self._generation.state,
+                None if self._journal_all else self._journal_lines,
+                None if self._journal_all else self._journal_carts,
+                self._aux_changes, log_changes,
+            )
+        self._aux_changes = {}
+        self._dirty_lines = set()
+        self._dirty_carts = set()
+        self._dirty_all = False
+        self._journal_lines = set()
+        self._journal_carts = set()
+        self._journal_all = False
+
+    def _publish_entities(self, working: list, published: list, dirty: Set[str]) -> list:
+        """新一代的实体列表：被标记或新增的实体复制自工作副本，其余沿用上一代的对象"""
+        if self._dirty_all:
+            return [entity.model_copy(deep=True) for entity in working]
+        previous = {entity.id: entity for entity in published}
+        result = []
+        for entity in working:
+            shared = previous.get(entity.id)
+            result.append(shared if shared is not None and entity.id not in dirty else entity.model_copy(deep=True))
+        return result
+
+    def _new_uuid(self) -> uuid.UUID:
+        return uuid.UUID(int=self._id_rng.getrandbits(128), version=4)
+
+    def reseed_ids(self, seed: int):
+        """以确定性种子生成后续的日志/小车/线体 ID"""
+        with self._write_lock:
+            self._id_rng.seed(seed)
+
+    def set_recorder(self, recorder):
+        """设置（或以 None 清除）操作员指令录制器"""
+        with self._write_lock:
+            self._recorder = recorder
+
+    def snapshot(self) -> Dict[str, Any]:
+        """工作副本的完整 JSON 快照（含环形缓冲中的日志）"""
+        with self._write_lock:
+            data = self._state.model_dump(mode='json')
+            data['systemLogs'] = [log.model_dump(mode='json') for log in self._system_logs]
+            data['operationLogs'] = [log.model_dump(mode='json') for log in self._operation_logs]
+            return data
+
+    @contextmanager
+    def detached(self):
+        """
+        脱离持久化与历史事件（仿真回放使用）：全程持有写者锁，其他写者等待回放结束；
+        期间的发布不写 journal，日志不写入 system_events。
+        退出时发布一次完整记录，使 journal 与工作副本（恢复后的实时状态或保留的回放结果）重新对齐
+        """
+        with self._write_lock:
+            self._detached = True
+            try:
+                yield
+            finally:
+                self._detached = False
+                with self.mutate():
+                    self.touch_all()
+                    self._journal_all = True
+                    self._log_resets.update(('system', 'operation'))
+                    self._aux_changes = copy.deepcopy(self._aux)
+
+    def restore(self, data: Dict[str, Any]):
+        """用快照替换工作副本并发布（仿真回放使用）"""
+        state = SystemState.model_validate(data)
+        with self.mutate():
+            self._state = state
+            self.touch_all()
+            self._journal_all = True
+            self._process_all = True
+            self._system_logs = deque(state.systemLogs, maxlen=self._system_logs.maxlen)
+            self._operation_logs = deque(state.operationLogs, maxlen=self._operation_logs.maxlen)
+            self._log_resets.update(('system', 'operation'))
+
+    def get_aux(self, name: str, default: Any = None) -> Any:
+        """读取随状态一起持久化的附加数据（如仿真簿记）"""
+        return copy.deepcopy(self._aux.get(name, default))
+
+    def set_aux(self, name: str, value: Any):
+        """更新附加数据，在当前写事务发布时写入 journal（值需可 JSON 序列化）"""
+        with self.mutate():
+            if self._aux.get(name) != value:
+                value = copy.deepcopy(value)
+                self._aux[name] = value
+                self._aux_changes[name] = value
+
+    def start_journal(self):
+        """启动持久化（应用 lifespan 调用）：以当前状态写入基线检查点并启动 journal 写线程"""
+        with self._write_lock:
+            self._journal.start(self._generation.state, self._aux)
+
+    def close(self):
+        """关闭持久化：写完 journal 并生成最终检查点"""
+        self._journal.close()
+
+    @recorded
+    def set_log_capacity(self, capacity: int):
+        """调整内存日志容量（保留最新的日志）"""
+        capacity = max(1, capacity)
+        with self.mutate():
+            if capacity != self._system_logs.maxlen:
+                self._system_logs = deque(self._system_logs, maxlen=capacity)
+                self._operation_logs = deque(self._operation_logs, maxlen=capacity)
+                self._log_resets.update(('system', 'operation'))
+
+    def add_system_log(self, content: str, level: str = 'info'):
+        """由仿真等后台服务写入系统日志（时间戳取虚拟时钟）"""
+        self._add_log(LogEntry(
+            id=str(self._new_uuid()),
+            timestamp=get_clock().now_ms(),
+            type='system',
+            content=content,
+            level=level
+        ), 'system')
 
     def _add_log(self, log: LogEntry, log_type: str = 'system'):
-        if log_type == 'system':
-            self.state.systemLogs.insert(0, log)
-            self.state.systemLogs = self.state.systemLogs[:50]
-        else:
-            self.state.operationLogs.insert(0, log)
-            self.state.operationLogs = self.state.operationLogs[:50]
+        with self.mutate():
+            if log_type == 'system':
+                self._system_logs.appendleft(log)
+            else:
+                self._operation_logs.appendleft(log)
+            self._log_appends['system' if log_type == 'system' else 'operation'].append(log)
+            # 回放中重放的日志在录制时已写入过历史事件
+            bridge = not self._detached
+        if not bridge:
+            return
         
-        # Record into HistoryService for playback markers
+        # Record into HistoryService for playback markers (异步入队，不阻塞请求线程)
         from app.services.history_service import get_history_service
         try:
-            get_history_service().record_event(
+            get_history_service().record_event_async(
                 type=log_type,
                 content=log.content,
                 level=log.level,
@@ -143,57 +512,67 @@ class StateService:
         except Exception as e:
             print(f"Error bridging log to history: {e}")
 
+    @recorded
     def clear_operation_logs(self):
-        self.state.operationLogs = []
-        return True
+        with self.mutate():
+            self._operation_logs.clear()
+            self._log_resets.add('operation')
+            return True
 
+    @recorded
     def update_chamber(self, line_id: str, chamber_id: str, updates: dict):
-        print(f"[DEBUG] update_chamber called: line_id={line_id}, chamber_id={chamber_id}")
-        print(f"[DEBUG] Updates received: {updates}")
-        print(f"[DEBUG] Available lines: {[l.id for l in self.state.lines]}")
+        with self.mutate() as state:
+            print(f"[DEBUG] update_chamber called: line_id={line_id}, chamber_id={chamber_id}")
+            print(f"[DEBUG] Updates received: {updates}")
+            print(f"[DEBUG] Available lines: {[l.id for l in state.lines]}")
         
-        line = next((l for l in self.state.lines if l.id == line_id), None)
-        if not line:
-            raise ValueError(f'Line not found: {line_id}')
+            line = next((l for l in state.lines if l.id == line_id), None)
+            if not line:
+                raise ValueError(f'Line not found: {line_id}')
         
-        all_chambers = (line.anodeChambers or []) + (line.cathodeChambers or [])
-        print(f"[DEBUG] Available chambers in line {line_id}: {[c.id for c in all_chambers]}")
+            all_chambers = (line.anodeChambers or []) + (line.cathodeChambers or [])
+            print(f"[DEBUG] Available chambers in line {line_id}: {[c.id for c in all_chambers]}")
         
-        chamber = next((c for c in all_chambers if c.id == chamber_id), None)
-        if not chamber:
-            raise ValueError(f'Chamber not found: {chamber_id}')
+            chamber = next((c for c in all_chambers if c.id == chamber_id), None)
+            if not chamber:
+                raise ValueError(f'Chamber not found: {chamber_id}')
+            self.touch_line(line.id)
         
-        # Apply updates
-        for key, value in updates.items():
-            print(f"[DEBUG] Setting {key} = {value}, hasattr = {hasattr(chamber, key)}")
-            if hasattr(chamber, key):
-                setattr(chamber, key, value)
+            # Apply updates
+            for key, value in updates.items():
+                print(f"[DEBUG] Setting {key} = {value}, hasattr = {hasattr(chamber, key)}")
+                if hasattr(chamber, key):
+                    setattr(chamber, key, value)
 
         
-        self._add_log(LogEntry(
-            id=str(uuid.uuid4()),
-            timestamp=time.time() * 1000,
-            type='system',
-            content=f"管理员更新了线体 {line.name} 中 {chamber.name} 的设置",
-            level='info'
-        ), 'system')
+            self._add_log(LogEntry(
+                id=str(self._new_uuid()),
+                timestamp=get_clock().now_ms(),
+                type='system',
+                content=f"管理员更新了线体 {line.name} 中 {chamber.name} 的设置",
+                level='info'
+            ), 'system')
         
-        return chamber
+            return chamber.model_copy(deep=True)
 
+    @recorded
     def update_cart(self, cart_id: str, updates: dict):
-        cart = next((c for c in self.state.carts if c.id == cart_id), None)
-        if not cart:
-            raise ValueError('Cart not found')
+        with self.mutate() as state:
+            cart = next((c for c in state.carts if c.id == cart_id), None)
+            if not cart:
+                raise ValueError('Cart not found')
+            self.touch_cart(cart_id)
         
-        # Apply updates
-        for key, value in updates.items():
-            if hasattr(cart, key):
-                setattr(cart, key, value)
+            # Apply updates
+            for key, value in updates.items():
+                if hasattr(cart, key):
+                    setattr(cart, key, value)
         
-        return cart
+            return cart.model_copy(deep=True)
 
-    def _find_chamber(self, chamber_id: str):
-        for line in self.state.lines:
+    def _find_chamber(self, chamber_id: str, state: Optional[SystemState] = None):
+        """在工作副本（或给定状态）中查找腔体（调用方需持有写者锁）"""
+        for line in (state or self._state).lines:
             # Search in anode chambers
             for chamber in line.anodeChambers:
                 if chamber.id == chamber_id:
@@ -204,171 +583,328 @@ class StateService:
                     return line, chamber, 'cathode'
         return None, None, None
 
+    @recorded
     def create_line(self, line_type: str, name: str):
-        new_id = f"line-{uuid.uuid4().hex[:8]}"
-        # 创建带有默认腔体的新线体
-        default_anode = Chamber(
-            id=f"{new_id}-a-default",
-            lineId=new_id,
-            name="进样仓",
-            type="load_lock",
-            temperature=25.0,
-            highVacPressure=1e-5,
-            forelinePressure=10.0,
-            state="idle",
-            valves=ChamberValves(),
-            molecularPump=False,
-            roughingPump=False,
-            hasCart=False,
-            cartId=None,
-        )
-        default_cathode = Chamber(
-            id=f"{new_id}-c-default",
-            lineId=new_id,
-            name="进样仓",
-            type="load_lock",
-            temperature=25.0,
-            highVacPressure=1e-5,
-            forelinePressure=10.0,
-            state="idle",
-            valves=ChamberValves(),
-            molecularPump=False,
-            roughingPump=False,
-            hasCart=False,
-            cartId=None,
-        )
-        new_line = LineData(id=new_id, name=name, anodeChambers=[default_anode], cathodeChambers=[default_cathode])
-        self.state.lines.append(new_line)
-        self._add_log(LogEntry(
-            id=str(uuid.uuid4()),
-            timestamp=time.time() * 1000,
-            type='system',
-            content=f"创建新线体: {name} ({new_id})",
-            level='success'
-        ), 'system')
-        return new_line
+        with self.mutate() as state:
+            new_id = f"line-{self._new_uuid().hex[:8]}"
+            # 创建带有默认腔体的新线体
+            default_anode = Chamber(
+                id=f"{new_id}-a-default",
+                lineId=new_id,
+                name="进样仓",
+                type="load_lock",
+                temperature=25.0,
+                highVacPressure=1e-5,
+                forelinePressure=10.0,
+                state="idle",
+                valves=ChamberValves(),
+                molecularPump=False,
+                roughingPump=False,
+                hasCart=False,
+                cartId=None,
+            )
+            default_cathode = Chamber(
+                id=f"{new_id}-c-default",
+                lineId=new_id,
+                name="进样仓",
+                type="load_lock",
+                temperature=25.0,
+                highVacPressure=1e-5,
+                forelinePressure=10.0,
+                state="idle",
+                valves=ChamberValves(),
+                molecularPump=False,
+                roughingPump=False,
+                hasCart=False,
+                cartId=None,
+            )
+            new_line = LineData(id=new_id, name=name, anodeChambers=[default_anode], cathodeChambers=[default_cathode])
+            state.lines.append(new_line)
+            self._add_log(LogEntry(
+                id=str(self._new_uuid()),
+                timestamp=get_clock().now_ms(),
+                type='system',
+                content=f"创建新线体: {name} ({new_id})",
+                level='success'
+            ), 'system')
+            return new_line.model_copy(deep=True)
 
+    @recorded
     def update_line(self, line_id: str, name: str, anode_chambers: list = None, cathode_chambers: list = None):
-        line = next((l for l in self.state.lines if l.id == line_id), None)
-        if not line:
-            raise ValueError("Line not found")
-        
-        line.name = name
-        
-        from app.models import Chamber  # Local import
-        
-        def parse_chambers(chambers_data):
-            if chambers_data is None:
-                return None
-            result = []
-            for c_data in chambers_data:
-                if isinstance(c_data, dict):
-                    c_obj = Chamber.model_validate(c_data)
-                    result.append(c_obj)
-                else:
-                    result.append(c_data)
-            return result
-        
-        if anode_chambers is not None:
-            parsed = parse_chambers(anode_chambers)
-            if len(parsed) < 1:
-                raise ValueError("阳极线至少需要保留1个腔体")
-            line.anodeChambers = parsed
-        
-        if cathode_chambers is not None:
-            parsed = parse_chambers(cathode_chambers)
-            if len(parsed) < 1:
-                raise ValueError("阴极线至少需要保留1个腔体")
-            line.cathodeChambers = parsed
+        with self.mutate() as state:
+            line = next((l for l in state.lines if l.id == line_id), None)
+            if not line:
+                raise ValueError("Line not found")
+            self.touch_line(line_id)
+        
+            line.name = name
+        
+            from app.models import Chamber  # Local import
+        
+            def parse_chambers(chambers_data):
+                if chambers_data is None:
+                    return None
+                result = []
+                for c_data in chambers_data:
+                    if isinstance(c_data, dict):
+                        c_obj = Chamber.model_validate(c_data)
+                        result.append(c_obj)
+                    else:
+                        result.append(c_data)
+                return result
+        
+            if anode_chambers is not None:
+                parsed = parse_chambers(anode_chambers)
+                if len(parsed) < 1:
+                    raise ValueError("阳极线至少需要保留1个腔体")
+                line.anodeChambers = parsed
+        
+            if cathode_chambers is not None:
+                parsed = parse_chambers(cathode_chambers)
+                if len(parsed) < 1:
+                    raise ValueError("阴极线至少需要保留1个腔体")
+                line.cathodeChambers = parsed
              
-        self._add_log(LogEntry(
-            id=str(uuid.uuid4()),
-            timestamp=time.time() * 1000,
-            type='system',
-            content=f"管理员更新 {name} 配置",
-            level='success'
-        ), 'system')
-        return line
+            self._add_log(LogEntry(
+                id=str(self._new_uuid()),
+                timestamp=get_clock().now_ms(),
+                type='system',
+                content=f"管理员更新 {name} 配置",
+                level='success'
+            ), 'system')
+            return line.model_copy(deep=True)
 
+    @recorded
     def delete_line(self, line_id: str):
-        # 保护：至少保留一条线体
-        if len(self.state.lines) <= 1:
-            raise ValueError("无法删除最后一条线体")
-        
-        line = next((l for l in self.state.lines if l.id == line_id), None)
-        if not line:
-            raise ValueError("Line not found")
-        self.state.lines = [l for l in self.state.lines if l.id != line_id]
-        # Also remove carts in this line? For now, keep them or mark abnormal? 
-        # Ideally remove carts or reset them.
-        self._add_log(LogEntry(
-            id=str(uuid.uuid4()),
-            timestamp=time.time() * 1000,
-            type='system',
-            content=f"删除线体: {line.name}",
-            level='warn'
-        ), 'system')
-        return True
+        with self.mutate() as state:
+            # 保护：至少保留一条线体
+            if len(state.lines) <= 1:
+                raise ValueError("无法删除最后一条线体")
+        
+            line = next((l for l in state.lines if l.id == line_id), None)
+            if not line:
+                raise ValueError("Line not found")
+            state.lines = [l for l in state.lines if l.id != line_id]
+            # Also remove carts in this line? For now, keep them or mark abnormal? 
+            # Ideally remove carts or reset them.
+            self._add_log(LogEntry(
+                id=str(self._new_uuid()),
+                timestamp=get_clock().now_ms(),
+                type='system',
+                content=f"删除线体: {line.name}",
+                level='warn'
+            ), 'system')
+            return True
 
+    @recorded
     def duplicate_line(self, line_id: str):
-        source_line = next((l for l in self.state.lines if l.id == line_id), None)
-        if not source_line:
-            raise ValueError("Line not found")
-        
-        # Determine new ID and Name suffix logic
-        # Simple logic: append copy timestamp or look for pattern
-        suffix = uuid.uuid4().hex[:4]
-        new_line_id = f"{source_line.id}-copy-{suffix}"
-        new_line_name = f"{source_line.name} (Copy)"
-        
-        # Deep copy chambers
-        new_anode_chambers = []
-        if source_line.anodeChambers:
-            for c in source_line.anodeChambers:
-                parts = c.id.split('-')
-                base_suffix = parts[-1] if len(parts) > 1 else 'chamber'
-                new_c_id = f"{new_line_id}-a-{base_suffix}-{uuid.uuid4().hex[:4]}"
-                new_chamber = c.model_copy(deep=True)
-                new_chamber.id = new_c_id
-                new_chamber.lineId = new_line_id
-                new_chamber.cartIds = []
-                new_anode_chambers.append(new_chamber)
-
-        new_cathode_chambers = []
-        if source_line.cathodeChambers:
-            for c in source_line.cathodeChambers:
-                parts = c.id.split('-')
-                base_suffix = parts[-1] if len(parts) > 1 else 'chamber'
-                new_c_id = f"{new_line_id}-c-{base_suffix}-{uuid.uuid4().hex[:4]}"
-                new_chamber = c.model_copy(deep=True)
-                new_chamber.id = new_c_id
-                new_chamber.lineId = new_line_id
-                new_chamber.cartIds = []
-                new_cathode_chambers.append(new_chamber)
+        with self.mutate() as state:
+            source_line = next((l for l in state.lines if l.id == line_id), None)
+            if not source_line:
+                raise ValueError("Line not found")
+        
+            # Determine new ID and Name suffix logic
+            # Simple logic: append copy timestamp or look for pattern
+            suffix = self._new_uuid().hex[:4]
+            new_line_id = f"{source_line.id}-copy-{suffix}"
+            new_line_name = f"{source_line.name} (Copy)"
+        
+            # Deep copy chambers
+            new_anode_chambers = []
+            if source_line.anodeChambers:
+                for c in source_line.anodeChambers:
+                    parts = c.id.split('-')
+                    base_suffix = parts[-1] if len(parts) > 1 else 'chamber'
+                    new_c_id = f"{new_line_id}-a-{base_suffix}-{self._new_uuid().hex[:4]}"
+                    new_chamber = c.model_copy(deep=True)
+                    new_chamber.id = new_c_id
+                    new_chamber.lineId = new_line_id
+                    new_chamber.cartIds = []
+                    new_anode_chambers.append(new_chamber)
+
+            new_cathode_chambers = []
+            if source_line.cathodeChambers:
+                for c in source_line.cathodeChambers:
+                    parts = c.id.split('-')
+                    base_suffix = parts[-1] if len(parts) > 1 else 'chamber'
+                    new_c_id = f"{new_line_id}-c-{base_suffix}-{self._new_uuid().hex[:4]}"
+                    new_chamber = c.model_copy(deep=True)
+                    new_chamber.id = new_c_id
+                    new_chamber.lineId = new_line_id
+                    new_chamber.cartIds = []
+                    new_cathode_chambers.append(new_chamber)
             
-        new_line = LineData(id=new_line_id, name=new_line_name, anodeChambers=new_anode_chambers, cathodeChambers=new_cathode_chambers)
-        self.state.lines.append(new_line)
+            new_line = LineData(id=new_line_id, name=new_line_name, anodeChambers=new_anode_chambers, cathodeChambers=new_cathode_chambers)
+            state.lines.append(new_line)
         
-        self._add_log(LogEntry(
-            id=str(uuid.uuid4()),
-            timestamp=time.time() * 1000,
-            type='system',
-            content=f"复制线体 {source_line.name} -> {new_line_name}",
-            level='success'
-        ), 'system')
-        return new_line
+            self._add_log(LogEntry(
+                id=str(self._new_uuid()),
+                timestamp=get_clock().now_ms(),
+                type='system',
+                content=f"复制线体 {source_line.name} -> {new_line_name}",
+                level='success'
+            ), 'system')
+            return new_line.model_copy(deep=True)
+
+    def validate_valve(self, chamber_id: str, valve_name: str):
+        """校验阀门指令目标，失败抛出 ValueError"""
+        with self._write_lock:
+            _, chamber, _ = self._find_chamber(chamber_id)
+        if not chamber:
+            raise ValueError('Chamber not found')
+        if valve_name not in ChamberValves.model_fields:
+            raise ValueError(f"Unknown valve name: {valve_name}")
+        return chamber
 
+    def validate_pump(self, chamber_id: str, pump_name: str):
+        """校验泵指令目标，失败抛出 ValueError"""
+        with self._write_lock:
+            _, chamber, _ = self._find_chamber(chamber_id)
+        if not chamber:
+            raise ValueError('Chamber not found')
+        if pump_name not in ('molecular', 'roughing'):
+            raise ValueError(f"Unknown pump name: {pump_name}")
+        return chamber
+
+    @recorded
+    def begin_valve_transition(self, chamber_id: str, valve_name: str, action: str) -> ValveState:
+        """阀门开始动作：立即置为 opening/closing 过渡态，由指令调度器稍后完成；返回动作前的状态"""
+        with self.mutate() as state:
+            chamber = self.validate_valve(chamber_id, valve_name)
+            previous = getattr(chamber.valves, valve_name)
+            self._touch_chamber(chamber_id)
+            transitional = ValveState.opening if action == 'open' else ValveState.closing
+            setattr(chamber.valves, valve_name, transitional)
+            self.mark_commanded('valve', chamber_id, valve_name)
+            return previous
+
+    @recorded
+    def revert_valve_transition(self, chamber_id: str, valve_name: str, previous: ValveState):
+        """阀门动作失败：仍处于过渡态时恢复为动作前的状态（腔体已删除或阀门已被其他指令改变时忽略）"""
+        with self.mutate():
+            _, chamber, _ = self._find_chamber(chamber_id)
+            if chamber is None or valve_name not in ChamberValves.model_fields:
+                return
+            if getattr(chamber.valves, valve_name) in (ValveState.opening, ValveState.closing):
+                self._touch_chamber(chamber_id)
+                setattr(chamber.valves, valve_name, ValveState(previous))
+                self.mark_commanded('valve', chamber_id, valve_name)
+
+    @recorded
     def toggle_valve(self, line_id: str, chamber_id: str, valve_name: str, action: str, operator_name: str = "Admin", operator_role: str = "admin"):
-        line, chamber, chamber_type_key = self._find_chamber(chamber_id)
+        """完成阀门动作（置为最终状态并记录操作日志），动作延时由 CommandService 调度"""
+        with self.mutate() as state:
+            content = self._apply_valve(state, chamber_id, valve_name, action, operator_name, operator_role)
+            self.mark_commanded('valve', chamber_id, valve_name)
+            self._add_log(self._operation_log(content), 'operation')
+        return self.get_state()
+
+    @recorded
+    def toggle_pump(self, line_id: str, chamber_id: str, pump_name: str, action: str, operator_name: str = "Admin", operator_role: str = "admin"):
+        """启停泵并记录操作日志，动作延时由 CommandService 调度"""
+        with self.mutate() as state:
+            content = self._apply_pump(state, chamber_id, pump_name, action, operator_name, operator_role)
+            self.mark_commanded('pump', chamber_id, pump_name)
+            self._add_log(self._operation_log(content), 'operation')
+        return self.get_state()
+
+    @recorded
+    def move_cart(self, cart_id: str, direction: str, operator_name: str = "Admin", operator_role: str = "admin"):
+        with self.mutate() as state:
+            content = self._apply_move(state, cart_id, direction, operator_name, operator_role)
+            self._add_log(self._operation_log(content), 'operation')
+        return self.get_state()
+
+    @recorded
+    def apply_batch(self, steps: List[BatchStep], mode: str = 'atomic', operator_name: str = "Admin", operator_role: str = "admin", busy_devices: Optional[List[str]] = None) -> Tuple[bool, List[BatchStepResult]]:
+        """
+        批量执行阀门/泵/小车移动指令（抽真空、转运等固定序列）
+        
+        整个序列先在当前状态的副本上逐步校验并执行，遇到第一个失败步骤即停止：
+        - atomic: 任一步失败则整体不生效
+        - ordered: 失败步骤之前的步骤生效，之后的步骤跳过
+        生效部分作为一次写事务提交，只写一条汇总操作日志；没有步骤生效时不发布新一代。
+        批量指令直接到达终态，不经过 CommandService 的阀门行程延时；
+        busy_devices 为有未完成指令的设备键（见 device_key），作用于这些设备的步骤失败，
+        避免行程结束时的指令覆盖批量步骤的结果。
+        :return: (是否有步骤生效, 每一步的执行结果)
+        """
+        busy = set(busy_devices or ())
+        with self._write_lock:
+            scratch = self._state.model_copy(deep=True)
+            results: List[BatchStepResult] = []
+            descriptions = []
+            failed = False
+            for i, step in enumerate(steps):
+                if failed:
+                    results.append(BatchStepResult(index=i, kind=step.kind, status='skipped'))
+                    continue
+                try:
+                    desc = self._apply_step(scratch, step, operator_name, operator_role, busy)
+                    descriptions.append(desc)
+                    results.append(BatchStepResult(index=i, kind=step.kind, status='ok', message=desc))
+                except ValueError as e:
+                    failed = True
+                    results.append(BatchStepResult(index=i, kind=step.kind, status='failed', message=str(e)))
+
+            if not descriptions or (failed and mode == 'atomic'):
+                return False, results
+
+            with self.mutate() as state:
+                state.lines = scratch.lines
+                state.carts = scratch.carts
+                for step, result in zip(steps, results):
+                    if result.status == 'ok' and step.kind in ('valve', 'pump'):
+                        self.mark_commanded(step.kind, step.chamberId, step.target)
+
+                role_zh = self._role_zh(operator_role)
+                summary = "；".join(d.replace(f"{role_zh}{operator_name}", "", 1) for d in descriptions)
+                self._add_log(self._operation_log(
+                    f"{role_zh}{operator_name}执行了批量操作({len(descriptions)}/{len(steps)}步): {summary}",
+                    level='success' if not failed else 'warn'
+                ), 'operation')
+        return True, results
+
+    def _apply_step(self, state: SystemState, step: BatchStep, operator_name: str, operator_role: str, busy: Set[str]) -> str:
+        if step.kind in ('valve', 'pump') and device_key(step.kind, step.chamberId, step.target) in busy:
+            raise ValueError(f"设备有未完成的指令: {step.chamberId}/{step.target}")
+        if step.kind == 'valve':
+            if step.action not in ('open', 'close'):
+                raise ValueError(f"Invalid valve action: {step.action}")
+            return self._apply_valve(state, step.chamberId, step.target, step.action, operator_name, operator_role)
+        if step.kind == 'pump':
+            if step.action not in ('on', 'off'):
+                raise ValueError(f"Invalid pump action: {step.action}")
+            return self._apply_pump(state, step.chamberId, step.target, step.action, operator_name, operator_role)
+        if step.action not in ('forward', 'backward'):
+            raise ValueError(f"Invalid move direction: {step.action}")
+        return self._apply_move(state, step.cartId, step.action, operator_name, operator_role)
+
+    @staticmethod
+    def _role_zh(operator_role: str) -> str:
+        role_map = {"admin": "管理员", "operator": "操作员", "observer": "观察员"}
+        return role_map.get(operator_role, "员工")
+
+    def _operation_log(self, content: str, level: str = 'success') -> LogEntry:
+        return LogEntry(
+            id=str(self._new_uuid()),
+            timestamp=get_clock().now_ms(),
+            type='operation',
+            content=content,
+            level=level,
+        )
+
+    def _apply_valve(self, state: SystemState, chamber_id: str, valve_name: str, action: str, operator_name: str, operator_role: str) -> str:
+        """在给定状态上设置阀门终态，返回操作描述"""
+        line, chamber, chamber_type_key = self._find_chamber(chamber_id, state)
         if not chamber:
             raise ValueError('Chamber not found')
+        if valve_name not in ChamberValves.model_fields:
+            raise ValueError(f"Unknown valve name: {valve_name}")
         
         target = 'open' if action == 'open' else 'closed'
-        line_idx = next((i + 1 for i, l in enumerate(self.state.lines) if l.id == line_id), "?")
-        
-        # Translate role
-        role_map = {"admin": "管理员", "operator": "操作员", "observer": "观察员"}
-        role_zh = role_map.get(operator_role, "员工")
+        line_idx = next((i + 1 for i, l in enumerate(state.lines) if l.id == line.id), "?")
+        role_zh = self._role_zh(operator_role)
         
         # Translate polarity
         polarity_zh = "阳极" if chamber_type_key == 'anode' else "阴极"
@@ -390,41 +926,25 @@ class StateService:
                 prev_chamber = chambers[idx-1]
                 location_desc = f"{polarity_zh}{prev_chamber.name}和{chamber.name}"
 
-        # Simulate delay 0.5-1s
-        delay = 0.5 + (uuid.uuid4().int % 500) / 1000.0
-        time.sleep(delay)
         setattr(chamber.valves, valve_name, target)
-        
-        log = LogEntry(
-            id=str(uuid.uuid4()),
-            timestamp=time.time() * 1000,
-            type='operation',
-            content=f"{role_zh}{operator_name}{'打开' if target == 'open' else '关闭'}了{line_idx}#{location_desc}的{v_zh}",
-            level='success',
-        )
-        self._add_log(log, 'operation')
-        return self.state
+        self.touch_line(line.id)
+        return f"{role_zh}{operator_name}{'打开' if target == 'open' else '关闭'}了{line_idx}#{location_desc}的{v_zh}"
 
-    def toggle_pump(self, line_id: str, chamber_id: str, pump_name: str, action: str, operator_name: str = "Admin", operator_role: str = "admin"):
-        line, chamber, chamber_type_key = self._find_chamber(chamber_id)
+    def _apply_pump(self, state: SystemState, chamber_id: str, pump_name: str, action: str, operator_name: str, operator_role: str) -> str:
+        """在给定状态上启停泵，返回操作描述"""
+        line, chamber, chamber_type_key = self._find_chamber(chamber_id, state)
         if not chamber:
             raise ValueError('Chamber not found')
             
         target_state = True if action == 'on' else False
-        line_idx = next((i + 1 for i, l in enumerate(self.state.lines) if l.id == line_id), "?")
-        
-        # Translate role
-        role_map = {"admin": "管理员", "operator": "操作员", "observer": "观察员"}
-        role_zh = role_map.get(operator_role, "员工")
+        line_idx = next((i + 1 for i, l in enumerate(state.lines) if l.id == line.id), "?")
+        role_zh = self._role_zh(operator_role)
         
         # Translate polarity
         polarity_zh = "阳极" if chamber_type_key == 'anode' else "阴极"
         
-        # Simulate delay 0.5-1s
-        delay = 0.5 + (uuid.uuid4().int % 500) / 1000.0
-        time.sleep(delay)
-        
         display_name = pump_name
+        self.touch_line(line.id)
         if pump_name == 'molecular':
             chamber.molecularPump = target_state
             display_name = "分子泵"
@@ -434,29 +954,21 @@ class StateService:
         else:
             raise ValueError(f"Unknown pump name: {pump_name}")
             
-        log = LogEntry(
-            id=str(uuid.uuid4()),
-            timestamp=time.time() * 1000,
-            type='operation',
-            content=f"{role_zh}{operator_name}{'启动' if target_state else '停止'}了{line_idx}#{polarity_zh}{chamber.name}的{display_name}",
-            level='success',
-        )
-        self._add_log(log, 'operation')
-        return self.state
+        return f"{role_zh}{operator_name}{'启动' if target_state else '停止'}了{line_idx}#{polarity_zh}{chamber.name}的{display_name}"
 
-    def move_cart(self, cart_id: str, direction: str, operator_name: str = "Admin", operator_role: str = "admin"):
-        cart = next((c for c in self.state.carts if c.id == cart_id), None)
+    def _apply_move(self, state: SystemState, cart_id: str, direction: str, operator_name: str, operator_role: str) -> str:
+        """在给定状态上移动小车（校验传输阀与占用），返回操作描述"""
+        cart = next((c for c in state.carts if c.id == cart_id), None)
         if not cart:
             raise ValueError('Cart not found')
             
         # Find current chamber and line
-        current_line, current_chamber, chamber_type = self._find_chamber(cart.locationChamberId)
+        current_line, current_chamber, chamber_type = self._find_chamber(cart.locationChamberId, state)
         if not current_line or not current_chamber:
              raise ValueError('Current chamber not found')
         
-        line_idx = next((i + 1 for i, l in enumerate(self.state.lines) if l.id == current_line.id), "?")
-        role_map = {"admin": "管理员", "operator": "操作员", "observer": "观察员"}
-        role_zh = role_map.get(operator_role, "员工")
+        line_idx = next((i + 1 for i, l in enumerate(state.lines) if l.id == current_line.id), "?")
+        role_zh = self._role_zh(operator_role)
              
         chambers = current_line.anodeChambers if chamber_type == 'anode' else current_line.cathodeChambers
         idx = next((i for i, ch in enumerate(chambers) if ch.id == cart.locationChamberId), -1)
@@ -478,21 +990,19 @@ class StateService:
             
         # Check occupancy
         target_chamber = chambers[next_idx]
-        if any(c.locationChamberId == target_chamber.id for c in self.state.carts):
+        if any(c.locationChamberId == target_chamber.id for c in state.carts):
             raise ValueError(f'目标腔体 ({target_chamber.name}) 已有车辆')
             
         # Move cart
+        self.touch_cart(cart.id)
         cart.locationChamberId = target_chamber.id
         
         # 更新工艺步骤与时间
         import datetime
-        now = datetime.datetime.now()
+        now = get_clock().datetime()
         
         # 根据目标腔体类型映射到工艺名称
-        type_to_process = {
-            'load_lock': '进样', 'bake': '烘烤工艺', 'cleaning': '清刷工艺', 'docking': '对接工艺', 'sealing': '铟封工艺', 'growth': '生长工艺', 'unload': '出样',
-        }
-        target_process_name = type_to_process.get(target_chamber.type, '未知工序')
+        target_process_name = PROCESS_BY_CHAMBER_TYPE.get(target_chamber.type, '未知工序')
         
         if cart.steps and target_process_name:
             # 1. 结束当前正在进行的步骤
@@ -522,16 +1032,9 @@ class StateService:
                         cart.nextTask = "已完成"
                     break
         
-        log = LogEntry(
-            id=str(uuid.uuid4()),
-            timestamp=time.time() * 1000,
-            type='operation',
-            content=f"{role_zh}{operator_name}将小车{cart.number}{'前进' if direction == 'forward' else '后退'}至{line_idx}#{'阳极' if chamber_type == 'anode' else '阴极'}{target_chamber.name}",
-            level='success',
-        )
-        self._add_log(log, 'operation')
-        return self.state
+        return f"{role_zh}{operator_name}将小车{cart.number}{'前进' if direction == 'forward' else '后退'}至{line_idx}#{'阳极' if chamber_type == 'anode' else '阴极'}{target_chamber.name}"
 
+    @recorded
     def create_cart(self, line_id: str, chamber_id: str, mes_data: dict, operator_name: str = "Admin", operator_role: str = "admin"):
         """
         创建新小车（进样）
@@ -540,195 +1043,199 @@ class StateService:
         :param mes_data: MES 数据（包含 recipeId）
         :return: 新创建的小车对象
         """
-        # 查找目标腔体和线体
-        line, chamber, chamber_type = self._find_chamber(chamber_id)
-        if not line or not chamber:
-            raise ValueError('Chamber not found')
+        with self.mutate() as state:
+            # 查找目标腔体和线体
+            line, chamber, chamber_type = self._find_chamber(chamber_id)
+            if not line or not chamber:
+                raise ValueError('Chamber not found')
         
-        # 检查腔体是否已有小车
-        if any(c.locationChamberId == chamber_id for c in self.state.carts):
-            raise ValueError('进样仓已有小车，无法进样')
+            # 检查腔体是否已有小车
+            if any(c.locationChamberId == chamber_id for c in state.carts):
+                raise ValueError('进样仓已有小车，无法进样')
         
-        # 获取或者使用默认配方
-        from app.services.recipe_service import get_recipe_service
-        recipe_service = get_recipe_service()
+            # 获取或者使用默认配方
+            from app.services.recipe_service import get_recipe_service
+            recipe_service = get_recipe_service()
         
-        recipe_id = mes_data.get('recipeId')
-        recipe = None
-        if recipe_id:
-            recipe = recipe_service.get_recipe(recipe_id)
+            recipe_id = mes_data.get('recipeId')
+            recipe = None
+            if recipe_id:
+                recipe = recipe_service.get_recipe(recipe_id)
         
-        if not recipe:
-            # 尝试获取该类型的默认配方
-            recipe = recipe_service.get_default_recipe(chamber_type)
+            if not recipe:
+                # 尝试获取该类型的默认配方
+                recipe = recipe_service.get_default_recipe(chamber_type)
             
-        if not recipe:
-            # 最后的降级方案（理论上不应发生，因为已初始化默认值）
-            raise ValueError("无法找到适用的工艺配方")
-
-        # 生成小车编号
-        prefix = 'A' if chamber_type == 'anode' else 'C'
-        existing_numbers = [
-            int(c.number.split('-')[1]) 
-            for c in self.state.carts 
-            if c.number.startswith(f"{prefix}-") and len(c.number.split('-')) > 1 and c.number.split('-')[1].isdigit()
-        ]
-        next_number = max(existing_numbers, default=0) + 1
-        cart_number = f"{prefix}-{next_number:03d}"
+            if not recipe:
+                # 最后的降级方案（理论上不应发生，因为已初始化默认值）
+                raise ValueError("无法找到适用的工艺配方")
+
+            # 生成小车编号
+            prefix = 'A' if chamber_type == 'anode' else 'C'
+            existing_numbers = [
+                int(c.number.split('-')[1]) 
+                for c in state.carts 
+                if c.number.startswith(f"{prefix}-") and len(c.number.split('-')) > 1 and c.number.split('-')[1].isdigit()
+            ]
+            next_number = max(existing_numbers, default=0) + 1
+            cart_number = f"{prefix}-{next_number:03d}"
         
-        # 定义工艺流程 (基于配方)
-        steps = []
-        import datetime
-        from app.models import ProcessStep
-        now = datetime.datetime.now()
-        
-        # 辅助函数：格式化时间
-        def fmt_dur(hours: float):
-            h = int(hours)
-            m = int((hours - h) * 60)
-            return f"{h}h {m}m" if h > 0 else f"{m}m"
-
-        if chamber_type == 'anode':
-            # 阳极标准流程
-            bake_dur_str = fmt_dur(recipe.bakeDuration)
+            # 定义工艺流程 (基于配方)
+            steps = []
+            import datetime
+            from app.models import ProcessStep
+            now = get_clock().datetime()
+        
+            # 辅助函数：格式化时间
+            def fmt_dur(hours: float):
+                h = int(hours)
+                m = int((hours - h) * 60)
+                return f"{h}h {m}m" if h > 0 else f"{m}m"
+
+            if chamber_type == 'anode':
+                # 阳极标准流程
+                bake_dur_str = fmt_dur(recipe.bakeDuration)
             
-            steps = [
-                ProcessStep(id='s1', name='进样', status='completed', startTime=(now - datetime.timedelta(minutes=5)).isoformat(), endTime=now.isoformat(), duration='5m', estimatedDuration='5m'),
-                ProcessStep(id='s2', name='烘烤工艺', status='active', startTime=now.isoformat(), estimatedDuration=bake_dur_str),
-                ProcessStep(id='s3', name='清刷工艺', status='pending', estimatedDuration='4h'),
-                ProcessStep(id='s4', name='对接工艺', status='pending', estimatedDuration='2h'),
-                ProcessStep(id='s5', name='铟封工艺', status='pending', estimatedDuration='3h'),
-                ProcessStep(id='s6', name='出样', status='pending', estimatedDuration='10m')
-            ]
-            current_task = "烘烤工艺"
-            next_task = "待清刷"
+                steps = [
+                    ProcessStep(id='s1', name='进样', status='completed', startTime=(now - datetime.timedelta(minutes=5)).isoformat(), endTime=now.isoformat(), duration='5m', estimatedDuration='5m'),
+                    ProcessStep(id='s2', name='烘烤工艺', status='active', startTime=now.isoformat(), estimatedDuration=bake_dur_str),
+                    ProcessStep(id='s3', name='清刷工艺', status='pending', estimatedDuration='4h'),
+                    ProcessStep(id='s4', name='对接工艺', status='pending', estimatedDuration='2h'),
+                    ProcessStep(id='s5', name='铟封工艺', status='pending', estimatedDuration='3h'),
+                    ProcessStep(id='s6', name='出样', status='pending', estimatedDuration='10m')
+                ]
+                current_task = "烘烤工艺"
+                next_task = "待清刷"
             
-            # 估算总时间 (简单累加，实际可更精确)
-            # 5m + bake + 4h + 2h + 3h + 10m
-            total_hours = 0.08 + recipe.bakeDuration + 4 + 2 + 3 + 0.16
+                # 估算总时间 (简单累加，实际可更精确)
+                # 5m + bake + 4h + 2h + 3h + 10m
+                total_hours = 0.08 + recipe.bakeDuration + 4 + 2 + 3 + 0.16
             
-            # 初始 MES 参数 (阳极) - 从配方读取
-            mes_params = {
-                "eGunVoltage": 0.0, # 初始0，清刷时才用
-                "eGunCurrent": 0.0,
-                "indiumTemp": 25.0, # 初始常温
-                "sealPressure": 0.0,
-                "temperature": 25.0,
-                "vacuum": 1e-5,
-                "targetTemp": recipe.bakeTargetTemp,
-                "targetVacuum": 1e-6,
-                "batchNo": mes_data.get('batchNo', f"ANO-{now.strftime('%y%m%d')}-{next_number:03d}"),
-                "recipeVer": f"{recipe.name} ({recipe.version})",
-                "loadTime": now.isoformat()
-            }
-        else:
-            # 阴极标准流程
-            bake_dur_str = fmt_dur(recipe.bakeDuration)
-            growth_dur_str = fmt_dur(recipe.growthDuration)
+                # 初始 MES 参数 (阳极) - 从配方读取
+                mes_params = {
+                    "eGunVoltage": 0.0, # 初始0，清刷时才用
+                    "eGunCurrent": 0.0,
+                    "indiumTemp": 25.0, # 初始常温
+                    "sealPressure": 0.0,
+                    "temperature": 25.0,
+                    "vacuum": 1e-5,
+                    "targetTemp": recipe.bakeTargetTemp,
+                    "targetVacuum": 1e-6,
+                    "batchNo": mes_data.get('batchNo', f"ANO-{now.strftime('%y%m%d')}-{next_number:03d}"),
+                    "recipeVer": f"{recipe.name} ({recipe.version})",
+                    "loadTime": now.isoformat()
+                }
+            else:
+                # 阴极标准流程
+                bake_dur_str = fmt_dur(recipe.bakeDuration)
+                growth_dur_str = fmt_dur(recipe.growthDuration)
             
-            steps = [
-                ProcessStep(id='s1', name='进样', status='completed', startTime=(now - datetime.timedelta(minutes=5)).isoformat(), endTime=now.isoformat(), duration='5m', estimatedDuration='5m'),
-                ProcessStep(id='s2', name='烘烤工艺', status='active', startTime=now.isoformat(), estimatedDuration=bake_dur_str),
-                ProcessStep(id='s3', name='生长工艺', status='pending', estimatedDuration=growth_dur_str),
-                ProcessStep(id='s4', name='出样', status='pending', estimatedDuration='10m')
-            ]
-            current_task = "烘烤工艺"
-            next_task = "待生长"
+                steps = [
+                    ProcessStep(id='s1', name='进样', status='completed', startTime=(now - datetime.timedelta(minutes=5)).isoformat(), endTime=now.isoformat(), duration='5m', estimatedDuration='5m'),
+                    ProcessStep(id='s2', name='烘烤工艺', status='active', startTime=now.isoformat(), estimatedDuration=bake_dur_str),
+                    ProcessStep(id='s3', name='生长工艺', status='pending', estimatedDuration=growth_dur_str),
+                    ProcessStep(id='s4', name='出样', status='pending', estimatedDuration='10m')
+                ]
+                current_task = "烘烤工艺"
+                next_task = "待生长"
             
-            # 5m + bake + growth + 10m
-            total_hours = 0.08 + recipe.bakeDuration + recipe.growthDuration + 0.16
+                # 5m + bake + growth + 10m
+                total_hours = 0.08 + recipe.bakeDuration + recipe.growthDuration + 0.16
             
-            # 初始 MES 参数 (阴极)
-            mes_params = {
-                "csCurrent": 0.0,
-                "o2Pressure": 1e-7,
-                "photoCurrent": 0.0,
-                "growthProgress": 0.0,
-                "temperature": 25.0,
-                "vacuum": 1e-7,
-                "targetTemp": recipe.bakeTargetTemp,
-                "targetVacuum": 1e-8,
-                "batchNo": mes_data.get('batchNo', f"CAT-{now.strftime('%y%m%d')}-{next_number:03d}"),
-                "recipeVer": f"{recipe.name} ({recipe.version})",
-                "loadTime": now.isoformat()
-            }
-
-        total_time_str = fmt_dur(total_hours)
-        
-        new_cart = Cart(
-            id=f"cart-{uuid.uuid4().hex[:8]}",
-            number=cart_number,
-            status='normal',
-            locationChamberId=chamber_id,
-            content=mes_data.get('materialCode', '未指定物料'),
-            recipeId=recipe.id,
-            currentTask=current_task,
-            nextTask=next_task,
-            progress=0.0,
-            totalTime=total_time_str,
-            remainingTime=total_time_str, # 初始近似
-            steps=steps,
-            **mes_params
-        )
+                # 初始 MES 参数 (阴极)
+                mes_params = {
+                    "csCurrent": 0.0,
+                    "o2Pressure": 1e-7,
+                    "photoCurrent": 0.0,
+                    "growthProgress": 0.0,
+                    "temperature": 25.0,
+                    "vacuum": 1e-7,
+                    "targetTemp": recipe.bakeTargetTemp,
+                    "targetVacuum": 1e-8,
+                    "batchNo": mes_data.get('batchNo', f"CAT-{now.strftime('%y%m%d')}-{next_number:03d}"),
+                    "recipeVer": f"{recipe.name} ({recipe.version})",
+                    "loadTime": now.isoformat()
+                }
+
+            total_time_str = fmt_dur(total_hours)
         
-        # 添加到系统状态
-        self.state.carts.append(new_cart)
+            new_cart = Cart(
+                id=f"cart-{self._new_uuid().hex[:8]}",
+                number=cart_number,
+                status='normal',
+                locationChamberId=chamber_id,
+                content=mes_data.get('materialCode', '未指定物料'),
+                recipeId=recipe.id,
+                currentTask=current_task,
+                nextTask=next_task,
+                progress=0.0,
+                totalTime=total_time_str,
+                remainingTime=total_time_str, # 初始近似
+                steps=steps,
+                **mes_params
+            )
         
-        # 获取线体编号
-        line_index = next((i + 1 for i, l in enumerate(self.state.lines) if l.id == line_id), "?")
+            # 添加到系统状态
+            state.carts.append(new_cart)
+            self.touch_cart(new_cart.id)
         
-        # Translate role
-        role_map = {"admin": "管理员", "operator": "操作员", "observer": "观察员"}
-        role_zh = role_map.get(operator_role, "员工")
+            # 获取线体编号
+            line_index = next((i + 1 for i, l in enumerate(state.lines) if l.id == line_id), "?")
         
-        # 记录操作日志
-        cart_type_name = "阳极" if chamber_type == 'anode' else "阴极"
-        log = LogEntry(
-            id=str(uuid.uuid4()),
-            timestamp=time.time() * 1000,
-            type='operation',
-            content=f"{role_zh}{operator_name}在{line_index}#{cart_type_name}{chamber.name}完成了进样(小车{cart_number})",
-            level='success',
-        )
-        self._add_log(log, 'operation')
+            # Translate role
+            role_map = {"admin": "管理员", "operator": "操作员", "observer": "观察员"}
+            role_zh = role_map.get(operator_role, "员工")
         
-        return new_cart
+            # 记录操作日志
+            cart_type_name = "阳极" if chamber_type == 'anode' else "阴极"
+            log = LogEntry(
+                id=str(self._new_uuid()),
+                timestamp=get_clock().now_ms(),
+                type='operation',
+                content=f"{role_zh}{operator_name}在{line_index}#{cart_type_name}{chamber.name}完成了进样(小车{cart_number})",
+                level='success',
+            )
+            self._add_log(log, 'operation')
+        
+            return new_cart.model_copy(deep=True)
 
+    @recorded
     def delete_cart(self, cart_id: str, operator_name: str = "Admin", operator_role: str = "admin"):
         """
         删除小车（出样）
         :param cart_id: 小车 ID
         :return: 删除结果
         """
-        # 查找小车
-        cart = next((c for c in self.state.carts if c.id == cart_id), None)
-        if not cart:
-            raise ValueError('Cart not found')
+        with self.mutate() as state:
+            # 查找小车
+            cart = next((c for c in state.carts if c.id == cart_id), None)
+            if not cart:
+                raise ValueError('Cart not found')
         
-        # 查找小车所在的腔体和线体
-        line, chamber, chamber_type = self._find_chamber(cart.locationChamberId)
-        if not line:
-            raise ValueError('Cart location not found')
+            # 查找小车所在的腔体和线体
+            line, chamber, chamber_type = self._find_chamber(cart.locationChamberId)
+            if not line:
+                raise ValueError('Cart location not found')
         
-        # 获取线体编号
-        line_index = next((i + 1 for i, l in enumerate(self.state.lines) if l.id == line.id), "?")
+            # 获取线体编号
+            line_index = next((i + 1 for i, l in enumerate(state.lines) if l.id == line.id), "?")
         
-        # Translate role
-        role_map = {"admin": "管理员", "operator": "操作员", "observer": "观察员"}
-        role_zh = role_map.get(operator_role, "员工")
+            # Translate role
+            role_map = {"admin": "管理员", "operator": "操作员", "observer": "观察员"}
+            role_zh = role_map.get(operator_role, "员工")
         
-        # 从系统中移除小车
-        self.state.carts = [c for c in self.state.carts if c.id != cart_id]
+            # 从系统中移除小车
+            state.carts = [c for c in state.carts if c.id != cart_id]
         
-        # 记录操作日志：格式 "x#出样阴极/阳极1辆"
-        cart_type_name = "阳极" if chamber_type == 'anode' else "阴极"
-        log = LogEntry(
-            id=str(uuid.uuid4()),
-            timestamp=time.time() * 1000,
-            type='operation',
-            content=f"{role_zh}{operator_name}在{line_index}#{cart_type_name}{chamber.name}完成了出样(小车{cart.number})",
-            level='success',
-        )
-        self._add_log(log, 'operation')
+            # 记录操作日志：格式 "x#出样阴极/阳极1辆"
+            cart_type_name = "阳极" if chamber_type == 'anode' else "阴极"
+            log = LogEntry(
+                id=str(self._new_uuid()),
+                timestamp=get_clock().now_ms(),
+                type='operation',
+                content=f"{role_zh}{operator_name}在{line_index}#{cart_type_name}{chamber.name}完成了出样(小车{cart.number})",
+                level='success',
+            )
+            self._add_log(log, 'operation')
         
-        return True
+            return True
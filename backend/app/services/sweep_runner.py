@@ -0,0 +1,399 @@
+"""
+What-if 参数扫描 - 在进程池中批量运行无界面仿真并对比结果
+
+扫描网格由若干维度的取值组成（笛卡尔积）：
+
+- recipe: 配方参数，如 {"bakeDuration": [12, 15], "anode.bakeTargetTemp": [390, 410]}
+  （不带前缀时同时作用于阳极与阴极配方）
+- extraChambers: 各线体追加的并行腔体，如 [{}, {"bake": 1}]
+- arrivalIntervalHours: 小车到达间隔，0 表示进样仓空出即投入
+
+每个网格点：
+1. 用产能规划的流水线仿真得到每日产出与瓶颈工位
+2. 用仿真服务的向量化物理内核与已编译的配方设定曲线，让一辆小车走完各工位，
+   统计能耗代理（加热时长、超出常温的度·时、处于设定温度的时长）与温度报警次数
+
+结果按参数哈希缓存（包含拓扑、基准配方与报警阈值），重复扫描只计算新增的网格点。
+"""
+
+import datetime
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.models import AlarmThresholds, Cart, Chamber, ChamberType, ProcessStep, Recipe
+from app.services.capacity_planner import DEFAULT_HANDOFF_SECONDS, plan_sequence, step_hours
+from app.services.recipe_profile import AMBIENT_TEMP, compile_profile
+from app.services.simulation_kernel import ChamberKernel
+from app.services.state_service import PROCESS_BY_CHAMBER_TYPE
+
+# 物理仿真步长 (虚拟秒)
+SWEEP_STEP = 30.0
+
+# 处于设定温度的判定带宽 (℃)
+AT_TEMPERATURE_BAND = 5.0
+
+# 单次扫描最多的网格点数
+MAX_SWEEP_POINTS = 256
+
+# 缓存的网格点结果数
+CACHE_SIZE = 1024
+
+# 扫描进程池大小（应用启动时创建）
+SWEEP_WORKERS = min(4, os.cpu_count() or 1)
+
+# 结果格式版本（计算方式变化时递增，使旧缓存失效）
+RESULT_VERSION = 1
+
+# 曲线编译的时间原点（工序开始时刻，epoch 秒）
+_ORIGIN = 1_700_000_000.0
+
+
+def expand_grid(recipe: Dict[str, List[Any]], extra_chambers: List[Dict[str, int]], arrival_intervals: List[float]) -> List[Dict[str, Any]]:
+    """展开为网格点列表：{'recipe': {参数: 值}, 'extraChambers': {...}, 'arrivalIntervalHours': x}"""
+    names = sorted(recipe)
+    points = []
+    for values in itertools.product(*(recipe[name] for name in names)):
+        for extra in extra_chambers or [{}]:
+            for interval in arrival_intervals or [0.0]:
+                points.append({
+                    'recipe': dict(zip(names, values)),
+                    'extraChambers': dict(extra),
+                    'arrivalIntervalHours': interval,
+                })
+    return points
+
+
+def apply_recipe_overrides(base: Dict[str, Recipe], overrides: Dict[str, Any]) -> Dict[str, Recipe]:
+    """按 "参数" / "anode.参数" / "cathode.参数" 覆盖基准配方"""
+    updates: Dict[str, Dict[str, Any]] = {polarity: {} for polarity in base}
+    for name, value in overrides.items():
+        polarity, _, field = name.rpartition('.')
+        if field not in Recipe.model_fields:
+            raise ValueError(f"Unknown recipe parameter: {field}")
+        for target in ([polarity] if polarity else list(base)):
+            if target not in base:
+                raise ValueError(f"Unknown line type: {target}")
+            updates[target][field] = value
+    return {
+        polarity: Recipe.model_validate({**recipe.model_dump(), **updates[polarity]})
+        for polarity, recipe in base.items()
+    }
+
+
+def _high_threshold(chamber: Chamber, polarity: str, thresholds: AlarmThresholds) -> Optional[float]:
+    if chamber.type == ChamberType.bake:
+        return thresholds.anodeBakeHighTemp if polarity == 'anode' else thresholds.cathodeBakeHighTemp
+    if chamber.type == ChamberType.growth:
+        return thresholds.growthHighTemp
+    return None
+
+
+def simulate_cart_physics(chambers: List[Chamber], polarity: str, recipe: Optional[Recipe], thresholds: AlarmThresholds) -> dict:
+    """
+    一辆小车依次经过各工位时腔体的温度响应（各工位相互独立，从常温开始）。
+    所有工位放在同一个内核中并行步进，工位时长结束后不再计入统计。
+    """
+    stages: List[Tuple[Chamber, float]] = []
+    for chamber in chambers:
+        if stages and stages[-1][0].type == chamber.type:
+            continue
+        stages.append((chamber, step_hours(chamber.type, recipe) * 3600))
+    if not stages:
+        return {'heaterHours': 0.0, 'degreeHours': 0.0, 'timeAtTemperatureHours': 0.0, 'alarms': 0}
+
+    start = datetime.datetime.fromtimestamp(_ORIGIN).isoformat()
+    models = [
+        chamber.model_copy(update={
+            'temperature': AMBIENT_TEMP, 'outerTemperature': AMBIENT_TEMP, 'heatingMode': 'off', 'isHeating': False,
+        })
+        for chamber, _ in stages
+    ]
+    profiles = []
+    for chamber in models:
+        name = PROCESS_BY_CHAMBER_TYPE.get(chamber.type, chamber.name)
+        cart = Cart(
+            id='sweep', number=f"{'A' if polarity == 'anode' else 'C'}-000", locationChamberId=chamber.id,
+            recipeId=recipe.id if recipe else None, currentTask=name,
+            steps=[ProcessStep(id='s', name=name, status='active', startTime=start, estimatedDuration='0m')],
+        )
+        profiles.append(compile_profile(recipe, chamber, cart))
+
+    kernel = ChamberKernel()
+    kernel.sync(models)
+    durations = [duration for _, duration in stages]
+    limits = [_high_threshold(chamber, polarity, thresholds) for chamber in models]
+    above = [False] * len(models)
+    heater = degree = at_temperature = 0.0
+    alarms = 0
+
+    elapsed = 0.0
+    horizon = max(durations)
+    while elapsed < horizon:
+        dt = min(SWEEP_STEP, horizon - elapsed)
+        t = _ORIGIN + elapsed
+        setpoints = [profile.evaluate(t) for profile in profiles]
+        for i, (inner, outer) in enumerate(setpoints):
+            kernel.target_inner[i] = inner
+            kernel.target_outer[i] = outer
+        kernel.step(dt, 1.0, False)
+        elapsed += dt
+
+        temperature = kernel.temperature.tolist()
+        heating = kernel.heating.tolist()
+        for i, duration in enumerate(durations):
+            if elapsed - dt >= duration:
+                continue
+            T = temperature[i]
+            if heating[i]:
+                heater += dt
+            degree += max(0.0, T - AMBIENT_TEMP) * dt
+            setpoint = setpoints[i][0]
+            if setpoint > AMBIENT_TEMP + AT_TEMPERATURE_BAND and abs(T - setpoint) <= AT_TEMPERATURE_BAND:
+                at_temperature += dt
+            if limits[i] is not None:
+                # 报警按越限的上升沿计数
+                is_above = T > limits[i]
+                if is_above and not above[i]:
+                    alarms += 1
+                above[i] = is_above
+
+    return {
+        'heaterHours': heater / 3600,
+        'degreeHours': degree / 3600,
+        'timeAtTemperatureHours': at_temperature / 3600,
+        'alarms': alarms,
+    }
+
+
+def evaluate_group(
+    overrides: Dict[str, Any],
+    points: List[Dict[str, Any]],
+    sequences: List[Tuple[str, str, List[Chamber]]],
+    base_recipes: Dict[str, Recipe],
+    thresholds: AlarmThresholds,
+    carts: int,
+    days: float,
+    handoff: float
+) -> List[dict]:
+    """
+    计算配方参数相同的一组网格点（纯函数，在进程池的子进程中执行）。
+    物理响应只取决于配方，每条腔体序列只仿真一次；流水线仿真按各点的腔体数与到达间隔分别运行。
+    """
+    recipes = apply_recipe_overrides(base_recipes, overrides)
+    physics = [
+        simulate_cart_physics(chambers, polarity, recipes.get(polarity), thresholds)
+        for _, polarity, chambers in sequences
+    ]
+    results = []
+    for point in points:
+        totals = {'throughputPerDay': 0.0, 'degreeHoursPerDay': 0.0, 'heaterHoursPerDay': 0.0, 'alarmsPerDay': 0.0}
+        rows = []
+        for (line_id, polarity, chambers), per_cart in zip(sequences, physics):
+            flow = plan_sequence(
+                chambers, recipes.get(polarity), carts, days,
+                handoff=handoff,
+                arrival_interval_hours=point['arrivalIntervalHours'],
+                extra_chambers=point['extraChambers'],
+            )
+            throughput = flow['throughputPerDay']
+            rows.append({
+                'lineId': line_id,
+                'polarity': polarity,
+                'throughputPerDay': throughput,
+                'meanLeadTimeHours': flow.get('meanLeadTimeHours'),
+                'bottleneck': flow['bottleneck']['name'] if flow['bottleneck'] else None,
+                'perCart': per_cart,
+            })
+            totals['throughputPerDay'] += throughput
+            totals['degreeHoursPerDay'] += per_cart['degreeHours'] * throughput
+            totals['heaterHoursPerDay'] += per_cart['heaterHours'] * throughput
+            totals['alarmsPerDay'] += per_cart['alarms'] * throughput
+        results.append({'sequences': rows, **totals})
+    return results
+
+
+def point_key(point: Dict[str, Any], context: Dict[str, Any]) -> str:
+    """网格点的参数哈希（含拓扑、基准配方、阈值与规划参数）"""
+    payload = json.dumps({'point': point, 'context': context, 'version': RESULT_VERSION}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class SweepRunner:
+    def __init__(self, state_service, recipe_service, settings_service):
+        self.state_service = state_service
+        self.recipe_service = recipe_service
+        self.settings_service = settings_service
+        self._cache: 'OrderedDict[str, dict]' = OrderedDict()
+        self._lock = Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_size = 0
+
+    def start(self, workers: int = SWEEP_WORKERS):
+        """
+        创建扫描进程池（应用启动时、其他服务启动线程之前调用）。
+        入口脚本导入即创建服务，子进程无法以 spawn 方式干净地启动，因此在后台线程启动之前 fork；
+        fork 方式的进程池在首次提交时才创建子进程，这里提交一个空任务使子进程立即创建。
+        不支持 fork 的平台上扫描在请求线程内串行计算。
+        """
+        if self._pool is not None or workers < 2 or "fork" not in multiprocessing.get_all_start_methods():
+            return
+        self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+        self._pool_size = workers
+        self._pool.submit(int).result()
+
+    def stop(self):
+        pool, self._pool = self._pool, None
+        self._pool_size = 0
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    def _cached(self, key: str) -> Optional[dict]:
+        with self._lock:
+            result = self._cache.get(key)
+            if result is not None:
+                self._cache.move_to_end(key)
+            return result
+
+    def _store(self, key: str, result: dict):
+        with self._lock:
+            self._cache[key] = result
+            self._cache.move_to_end(key)
+            while len(self._cache) > CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+
+    @staticmethod
+    def _run_pooled(pool: ProcessPoolExecutor, tasks: list, args: tuple, limit: int) -> list:
+        """在进程池中计算各任务，同时在途的任务不超过 limit 个（其余排队等待空位）"""
+        computed = []
+        pending = {}
+        for overrides, keys_, group_points in tasks:
+            pending[pool.submit(evaluate_group, overrides, group_points, *args)] = keys_
+            if len(pending) < limit:
+                continue
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            computed += [(pending.pop(future), future.result()) for future in done]
+        computed += [(keys_, future.result()) for future, keys_ in pending.items()]
+        return computed
+
+    def run(
+        self,
+        recipe: Optional[Dict[str, List[Any]]] = None,
+        extra_chambers: Optional[List[Dict[str, int]]] = None,
+        arrival_intervals: Optional[List[float]] = None,
+        carts: int = 20,
+        days: float = 7.0,
+        line_id: Optional[str] = None,
+        handoff_seconds: float = DEFAULT_HANDOFF_SECONDS,
+        workers: int = 2
+    ) -> dict:
+        """
+        运行扫描。workers 为同时计算的任务数上限：实际并行度为 min(workers, 进程池大小)，
+        workers <= 1 或进程池不可用时在请求线程内串行计算
+        """
+        started_at = time.perf_counter()
+        points = expand_grid(recipe or {}, extra_chambers or [], arrival_intervals or [])
+        if len(points) > MAX_SWEEP_POINTS:
+            raise ValueError(f"Sweep has {len(points)} points (max {MAX_SWEEP_POINTS})")
+        if carts < 1 or days <= 0:
+            raise ValueError("carts and days must be positive")
+
+        state = self.state_service.get_state()
+        lines = [line for line in state.lines if line_id is None or line.id == line_id]
+        if line_id is not None and not lines:
+            raise ValueError(f"Line not found: {line_id}")
+        sequences = [
+            (line.id, polarity, chambers)
+            for line in lines
+            for polarity, chambers in (('anode', line.anodeChambers), ('cathode', line.cathodeChambers))
+            if chambers
+        ]
+        base_recipes = {
+            polarity: recipe
+            for polarity in ('anode', 'cathode')
+            if (recipe := self.recipe_service.get_default_recipe(polarity)) is not None
+        }
+        thresholds = self.settings_service.get_settings().thresholds
+
+        # 缓存键只包含影响结果的输入
+        context = {
+            'topology': [
+                (line_id, polarity, [(c.id, c.type.value, c.maxCartCapacity) for c in chambers])
+                for line_id, polarity, chambers in sequences
+            ],
+            'recipes': {polarity: recipe.model_dump(mode='json') for polarity, recipe in base_recipes.items()},
+            'thresholds': thresholds.model_dump(mode='json'),
+            'carts': carts,
+            'days': days,
+            'handoff': handoff_seconds,
+        }
+        keys = [point_key(point, context) for point in points]
+        results: Dict[str, dict] = {}
+        missing: Dict[str, Dict[str, Any]] = {}
+        for key, point in zip(keys, points):
+            cached = self._cached(key)
+            if cached is not None:
+                results[key] = cached
+            else:
+                missing.setdefault(key, point)
+
+        # 按配方参数分组，每组作为进程池的一个任务
+        groups: Dict[str, Tuple[Dict[str, Any], List[str]]] = {}
+        for key, point in missing.items():
+            group = json.dumps(point['recipe'], sort_keys=True, default=str)
+            groups.setdefault(group, (point['recipe'], []))[1].append(key)
+
+        args = (sequences, base_recipes, thresholds, carts, days, handoff_seconds)
+        tasks = [(overrides, keys_, [missing[key] for key in keys_]) for overrides, keys_ in groups.values()]
+        if tasks:
+            pool = self._pool
+            computed = None
+            limit = min(workers, self._pool_size)
+            if pool is not None and limit > 1 and len(tasks) > 1:
+                try:
+                    computed = self._run_pooled(pool, tasks, args, limit)
+                except BrokenProcessPool:
+                    # 子进程异常退出：此后无法再安全地 fork，改为串行计算
+                    print("Sweep worker pool broke; computing sweeps in-process.")
+                    self._pool = None
+            if computed is None:
+                computed = [(keys_, evaluate_group(overrides, group_points, *args)) for overrides, keys_, group_points in tasks]
+            for keys_, group_results in computed:
+                for key, result in zip(keys_, group_results):
+                    self._store(key, result)
+                    results[key] = result
+
+        rows = [
+            {'key': key, 'cached': key not in missing, 'parameters': point, **results[key]}
+            for key, point in zip(keys, points)
+        ]
+        return {
+            'points': len(points),
+            'computed': len(missing),
+            'rows': rows,
+            'wallSeconds': time.perf_counter() - started_at,
+        }
+
+
+_sweep_runner_instance: Optional[SweepRunner] = None
+
+def get_sweep_runner() -> SweepRunner:
+    global _sweep_runner_instance
+    if _sweep_runner_instance is None:
+        from app.services.recipe_service import get_recipe_service
+        from app.services.settings_service import SettingsService
+        from app.services.state_service import StateService
+        _sweep_runner_instance = SweepRunner(StateService(), get_recipe_service(), SettingsService())
+    return _sweep_runner_instance
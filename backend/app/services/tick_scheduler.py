@@ -0,0 +1,137 @@
+"""
+固定频率 tick 调度器 - 基于单调时钟的无漂移节拍
+
+第 k 个 tick 的截止时刻为 anchor + k * period，与 tick 本身的耗时无关，
+因此不会像 "执行 + sleep(period)" 那样随负载累积漂移。
+tick 超时（错过一个或多个截止时刻）时按策略处理：
+
+- catch_up: 立即连续补跑错过的 tick（最多 MAX_CATCH_UP 个，超出部分跳过）
+- skip: 丢弃错过的截止时刻，对齐到下一个未来的节拍
+
+由于仿真步长取自虚拟时钟，跳过的 tick 不会丢失仿真时间，只会合并进下一个 tick 的 dt。
+"""
+
+import math
+import threading
+import time
+from typing import Callable
+
+TICK_POLICIES = ('catch_up', 'skip')
+
+# catch_up 策略下单次最多补跑的 tick 数，超出部分按 skip 处理
+MAX_CATCH_UP = 5
+
+# 最小 tick 周期 (秒)
+MIN_PERIOD = 0.05
+
+# 迟到时间滑动平均的平滑系数
+LATENESS_SMOOTHING = 0.1
+
+
+class TickScheduler:
+    def __init__(self, period: float, policy: str = 'skip', clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self.period = max(MIN_PERIOD, period)
+        self.policy = policy
+        self._anchor = clock()
+        self._index = 0
+        self._run_started = self._anchor
+        self._last_tick_started = self._anchor
+        self._run_ticks = 0
+        # 唤醒事件：停止或修改周期时提前结束等待
+        self._wake = threading.Event()
+
+        # 指标
+        self.ticks = 0
+        self.skipped = 0
+        self.caught_up = 0
+        self.last_lateness = 0.0
+        self.max_lateness = 0.0
+        self.mean_lateness = 0.0
+        self.last_duration = 0.0
+
+    @property
+    def deadline(self) -> float:
+        return self._anchor + self._index * self.period
+
+    def reset(self):
+        """以当前时刻为锚点重新计数（启动/恢复时调用）"""
+        self._anchor = self._clock()
+        self._index = 0
+        self._run_started = self._anchor
+        self._last_tick_started = self._anchor
+        self._run_ticks = 0
+
+    def set_period(self, period: float):
+        """修改周期：从当前节拍起按新周期排程"""
+        period = max(MIN_PERIOD, period)
+        if period == self.period:
+            return
+        self._anchor = self.deadline
+        self._index = 0
+        self.period = period
+
+    def set_policy(self, policy: str):
+        if policy not in TICK_POLICIES:
+            raise ValueError(f"Unknown tick policy: {policy}")
+        self.policy = policy
+
+    def wake(self):
+        self._wake.set()
+
+    def wait(self) -> bool:
+        """
+        等待下一个截止时刻并记录迟到时间。
+        返回 False 表示等待被 wake() 打断（调用方应重新检查运行状态）。
+        """
+        while True:
+            delay = self.deadline - self._clock()
+            if delay <= 0:
+                break
+            self._wake.clear()
+            if self._wake.wait(delay):
+                return False
+
+        lateness = self._clock() - self.deadline
+        self.last_lateness = lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+        self.mean_lateness += (lateness - self.mean_lateness) * LATENESS_SMOOTHING
+        return True
+
+    def advance(self, tick_started: float):
+        """tick 执行完毕：累计指标并确定下一个截止时刻"""
+        self.ticks += 1
+        self._run_ticks += 1
+        self._last_tick_started = tick_started
+        now = self._clock()
+        self.last_duration = now - tick_started
+        self._index += 1
+
+        missed = math.floor((now - self.deadline) / self.period) + 1 if now > self.deadline else 0
+        if missed <= 0:
+            return
+        # catch_up 保留不超过 MAX_CATCH_UP 个已过期的截止时刻，其余跳过
+        skip = max(0, missed - MAX_CATCH_UP) if self.policy == 'catch_up' else missed
+        if skip:
+            self._index += skip
+            self.skipped += skip
+        if self.deadline <= now:
+            # 下一个 tick 不等待，立即补跑
+            self.caught_up += 1
+
+    def metrics(self) -> dict:
+        # 本次运行（上次 reset 以来）实际达到的 tick 频率：按首尾 tick 的起始时刻计算
+        span = self._last_tick_started - self._run_started if self._run_ticks > 1 else 0.0
+        return {
+            'period': self.period,
+            'tickRate': 1.0 / self.period,
+            'measuredTickRate': (self._run_ticks - 1) / span if span > 0 else 0.0,
+            'policy': self.policy,
+            'ticks': self.ticks,
+            'skipped': self.skipped,
+            'caughtUp': self.caught_up,
+            'lastLateness': self.last_lateness,
+            'meanLateness': self.mean_lateness,
+            'maxLateness': self.max_lateness,
+            'lastDuration': self.last_duration,
+        }
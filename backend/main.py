@@ -4,17 +4,35 @@ from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 
 from app.api import router
-from app.services.simulation_service import SimulationService
-
-simulation_service = SimulationService()
+from app.services.simulation_service import get_simulation_service
+from app.services.acquisition_service import get_acquisition_service
+from app.services.alarm_history import get_alarm_history
+from app.services.history_service import get_history_service
+from app.services.ingest_aggregator import get_ingest_aggregator
+from app.services.state_service import StateService
+from app.services.sweep_runner import get_sweep_runner
+
+# 仿真引擎全局唯一，由应用生命周期负责启动与关闭
+simulation_service = get_simulation_service()
+acquisition_service = get_acquisition_service()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
+    # 扫描进程池以 fork 方式创建，须在任何后台线程启动之前
+    get_sweep_runner().start()
+    StateService().start_journal()
+    get_alarm_history().start()
     simulation_service.start()
+    acquisition_service.start()
     yield
     # Shutdown
+    acquisition_service.stop()
     simulation_service.stop()
+    get_ingest_aggregator().flush()
+    get_history_service().flush_events()
+    StateService().close()
+    get_sweep_runner().stop()
 
 app = FastAPI(title="AutoLine Monitor API", lifespan=lifespan)
 
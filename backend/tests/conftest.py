@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from app.services.history_service import HistoryService
+
+# 测试使用临时的历史库，不写入 mes_data
+HistoryService.DB_PATH = os.path.join(tempfile.mkdtemp(prefix='autoline-tests-'), 'history.db')
@@ -0,0 +1,285 @@
+import asyncio
+import json
+import math
+import socket
+import time
+
+import pytest
+
+from app.models import Chamber, ChamberType, CommandStatus, HardwareConfig, LineData, SystemState, ValveState
+from app.services import acquisition_service, http_polling, modbus_tcp, mqtt_ingest
+from app.services.acquisition_service import AcquisitionDriver, AcquisitionService, SimulatedPlant, clean_reading
+from app.services.command_service import CommandService
+from app.services.modbus_tcp import POINT_REGISTERS, coalesce, decode_reading, encode_reading
+from app.services.mqtt_ingest import TopicRouter, telemetry_topic, topic_matches
+from app.services.state_service import StateService
+
+ANODE_TYPES = (ChamberType.load_lock, ChamberType.bake, ChamberType.cleaning, ChamberType.docking, ChamberType.sealing)
+CATHODE_TYPES = (ChamberType.load_lock, ChamberType.bake, ChamberType.growth, ChamberType.growth, ChamberType.unload)
+
+# 替身往返的规模与时间预算
+LINES = 10
+CHAMBERS_PER_LINE = 10
+ROUND_TRIP_BUDGET = 1.0
+
+
+def _topology() -> SystemState:
+    lines = []
+    for k in range(LINES):
+        line_id = f"L{k}"
+
+        def chambers(prefix, types):
+            return [
+                Chamber(id=f"{line_id}-{prefix}{i}", lineId=line_id, name=f"{prefix}{i}", type=t,
+                        targetTemperature=100.0 + 10 * i, molecularPump=i % 2 == 0)
+                for i, t in enumerate(types)
+            ]
+        lines.append(LineData(id=line_id, name=f"{k + 1}#", anodeChambers=chambers('a', ANODE_TYPES),
+                              cathodeChambers=chambers('c', CATHODE_TYPES)))
+    return SystemState(lines=lines, carts=[], timestamp=0)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _reading(**overrides) -> dict:
+    reading = {
+        'temperature': 123.5, 'outerTemperature': 25.0, 'highVacPressure': 3.2e-7, 'forelinePressure': 10.0,
+        'molecularPump': True, 'roughingPump': False, 'isHeating': True,
+        'valves': {'gate_valve': True, 'transfer_valve': False, 'roughing_valve': False,
+                   'foreline_valve': True, 'vent_valve': False},
+    }
+    reading.update(overrides)
+    return reading
+
+
+# ==================== Modbus 编解码 ====================
+
+def test_coalesce_merges_small_gaps_and_splits_at_protocol_limit():
+    assert coalesce([(20, 9), (0, 9), (10, 9)]) == [(0, 29)]
+    # 间隔超过 max_gap 时不合并
+    assert coalesce([(0, 9), (20, 9)], max_gap=4) == [(0, 9), (20, 9)]
+    # 合并后不超过 125 个寄存器，单个腔体的点位不拆开
+    requests = coalesce([(k * 10, POINT_REGISTERS) for k in range(100)])
+    assert all(count <= 125 for _, count in requests)
+    assert all(start % 10 == 0 for start, _ in requests)
+    assert requests[-1][0] + requests[-1][1] == 99 * 10 + POINT_REGISTERS
+    # 超长区间按上限拆分
+    assert coalesce([(0, 300)]) == [(0, 125), (125, 125), (250, 50)]
+
+
+def test_encode_decode_round_trip():
+    reading = _reading()
+    words = encode_reading(reading)
+    assert len(words) == POINT_REGISTERS
+    assert all(0 <= w <= 0xFFFF for w in words)
+    decoded = decode_reading(words)
+    for name in ('temperature', 'outerTemperature', 'highVacPressure', 'forelinePressure'):
+        assert math.isclose(decoded[name], reading[name], rel_tol=1e-6)
+    for name in ('molecularPump', 'roughingPump', 'isHeating'):
+        assert decoded[name] is reading[name]
+    assert decoded['valves'] == reading['valves']
+
+
+# ==================== 读数校验 ====================
+
+def test_clean_reading_drops_and_counts_bad_fields():
+    cleaned, bad = clean_reading({
+        'temperature': '150', 'highVacPressure': float('nan'), 'forelinePressure': 12,
+        'molecularPump': 1, 'roughingPump': 'on', 'isHeating': True,
+        'valves': {'vent_valve': False, 'gate_valve': [1], 'unknown_valve': True},
+        'extra': 'ignored',
+    })
+    assert bad == 4
+    assert cleaned == {
+        'forelinePressure': 12.0, 'molecularPump': True, 'isHeating': True, 'valves': {'vent_valve': False},
+    }
+    assert clean_reading({'valves': 'open'}) == ({}, 1)
+
+
+# ==================== MQTT 主题 ====================
+
+def test_topic_matches_wildcards():
+    assert topic_matches('autoline/+/+/telemetry', 'autoline/L1/c1/telemetry')
+    assert not topic_matches('autoline/+/telemetry', 'autoline/L1/c1/telemetry')
+    assert topic_matches('a/#', 'a')
+    assert topic_matches('a/#', 'a/b/c')
+    assert not topic_matches('a/+', 'a/b/c')
+    assert not topic_matches('a/b', 'a')
+
+
+def test_topic_router_matches_like_topic_filters():
+    router = TopicRouter()
+    filters = ['a/+/c', 'a/#', '#', 'a/b/c', 'b/+']
+    for topic_filter in filters:
+        router.add(topic_filter, topic_filter)
+    for topic in ('a/b/c', 'a', 'b/x', 'b/x/y', 'c'):
+        expected = sorted(f for f in filters if topic_matches(f, topic))
+        assert sorted(router.match(topic)) == expected
+
+
+def test_mqtt_message_with_bad_fields_is_partially_merged():
+    state = _topology()
+    driver = mqtt_ingest.MqttDriver(HardwareConfig(port=1), state)
+    topic = telemetry_topic('L0', 'L0-a1')
+    driver._on_message(topic, json.dumps({'temperature': 'hot', 'highVacPressure': 1e-6, 'valves': {'vent_valve': 1}}).encode())
+    driver._on_message(topic, b'not json')
+    driver._on_message(telemetry_topic('L1', 'L0-a1'), b'{}')
+
+    assert driver.decode_errors == 2
+    assert driver.unrouted == 1
+    assert driver._batch == {'L0-a1': {'highVacPressure': 1e-6, 'valves': {'vent_valve': True}}}
+    assert [(s[0], s[1], s[2]) for s in driver._samples] == [('L0-a1', 'vacuum', 1e-6)]
+
+
+async def _scripted_broker(port: int, packets: list):
+    """接受一个客户端：应答 CONNECT/SUBSCRIBE 后依次发送给定的报文"""
+    async def handle(reader, writer):
+        await mqtt_ingest.read_packet(reader)
+        writer.write(mqtt_ingest.packet(mqtt_ingest.CONNACK, 0, b'\x00\x00'))
+        _, _, body = await mqtt_ingest.read_packet(reader)
+        writer.write(mqtt_ingest.packet(mqtt_ingest.SUBACK, 0, body[:2] + b'\x01' * (len(_topology().lines))))
+        for data in packets:
+            writer.write(data)
+        await writer.drain()
+        await reader.read()
+    return await asyncio.start_server(handle, '127.0.0.1', port)
+
+
+async def _receive_scripted(packets: list, on_message=None):
+    port = _free_port()
+    server = await _scripted_broker(port, packets)
+    driver = mqtt_ingest.MqttDriver(HardwareConfig(ipAddress='127.0.0.1', port=port), _topology())
+    if on_message is not None:
+        driver.client.on_message = on_message
+    try:
+        batch = await driver.poll()
+        await asyncio.sleep(0.1)
+        connected = driver.client.connected
+        batch.update(await driver.poll())
+        return driver, connected, batch
+    finally:
+        await driver.close()
+        server.close()
+        await server.wait_closed()
+
+
+def test_mqtt_malformed_publish_is_counted_and_receiving_continues():
+    bad_topic = mqtt_ingest.packet(mqtt_ingest.PUBLISH, 0, b'\x00\x02\xff\xfe{}')
+    truncated = mqtt_ingest.packet(mqtt_ingest.PUBLISH, 0x02, b'\x00')
+    good = mqtt_ingest.publish_packet(telemetry_topic('L0', 'L0-a1'), json.dumps({'temperature': 150.0}).encode(), 0)
+    driver, connected, batch = asyncio.run(_receive_scripted([bad_topic, truncated, good]))
+    assert connected
+    assert driver.decode_errors == 2
+    assert batch == {'L0-a1': {'temperature': 150.0}}
+
+
+def test_mqtt_receiver_failure_marks_connection_lost():
+    def fail(topic, payload):
+        raise RuntimeError('handler bug')
+    good = mqtt_ingest.publish_packet(telemetry_topic('L0', 'L0-a1'), b'{}', 0)
+    _, connected, _ = asyncio.run(_receive_scripted([good], on_message=fail))
+    assert not connected
+
+
+# ==================== 协议替身往返 ====================
+
+async def _round_trip(module, driver_class, config: HardwareConfig, wait: float):
+    """启动替身与驱动，直到取得全部腔体的读数或超出时间预算；返回 (替身读数, 驱动读数, 耗时)"""
+    state = _topology()
+    plant = SimulatedPlant(state, seed=1)
+    plant.step(1.0)
+    standin = await module.start_standin(plant, config)
+    driver = driver_class(config, state)
+    try:
+        started = time.perf_counter()
+        batch = await driver.poll()
+        while len(batch) < len(plant.chambers) and time.perf_counter() - started < ROUND_TRIP_BUDGET:
+            await asyncio.sleep(wait)
+            batch.update(await driver.poll())
+        return plant.readings(), batch, time.perf_counter() - started
+    finally:
+        await driver.close()
+        await standin.close()
+
+
+def _assert_round_trip(expected: dict, received: dict, elapsed: float, rel_tol: float):
+    assert len(expected) == LINES * CHAMBERS_PER_LINE
+    assert set(received) == set(expected)
+    assert elapsed < ROUND_TRIP_BUDGET
+    for chamber_id, reading in expected.items():
+        got = received[chamber_id]
+        for name in ('temperature', 'outerTemperature', 'highVacPressure', 'forelinePressure'):
+            assert math.isclose(got[name], reading[name], rel_tol=rel_tol), (chamber_id, name)
+        for name in ('molecularPump', 'roughingPump', 'isHeating'):
+            assert got[name] == reading[name]
+        assert got['valves'] == reading['valves']
+
+
+@pytest.mark.parametrize('module, driver_class, rel_tol', [
+    # Modbus 浮点点位为单精度
+    (modbus_tcp, modbus_tcp.ModbusDriver, 1e-6),
+    (mqtt_ingest, mqtt_ingest.MqttDriver, 1e-12),
+    (http_polling, http_polling.HttpPollingDriver, 1e-12),
+], ids=['modbus', 'mqtt', 'http'])
+def test_standin_round_trip(module, driver_class, rel_tol):
+    config = HardwareConfig(protocol=driver_class.protocol, port=_free_port(), pollingInterval=100)
+    expected, received, elapsed = asyncio.run(_round_trip(module, driver_class, config, wait=0.05))
+    _assert_round_trip(expected, received, elapsed, rel_tol)
+
+
+# ==================== 指令与采集 ====================
+
+class _PlantDriver(AcquisitionDriver):
+    """直接读取替身数据源的驱动"""
+    protocol = 'test'
+
+    def __init__(self, plant: SimulatedPlant):
+        self.plant = plant
+
+    async def poll(self):
+        return self.plant.readings()
+
+
+def test_valve_command_is_kept_and_forwarded_while_acquiring(monkeypatch):
+    monkeypatch.setattr(CommandService, 'VALVE_STROKE_TIME', (0.01, 0.01))
+    state_service = StateService()
+    line = state_service.get_state().lines[0]
+    chamber_id = line.anodeChambers[0].id
+
+    def valve():
+        _, chamber, _ = state_service._find_chamber(chamber_id, state_service.get_state())
+        return chamber.valves.roughing_valve
+
+    async def scenario():
+        state_service.toggle_valve(line.id, chamber_id, 'roughing_valve', 'close')
+        service = AcquisitionService()
+        plant = SimulatedPlant(state_service.get_state(), seed=1)
+        service._driver = _PlantDriver(plant)
+        service._plant = plant
+        await service._cycle()
+        assert valve() == ValveState.closed
+
+        commands = CommandService()
+        command = commands.submit_valve(line.id, chamber_id, 'roughing_valve', 'open')
+        # 动作中：读数不覆盖过渡态
+        await service._cycle()
+        assert valve() == ValveState.opening
+        await commands.wait_for(command.id, timeout=1.0)
+        assert command.status == CommandStatus.completed
+
+        # 行程结束后读数（替身仍为关闭）不回滚指令，指令转发给替身
+        await service._cycle()
+        assert valve() == ValveState.open
+        assert plant.chamber_by_id[chamber_id].valves.roughing_valve == ValveState.open
+
+        # 保持期结束后读数已与指令一致
+        monkeypatch.setattr(acquisition_service, 'COMMAND_HOLD', 0.0)
+        await service._cycle()
+        assert valve() == ValveState.open
+        assert service.errors == 0
+
+    asyncio.run(scenario())
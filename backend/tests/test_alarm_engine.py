@@ -0,0 +1,129 @@
+import pytest
+
+from app.models import Cart, Chamber, ChamberType, LineData, SystemState
+from app.services.alarm_engine import ACKNOWLEDGED, ACTIVE, CLEARED, AlarmEngine
+from app.services.settings_service import SettingsService
+
+ALARM_ID = 'L1-bake:TEMP_HIGH'
+
+
+@pytest.fixture
+def setup():
+    thresholds = SettingsService().get_settings().thresholds
+    bake = Chamber(id='L1-bake', lineId='L1', name='烘烤仓', type=ChamberType.bake)
+    state = SystemState(lines=[LineData(id='L1', name='1#', anodeChambers=[bake])], carts=[], timestamp=0)
+    engine = AlarmEngine()
+    events = []
+    engine.add_listener(events.extend)
+    return engine, state, bake, thresholds, events
+
+
+def _status(engine: AlarmEngine):
+    return next((a['status'] for a in engine.get_alarms()[1] if a['id'] == ALARM_ID), 'normal')
+
+
+def _transitions(events):
+    return [e['transition'] for e in events if e['id'] == ALARM_ID]
+
+
+def test_acknowledged_alarm_returns_to_normal_on_recovery(setup):
+    engine, state, bake, thresholds, events = setup
+    delay = thresholds.alarmDelay
+    limit = thresholds.anodeBakeHighTemp
+
+    bake.temperature = limit + 10
+    engine.evaluate(state, [bake], 1000.0)
+    # 越限须持续 alarmDelay 秒
+    assert _status(engine) == 'normal'
+    engine.evaluate(state, [bake], 1000.0 + delay)
+    assert _status(engine) == ACTIVE
+    alarm = next(a for a in engine.get_alarms()[1] if a['id'] == ALARM_ID)
+    assert alarm['triggerValue'] == limit + 10 and alarm['lineId'] == 'L1'
+
+    assert engine.acknowledge([ALARM_ID], now=1010.0) == 1
+    assert _status(engine) == ACKNOWLEDGED
+
+    # 死区以内不算恢复
+    bake.temperature = limit - thresholds.temperatureHysteresis / 2
+    engine.evaluate(state, [bake], 1020.0)
+    engine.evaluate(state, [bake], 1020.0 + delay)
+    assert _status(engine) == ACKNOWLEDGED
+
+    bake.temperature = limit - thresholds.temperatureHysteresis - 1
+    engine.evaluate(state, [bake], 1030.0)
+    engine.evaluate(state, [bake], 1030.0 + delay)
+    assert _status(engine) == 'normal'
+    assert _transitions(events) == ['raised', 'acknowledged', 'cleared']
+
+
+def test_unacknowledged_alarm_latches_until_cleared(setup):
+    engine, state, bake, thresholds, events = setup
+    delay = thresholds.alarmDelay
+    limit = thresholds.anodeBakeHighTemp
+
+    bake.temperature = limit + 10
+    engine.evaluate(state, [bake], 2000.0)
+    engine.evaluate(state, [bake], 2000.0 + delay)
+    # 越限中的报警不能清除
+    with pytest.raises(ValueError):
+        engine.clear([ALARM_ID], now=2010.0)
+
+    bake.temperature = 25.0
+    engine.evaluate(state, [bake], 2020.0)
+    engine.evaluate(state, [bake], 2020.0 + delay)
+    assert _status(engine) == CLEARED
+
+    assert engine.clear([ALARM_ID], now=2030.0) == 1
+    assert _status(engine) == 'normal'
+    assert _transitions(events) == ['raised', 'cleared', 'reset']
+    with pytest.raises(KeyError):
+        engine.acknowledge(['missing:TEMP_HIGH'])
+
+
+def test_removed_chamber_ends_open_alarm(setup):
+    engine, state, bake, thresholds, events = setup
+    bake.temperature = thresholds.anodeBakeHighTemp + 10
+    engine.evaluate(state, [bake], 3000.0)
+    engine.evaluate(state, [bake], 3000.0 + thresholds.alarmDelay)
+
+    empty = SystemState(lines=[LineData(id='L1', name='1#')], carts=[], timestamp=0)
+    engine.evaluate(empty, [], 3010.0)
+    assert _transitions(events) == ['raised', 'removed']
+    assert engine.get_alarms()[1] == []
+
+
+def _growth_line():
+    growth = Chamber(id='L1-sz', lineId='L1', name='生长仓', type=ChamberType.growth, isHeating=True)
+    cart = Cart(id='k1', number='C-001', locationChamberId=growth.id)
+    state = SystemState(lines=[LineData(id='L1', name='1#', cathodeChambers=[growth])], carts=[cart], timestamp=0)
+    return growth, cart, state
+
+
+def test_growth_chamber_with_cart_raises_temp_low_and_process_vacuum():
+    thresholds = SettingsService().get_settings().thresholds
+    growth, cart, state = _growth_line()
+    growth.temperature = thresholds.growthLowTemp - 10
+    cart.vacuum = 1.0
+    engine = AlarmEngine()
+    for now in (0.0, 10.0, 20.0):
+        engine.evaluate(state, [growth], now)
+    assert {a['id']: a['status'] for a in engine.get_alarms()[1]} == {
+        'L1-sz:TEMP_LOW': ACTIVE, 'k1:PROCESS_VACUUM': ACTIVE,
+    }
+
+
+def test_temp_low_and_process_vacuum_need_occupied_heating_chamber():
+    thresholds = SettingsService().get_settings().thresholds
+    growth, cart, state = _growth_line()
+    growth.temperature = thresholds.growthLowTemp - 10
+    cart.vacuum = 1.0
+    engine = AlarmEngine()
+    # 仿真 tick 传入的占用集合为空：腔体不在工艺中
+    for now in (0.0, 10.0):
+        engine.evaluate(state, [growth], now, occupied=set())
+    assert engine.get_alarms()[1] == []
+    # 未加热时同样不在工艺中
+    growth.isHeating = False
+    for now in (20.0, 30.0):
+        engine.evaluate(state, [growth], now, occupied={growth.id})
+    assert engine.get_alarms()[1] == []
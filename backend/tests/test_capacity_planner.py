@@ -0,0 +1,58 @@
+import pytest
+
+from app.models import Chamber, ChamberType, Recipe
+from app.services.capacity_planner import Stage, build_stages, plan_sequence, simulate_flow
+
+
+def _recipe(bake_hours: float) -> Recipe:
+    return Recipe(id='r1', name='anode', version='1.0', targetLineType='anode', bakeDuration=bake_hours, growthDuration=0.0)
+
+
+def _sequence(*types, capacity=1):
+    return [
+        Chamber(id=f"c{i}", lineId='L1', name=t.value, type=t, maxCartCapacity=capacity)
+        for i, t in enumerate(types)
+    ]
+
+
+def test_adjacent_chambers_of_one_type_form_a_stage():
+    chambers = _sequence(ChamberType.load_lock, ChamberType.bake, ChamberType.bake, ChamberType.cleaning)
+    stages = build_stages(chambers, _recipe(12.0), extra={'cleaning': 1})
+    assert [(s.type, s.servers, s.chamber_ids) for s in stages] == [
+        (ChamberType.load_lock, 1, ['c0']),
+        (ChamberType.bake, 2, ['c1', 'c2']),
+        (ChamberType.cleaning, 2, ['c3']),
+    ]
+    assert stages[1].process == 12.0 * 3600
+
+
+def test_blocking_flow_throughput_is_set_by_slowest_stage():
+    hour = 3600.0
+    stages = [Stage(ChamberType.load_lock, 'in', 1 * hour), Stage(ChamberType.bake, 'bake', 3 * hour), Stage(ChamberType.unload, 'out', 1 * hour)]
+    for stage in stages:
+        stage.servers = 1
+    result = simulate_flow(stages, carts=100, horizon=48 * hour, handoff=0.0)
+    # 第一辆车 5 小时完工，之后每 3 小时一辆
+    assert result['completed'] == 1 + (48 - 5) // 3
+    assert result['leadTimes'][0] == 5 * hour
+    # 上游工位被瓶颈阻塞
+    assert stages[0].blocked_time > 0
+    assert result['released'] == 100
+
+
+def test_plan_sequence_reports_bottleneck_and_extra_chamber_gain():
+    chambers = _sequence(ChamberType.load_lock, ChamberType.bake, ChamberType.cleaning, ChamberType.unload)
+    base = plan_sequence(chambers, _recipe(12.0), carts=50, days=7, handoff=0.0)
+    assert base['bottleneck']['type'] == 'bake'
+    assert base['throughputPerDay'] == pytest.approx(2.0, abs=0.2)
+
+    extended = plan_sequence(chambers, _recipe(12.0), carts=50, days=7, handoff=0.0, extra_chambers={'bake': 1})
+    assert extended['throughputPerDay'] > base['throughputPerDay'] * 1.5
+    assert next(s for s in extended['stages'] if s['type'] == 'bake')['chambers'] == 2
+
+
+def test_arrival_interval_limits_release():
+    chambers = _sequence(ChamberType.load_lock, ChamberType.unload)
+    plan = plan_sequence(chambers, None, carts=1000, days=1, handoff=0.0, arrival_interval_hours=2.0)
+    assert plan['released'] == 13
+    assert plan['bottleneck'] is not None
@@ -0,0 +1,55 @@
+import asyncio
+
+from app.models import BatchStep, CommandStatus
+from app.services.command_service import CommandService
+from app.services.state_service import StateService
+
+
+def _chamber():
+    line = StateService().get_state().lines[0]
+    return line.id, line.anodeChambers[0].id
+
+
+def test_batch_from_worker_thread_respects_commands_in_flight(monkeypatch):
+    monkeypatch.setattr(CommandService, 'VALVE_STROKE_TIME', (0.05, 0.05))
+    line_id, chamber_id = _chamber()
+    step = BatchStep(kind='valve', chamberId=chamber_id, target='gate_valve', action='close')
+
+    async def scenario():
+        commands = CommandService()
+        command = commands.submit_valve(line_id, chamber_id, 'gate_valve', 'open')
+        # API 在线程池中执行批量指令
+        applied, results = await asyncio.to_thread(commands.submit_batch, [step])
+        assert not applied and results[0].status == 'failed'
+        await commands.wait_for(command.id, timeout=1.0)
+        assert command.status == CommandStatus.completed
+        applied, results = await asyncio.to_thread(commands.submit_batch, [step])
+        assert applied and results[0].status == 'ok'
+
+    asyncio.run(scenario())
+
+
+def test_failed_rollback_is_logged_and_kept_on_command(monkeypatch):
+    monkeypatch.setattr(CommandService, 'VALVE_STROKE_TIME', (0.01, 0.01))
+    line_id, chamber_id = _chamber()
+    state_service = StateService()
+    before = state_service.get_state().lines[0].anodeChambers[0].valves.foreline_valve
+
+    def broken(*args, **kwargs):
+        raise RuntimeError('bus fault')
+
+    async def scenario():
+        commands = CommandService()
+        monkeypatch.setattr(state_service, 'toggle_valve', broken)
+        monkeypatch.setattr(state_service, 'revert_valve_transition', broken)
+        command = commands.submit_valve(line_id, chamber_id, 'foreline_valve', 'open')
+        return await commands.wait_for(command.id, timeout=1.0)
+
+    command = asyncio.run(scenario())
+    assert command.status == CommandStatus.failed
+    assert command.error == 'bus fault' and command.rollbackError == 'bus fault'
+    log = state_service.get_state().systemLogs[0]
+    assert log.level == 'error' and command.id in log.content
+
+    monkeypatch.undo()
+    state_service.revert_valve_transition(chamber_id, 'foreline_valve', before)
@@ -0,0 +1,65 @@
+import pytest
+
+from app.services.ingest_aggregator import IngestAggregator
+
+
+class _History:
+    def __init__(self):
+        self.rows = []
+        self.raw = []
+
+    def record_aggregates(self, rows, raw):
+        self.rows.extend(rows)
+        self.raw.extend(raw)
+
+
+@pytest.fixture
+def aggregator():
+    history = _History()
+    aggregator = IngestAggregator(history)
+    # 与设置无关：固定 1 秒的时间桶，不抓取原始样本
+    aggregator._settings = lambda: (1.0, 0.0)
+    aggregator._interval = 1.0
+    return aggregator, history
+
+
+def test_bucket_statistics(aggregator):
+    aggregator, history = aggregator
+    aggregator.ingest_samples(['c1'] * 4, 'temperature', [10.0, 30.0, 20.0, 5.0], [100.1, 100.9, 100.5, 100.2])
+    aggregator.ingest_samples(['c2'], 'vacuum', [1e-5], [100.3])
+    assert history.rows == []
+
+    # 下一个时间桶的样本到达时结束上一个时间桶
+    aggregator.ingest_samples(['c1'], 'temperature', [50.0], [101.2])
+    rows = {(row[0], row[1]): row[2:] for row in history.rows}
+    # (桶起点, 最小, 最大, 均值, 末值, 样本数)；末值取时间最晚的样本而不是最后到达的样本
+    assert rows[('c1', 'temperature')] == (100.0, 5.0, 30.0, 16.25, 30.0, 4)
+    assert rows[('c2', 'vacuum')] == (100.0, 1e-5, 1e-5, 1e-5, 1e-5, 1)
+
+    aggregator.flush()
+    assert history.rows[-1] == ('c1', 'temperature', 101.0, 50.0, 50.0, 50.0, 50.0, 1)
+    assert aggregator.buckets == 2
+
+
+def test_late_samples_fold_into_current_bucket(aggregator):
+    aggregator, history = aggregator
+    aggregator.ingest([{'entity_id': 'c1', 'temperature': 1.0, 'vacuum': 2.0, 'timestamp': 200.5}])
+    aggregator.ingest_samples(['c1'], 'temperature', [3.0], [201.5])
+    aggregator.ingest_samples(['c1'], 'temperature', [7.0], [200.7])
+    assert aggregator.late_samples == 1
+
+    aggregator.flush()
+    rows = {(row[0], row[1], row[2]): row[3:] for row in history.rows}
+    assert rows[('c1', 'temperature', 200.0)] == (1.0, 1.0, 1.0, 1.0, 1)
+    assert rows[('c1', 'vacuum', 200.0)] == (2.0, 2.0, 2.0, 2.0, 1)
+    # 迟到的样本计入当前时间桶的统计，但不覆盖时间更晚的末值
+    assert rows[('c1', 'temperature', 201.0)] == (3.0, 7.0, 5.0, 3.0, 2)
+
+
+def test_series_capacity_grows(aggregator):
+    aggregator, history = aggregator
+    ids = [f"c{i}" for i in range(600)]
+    aggregator.ingest_samples(ids, 'temperature', [float(i) for i in range(600)], [10.0] * 600)
+    aggregator.flush()
+    assert len(history.rows) == 600
+    assert sorted(row[3] for row in history.rows) == [float(i) for i in range(600)]
@@ -0,0 +1,59 @@
+import datetime
+
+from app.models import Cart, ProcessStep
+from app.services.process_events import ProcessEventEngine
+
+START = 1_700_000_000.0
+
+
+class _Recipes:
+    revision = 0
+
+    def get_recipe(self, recipe_id):
+        return None
+
+
+def _cart(cart_id: str) -> Cart:
+    start = datetime.datetime.fromtimestamp(START).isoformat()
+    return Cart(
+        id=cart_id, number=cart_id, locationChamberId='c1', currentTask='清刷工艺',
+        steps=[
+            ProcessStep(id='s1', name='清刷工艺', status='active', startTime=start, estimatedDuration='1h'),
+            ProcessStep(id='s2', name='出样', status='pending', estimatedDuration='10m'),
+        ],
+    )
+
+
+def test_sync_rechecks_only_changed_carts():
+    engine = ProcessEventEngine()
+    recipes = _Recipes()
+    carts = [_cart('a'), _cart('b')]
+    engine.sync(carts, recipes, START, None)
+    versions = dict(engine._versions)
+
+    # 未标记的小车即使步骤变化也不重新编译；标记后才重新编译
+    carts[1].steps[0].startTime = datetime.datetime.fromtimestamp(START + 60).isoformat()
+    engine.sync(carts, recipes, START, set())
+    assert engine._versions == versions
+    engine.sync(carts, recipes, START, {'b'})
+    assert engine._versions == {'a': versions['a'], 'b': versions['b'] + 1}
+
+    # 配方修订时检查全部小车；删除的小车被移除
+    recipes.revision = 1
+    engine.sync(carts[:1], recipes, START, set())
+    assert engine._versions == {'a': versions['a'] + 1}
+
+
+def test_completed_cart_is_rechecked_after_last_step():
+    engine = ProcessEventEngine()
+    recipes = _Recipes()
+    cart = _cart('a')
+    cart.steps = cart.steps[:1]
+    engine.sync([cart], recipes, START, None)
+    engine.advance([cart], START + 3600, lambda when, content, level: None)
+    assert cart.nextTask == '已完成'
+
+    version = engine._versions['a']
+    engine.sync([cart], recipes, START + 3600, set())
+    assert engine._versions['a'] == version + 1
+    assert engine.observe(cart, START + 7200)['progress'] == 100.0
@@ -0,0 +1,40 @@
+import json
+
+from app.services.history_service import get_history_service
+from app.services.replay_service import state_digest
+from app.services.simulation_service import get_simulation_service
+from app.services.state_service import StateService
+
+
+def _event_count() -> int:
+    history = get_history_service()
+    history.flush_events()
+    return len(history.query_events(0, 2 ** 40))
+
+
+def test_replay_matches_without_side_effects():
+    sim = get_simulation_service()
+    state_service = StateService()
+    chamber = state_service.get_state().lines[0].anodeChambers[0]
+
+    sim.start_recording(seed=42)
+    sim.step(3, dt=1.0)
+    state_service.toggle_pump('line-1', chamber.id, 'roughing', 'on')
+    state_service.begin_valve_transition(chamber.id, 'vent_valve', 'open')
+    state_service.toggle_valve('line-1', chamber.id, 'vent_valve', 'open')
+    sim.step(3, dt=1.0)
+    recording = json.loads(json.dumps(sim.stop_recording()))
+
+    # 录制结束后实时时钟继续前进，回放不应把它拉回录制结束的时刻
+    sim.step(10, dt=600.0)
+    live_digest = state_digest(state_service.get_state())
+    live_offset = sim.clock.offset
+    events = _event_count()
+
+    result = sim.replay(recording)
+
+    assert result['match']
+    assert result['digest'] == recording['digest']
+    assert state_digest(state_service.get_state()) == live_digest
+    assert abs(sim.clock.offset - live_offset) < 1.0
+    assert _event_count() == events
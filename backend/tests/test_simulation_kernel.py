@@ -0,0 +1,28 @@
+import numpy as np
+
+from app.services.simulation_kernel import solve_tridiagonal
+
+
+def test_solve_tridiagonal_matches_dense_solve():
+    rng = np.random.default_rng(1)
+    batch, m = 8, 6
+    for dt in (0.1, 3600.0):
+        w = rng.uniform(0.0, 1e3, (batch, m - 1)) * dt
+        # 较短的链补零，补齐部分退化为单位行
+        w[:, 4:] = 0.0
+        diagonal = np.ones((batch, m))
+        diagonal[:, :-1] += w
+        diagonal[:, 1:] += w
+        rhs = rng.uniform(1e-6, 1e5, (batch, m))
+
+        dense = np.zeros((batch, m, m))
+        offsets = np.arange(m)
+        dense[:, offsets, offsets] = diagonal
+        dense[:, offsets[:-1], offsets[1:]] = -w
+        dense[:, offsets[1:], offsets[:-1]] = -w
+        expected = np.linalg.solve(dense, rhs[..., None])[..., 0]
+
+        solved = solve_tridiagonal(diagonal, -w, rhs)
+        np.testing.assert_allclose(solved, expected, rtol=1e-8)
+        # 均压前后总气量守恒
+        np.testing.assert_allclose(solved.sum(axis=1), rhs.sum(axis=1), rtol=1e-9)
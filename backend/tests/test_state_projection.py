@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from app.models import Cart, Chamber, ChamberType, LineData, LogEntry, ProcessStep, SystemState
+from app.services.state_projection import StateProjection
+
+
+def _state() -> SystemState:
+    def line(line_id):
+        return LineData(
+            id=line_id, name=line_id,
+            anodeChambers=[Chamber(id=f"{line_id}-a", lineId=line_id, name='烘烤仓', type=ChamberType.bake)],
+            cathodeChambers=[Chamber(id=f"{line_id}-c", lineId=line_id, name='生长仓', type=ChamberType.growth)],
+        )
+    carts = [
+        Cart(id=f"cart-{line_id}", number=line_id, locationChamberId=f"{line_id}-a", temperature=100.0,
+             steps=[ProcessStep(id='s1', name='烘烤工艺', status='active', estimatedDuration='1h')])
+        for line_id in ('L1', 'L2')
+    ]
+    log = LogEntry(id='log-1', timestamp=1.0, type='system', content='start', level='info')
+    return SystemState(lines=[line('L1'), line('L2')], carts=carts, timestamp=5.0, systemLogs=(log,))
+
+
+def test_full_projection_matches_model_dump():
+    state = _state()
+    projection = StateProjection()
+    assert projection.is_full
+    assert json.loads(projection.render(state)) == json.loads(state.model_dump_json())
+
+
+def test_line_scope_and_sections():
+    projection = StateProjection(line_id='L2', exclude='logs,mes')
+    data = json.loads(projection.render(_state()))
+    assert [line['id'] for line in data['lines']] == ['L2']
+    assert [cart['id'] for cart in data['carts']] == ['cart-L2']
+    assert 'systemLogs' not in data and 'operationLogs' not in data
+    assert 'temperature' not in data['carts'][0]
+    assert data['carts'][0]['steps'][0]['name'] == '烘烤工艺'
+
+    data = json.loads(StateProjection(include='logs').render(_state()))
+    assert data['systemLogs'][0]['content'] == 'start'
+    assert 'steps' not in data['carts'][0] and 'temperature' not in data['carts'][0]
+
+
+def test_sparse_fields():
+    projection = StateProjection(fields='timestamp,lines.id,lines.anodeChambers.temperature')
+    data = json.loads(projection.render(_state()))
+    assert data == {
+        'timestamp': 5.0,
+        'lines': [{'id': 'L1', 'anodeChambers': [{'temperature': 25.0}]}, {'id': 'L2', 'anodeChambers': [{'temperature': 25.0}]}],
+    }
+    # 父路径覆盖子路径
+    data = json.loads(StateProjection(fields='lines,lines.id').render(_state()))
+    assert data['lines'][0]['anodeChambers'][0]['id'] == 'L1-a'
+
+
+def test_invalid_projection():
+    with pytest.raises(ValueError):
+        StateProjection(include='logs,unknown')
+    with pytest.raises(ValueError):
+        StateProjection(line_id='missing').render(_state())
+    assert StateProjection(exclude='steps').key == StateProjection(include='logs,mes').key
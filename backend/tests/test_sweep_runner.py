@@ -0,0 +1,29 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.services import sweep_runner
+from app.services.sweep_runner import SweepRunner
+
+
+def test_pooled_tasks_in_flight_are_capped(monkeypatch):
+    lock = threading.Lock()
+    running = [0]
+    peak = [0]
+
+    def evaluate_group(overrides, group_points, *args):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        return [point * 10 for point in group_points]
+
+    monkeypatch.setattr(sweep_runner, 'evaluate_group', evaluate_group)
+    tasks = [({}, [f"k{i}"], [i]) for i in range(8)]
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        computed = SweepRunner._run_pooled(pool, tasks, (), limit=2)
+
+    assert peak[0] == 2
+    assert sorted(computed) == [([f"k{i}"], [i * 10]) for i in range(8)]
@@ -68,7 +68,8 @@ def test_recipe_flow():
         # state_service.state.carts = [] # Force clear for test
         # Retry
         if '已有小车' in str(e):
-             state_service.state.carts = [c for c in state_service.state.carts if c.locationChamberId != in_feed_chamber.id]
+             with state_service.mutate() as state:
+                 state.carts = [c for c in state.carts if c.locationChamberId != in_feed_chamber.id]
              cart = state_service.create_cart(
                 line_id=anode_line.id,
                 chamber_id=in_feed_chamber.id,
@@ -102,9 +103,11 @@ def test_recipe_flow():
     # So if task name has '烘烤', it should trigger logic.
     
     for _ in range(5):
-        sim_service._simulate_temperature(1.0) # 1 sec tick
+        with state_service.mutate() as state:
+            sim_service._simulate_physics(state, 1.0) # 1 sec tick
     
-    # Check chamber temp
+    # Check chamber temp (re-read the latest published generation)
+    anode_line = state_service.get_state().lines[0]
     chamber = next(c for c in anode_line.anodeChambers if c.id == in_feed_chamber.id)
     print(f"Chamber Temp after sim: {chamber.temperature:.2f} (Init 25.0)")
     